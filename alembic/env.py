@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -16,6 +17,16 @@ from app.database import SQLALCHEMY_DATABASE_URL
 config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
 # --- FIN DE LA ADICIÓN ---
 
+# --- Modo online (cambios de esquema sin parar la API, ver app/online_migrations.py) ---
+#   alembic -x online=true upgrade head
+from app.online_migrations import LOCK_TIMEOUT
+
+x_args = context.get_x_argument(as_dictionary=True)
+ONLINE_MIGRATIONS = config.attributes.get(
+    "online_migrations",
+    x_args.get("online", os.getenv("CLINICA_ONLINE_MIGRATIONS", "0")).lower() in ("1", "true", "yes")
+)
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -58,6 +69,8 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,  # Ahora usa tu metadata
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=ONLINE_MIGRATIONS,
+        online_migrations=ONLINE_MIGRATIONS,
     )
 
     with context.begin_transaction():
@@ -71,19 +84,40 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # Conexión ya abierta por quien llama (ej. app/migration_profiler.py sobre la BD scratch)
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run_migrations_with(connection)
+        return
+
+    connect_args = {}
+    if ONLINE_MIGRATIONS:
+        # Ninguna sentencia espera un bloqueo más de LOCK_TIMEOUT (las que
+        # pasan por app.online_migrations además reintentan)
+        connect_args["options"] = f"-c lock_timeout={LOCK_TIMEOUT}"
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
+        connect_args=connect_args,
     )
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata  # Ahora usa tu metadata
-        )
+        _run_migrations_with(connection)
 
-        with context.begin_transaction():
-            context.run_migrations()
+
+def _run_migrations_with(connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata,  # Ahora usa tu metadata
+        # En modo online cada migración confirma por separado: así los
+        # bloqueos no se acumulan hasta el final de todo el upgrade
+        transaction_per_migration=ONLINE_MIGRATIONS,
+        online_migrations=ONLINE_MIGRATIONS,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,37 @@
+"""M14_Indice_parcial_citas_programadas
+
+Revision ID: 34f35d8c601e
+Revises: 8c3b067fd134
+Create Date: 2026-10-19 18:41:06.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app import online_migrations
+
+
+# revision identifiers, used by Alembic.
+revision: str = '34f35d8c601e'
+down_revision: Union[str, Sequence[str], None] = '8c3b067fd134'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Debe coincidir con el filtro de /appointments/pending para que el planner use el índice
+scheduled_appointments_sql = "status = 'scheduled'"
+
+
+def upgrade() -> None:
+    # ### Índice parcial sobre las citas programadas ###
+    # /appointments/pending filtra por estado y por una cota inferior de fecha:
+    # la fecha poda las particiones antiguas y en las que quedan solo se leen
+    # las citas programadas, no el histórico de completadas.
+    print("Creando índice parcial 'ix_appointments_scheduled_appointment_date'...")
+    online_migrations.create_partitioned_index('ix_appointments_scheduled_appointment_date', 'appointments',
+                                               ['appointment_date'], where=scheduled_appointments_sql)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_appointments_scheduled_appointment_date', table_name='appointments', if_exists=True)
+    print("Downgrade completado. Índice 'ix_appointments_scheduled_appointment_date' eliminado.")
@@ -9,7 +9,8 @@ from typing import Sequence, Union
 
 from alembic import op
 import sqlalchemy as sa
-from sqlalchemy.sql import text # Necesario para ejecutar SQL
+
+from app.backfill import run_backfill
 
 
 # revision identifiers, used by Alembic.
@@ -56,15 +57,19 @@ def upgrade() -> None:
         sa.ForeignKeyConstraint(['appointment_id'], ['appointments.appointment_id'], ondelete='SET NULL'),
         sa.PrimaryKeyConstraint('invoice_id'),
         sa.UniqueConstraint('appointment_id'),
-        sa.UniqueConstraint('invoice_number')
+        sa.UniqueConstraint('invoice_number'),
+        if_not_exists=True  # Idempotente: permite reanudar el backfill si se interrumpe
     )
-    op.create_index(op.f('ix_invoices_invoice_id'), 'invoices', ['invoice_id'], unique=False)
-    op.create_index(op.f('ix_invoices_invoice_number'), 'invoices', ['invoice_number'], unique=True)
+    op.create_index(op.f('ix_invoices_invoice_id'), 'invoices', ['invoice_id'], unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_invoices_invoice_number'), 'invoices', ['invoice_number'], unique=True, if_not_exists=True)
 
     # --- MIGRACIÓN DE DATOS (Requisito Especial) ---
+    # Por lotes de appointment_id, con un COMMIT por lote (ver app/backfill.py)
     print("Generando facturas retroactivas para citas completadas...")
-    op.execute(
-        text("""
+    run_backfill(
+        name=f'{revision}_facturas_historicas',
+        table='appointments', key='appointment_id',
+        sql="""
         INSERT INTO invoices (appointment_id, invoice_number, issue_date, 
                               subtotal, tax_amount, total_amount, 
                               payment_status, payment_date)
@@ -78,11 +83,13 @@ def upgrade() -> None:
             appointments AS app
         WHERE 
             app.status = 'completed'
+            AND app.appointment_id >= :start AND app.appointment_id < :end
             AND NOT EXISTS (
                 SELECT 1 FROM invoices inv 
                 WHERE inv.appointment_id = app.appointment_id
-            );
-        """)
+            )
+        RETURNING 1
+        """
     )
 
 
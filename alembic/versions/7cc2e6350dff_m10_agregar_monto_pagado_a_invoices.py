@@ -0,0 +1,46 @@
+"""M10_Agregar_monto_pagado_a_invoices
+
+Revision ID: 7cc2e6350dff
+Revises: ee668439b2fa
+Create Date: 2026-10-19 13:22:51.804117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.backfill import run_backfill
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7cc2e6350dff'
+down_revision: Union[str, Sequence[str], None] = 'ee668439b2fa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ### Paso 1: Monto cobrado (permite pagos parciales) ###
+    # Con default constante, Postgres no reescribe la tabla al añadir la columna.
+    print("Añadiendo 'amount_paid' a 'invoices'...")
+    op.add_column('invoices', sa.Column('amount_paid', sa.Numeric(precision=10, scale=2),
+                                        nullable=False, server_default='0'), if_not_exists=True)
+
+    # ### Paso 2: Las facturas ya pagadas se cobraron completas ###
+    run_backfill(
+        name=f'{revision}_amount_paid',
+        table='invoices', key='invoice_id',
+        sql="""
+        UPDATE invoices SET amount_paid = total_amount
+        WHERE payment_status = 'paid' AND amount_paid = 0
+          AND invoice_id >= :start AND invoice_id < :end
+        RETURNING 1
+        """
+    )
+
+
+def downgrade() -> None:
+    # Los montos parciales se pierden; el estado 'partial' se conserva.
+    op.drop_column('invoices', 'amount_paid')
+    print("Downgrade completado. Columna 'amount_paid' eliminada.")
@@ -0,0 +1,37 @@
+"""M11_Indice_parcial_facturas_abiertas
+
+Revision ID: 7ef96dbec491
+Revises: 7cc2e6350dff
+Create Date: 2026-10-19 14:05:37.912640
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import online_migrations
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7ef96dbec491'
+down_revision: Union[str, Sequence[str], None] = '7cc2e6350dff'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Debe coincidir con crud.OPEN_INVOICE_STATUSES para que el planner use el índice
+open_invoices_sql = "payment_status IN ('pending', 'partial', 'overdue')"
+
+
+def upgrade() -> None:
+    # ### Índice parcial sobre las facturas abiertas ###
+    # Solo indexa lo que falta cobrar: no crece con el histórico de pagadas.
+    # Lo usan /invoices/pending y el barrido de vencidas (crud.mark_overdue_invoices).
+    print("Creando índice parcial 'ix_invoices_open_issue_date'...")
+    online_migrations.create_partitioned_index('ix_invoices_open_issue_date', 'invoices', ['issue_date'],
+                                               where=open_invoices_sql)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_invoices_open_issue_date', table_name='invoices', if_exists=True)
+    print("Downgrade completado. Índice 'ix_invoices_open_issue_date' eliminado.")
@@ -0,0 +1,78 @@
+"""M13_Notificaciones_de_cambios
+
+Revision ID: 8c3b067fd134
+Revises: b85408b81c2e
+Create Date: 2026-10-19 16:02:19.448805
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c3b067fd134'
+down_revision: Union[str, Sequence[str], None] = 'b85408b81c2e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Canal de NOTIFY (debe coincidir con app.events.CHANNEL)
+channel = 'clinica_changes'
+
+# (tabla, columna PK, columna de fecha para filtrar). El veterinario se toma de
+# la fila, salvo en invoices, que lo hereda de su cita.
+notified_tables = [
+    ('appointments', 'appointment_id', 'appointment_date'),
+    ('invoices', 'invoice_id', 'issue_date'),
+    ('vaccination_records', 'vaccination_id', 'vaccination_date'),
+]
+
+# El payload es mínimo (tabla, operación, id y campos de filtro): NOTIFY admite
+# menos de 8000 bytes, y los clientes leen la fila completa por la API si la necesitan.
+notify_change_sql = f"""
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    rec jsonb := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+    vet_id integer := (rec ->> 'veterinarian_id')::integer;
+BEGIN
+    IF current_setting('clinica.moving_partition_rows', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_ARGV[1] = 'invoices' THEN
+        SELECT veterinarian_id INTO vet_id FROM appointments
+        WHERE appointment_id = (rec ->> 'appointment_id')::integer;
+    END IF;
+    PERFORM pg_notify('{channel}', json_build_object(
+        'table', TG_ARGV[1],
+        'op', left(TG_OP, 1),
+        'id', (rec ->> TG_ARGV[0])::integer,
+        'veterinarian_id', vet_id,
+        'date', left(rec ->> TG_ARGV[2], 10),
+        'status', coalesce(rec ->> 'status', rec ->> 'payment_status')
+    )::text);
+    RETURN NULL;
+END $$;
+"""
+
+
+def upgrade() -> None:
+    # ### Triggers NOTIFY para el push de cambios (app/events.py, GET /events) ###
+    # NOTIFY se entrega al confirmar la transacción y solo en el primario.
+    print("Creando triggers de notificación de cambios...")
+    op.execute(notify_change_sql)
+    for table, pk, date_column in notified_tables:
+        op.execute(f"""
+            CREATE OR REPLACE TRIGGER {table}_notify_change
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION notify_change('{pk}', '{table}', '{date_column}')
+        """)
+
+
+def downgrade() -> None:
+    for table, _, _ in notified_tables:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_change ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS notify_change()")
+    print("Downgrade completado. Triggers de notificación eliminados.")
@@ -0,0 +1,408 @@
+"""M8_Particionar_appointments_e_invoices
+
+Revision ID: 8e8305643ba4
+Revises: bdf2a1ec7ec8
+Create Date: 2026-10-19 11:26:50.381907
+
+Requiere ventana de mantenimiento: toda la migración corre en una sola
+transacción. Desde el RENAME del paso 2 hasta el COMMIT final,
+appointments e invoices (y sus *_legacy) quedan con ACCESS EXCLUSIVE: ni
+lecturas ni escrituras de citas o facturas durante la copia completa. Los
+lotes de BATCH_SIZE solo acotan cada sentencia, no el bloqueo ni el WAL,
+que se acumula hasta el final. Hacer COMMIT por lote dejaría a la API leer
+tablas a medio copiar, así que no se hace: parar la API (o ponerla en solo
+lectura sobre una réplica) mientras dura.
+
+Límite conocido: la restricción de no solapamiento (M7) vive en cada
+partición, así que no ve solapamientos entre citas de meses distintos
+(p. ej. una de 23:45 + 30 min el último día del mes y otra a las 00:00 del
+día 1). Para esos casos solo queda la comprobación de la aplicación
+(crud.get_conflicting_appointment), que no es atómica: dos reservas
+simultáneas pueden pasarla las dos.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy.sql import text
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e8305643ba4'
+down_revision: Union[str, Sequence[str], None] = 'bdf2a1ec7ec8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Filas copiadas por sentencia al mover datos entre la tabla vieja y la nueva
+BATCH_SIZE = 5000
+
+# Meses futuros con partición ya creada (debe coincidir con crud.PARTITION_MONTHS_AHEAD)
+MONTHS_AHEAD = 3
+
+# --- Definición de columnas (igual que en M7) ---
+# Sin PK ni UNIQUE: cambian según la tabla sea particionada o no.
+appointments_columns_ddl = """
+    appointment_id integer NOT NULL DEFAULT nextval('appointments_appointment_id_seq'::regclass),
+    pet_id integer NOT NULL REFERENCES pets (pet_id),
+    veterinarian_id integer NOT NULL REFERENCES veterinarians (veterinarian_id),
+    appointment_date timestamp without time zone NOT NULL,
+    reason text,
+    status appointment_status_enum,
+    notes text,
+    created_at timestamp without time zone DEFAULT now(),
+    duration_minutes integer NOT NULL DEFAULT 30
+        CONSTRAINT ck_appointments_duration_positive CHECK (duration_minutes > 0),
+    time_slot tsrange GENERATED ALWAYS AS
+        (tsrange(appointment_date, appointment_date + duration_minutes * interval '1 minute')) STORED
+"""
+
+invoices_columns_ddl = """
+    invoice_id integer NOT NULL DEFAULT nextval('invoices_invoice_id_seq'::regclass),
+    appointment_id integer,
+    invoice_number varchar(50) NOT NULL,
+    issue_date date NOT NULL,
+    subtotal numeric(10, 2) NOT NULL,
+    tax_amount numeric(10, 2) NOT NULL,
+    total_amount numeric(10, 2) NOT NULL,
+    payment_status invoice_payment_status_enum,
+    payment_date timestamp without time zone
+"""
+
+# Columnas a copiar (sin la columna generada 'time_slot')
+appointments_copy_columns = [
+    'appointment_id', 'pet_id', 'veterinarian_id', 'appointment_date', 'reason',
+    'status', 'notes', 'created_at', 'duration_minutes'
+]
+invoices_copy_columns = [
+    'invoice_id', 'appointment_id', 'invoice_number', 'issue_date', 'subtotal',
+    'tax_amount', 'total_amount', 'payment_status', 'payment_date'
+]
+
+# Por partición: no detecta solapamientos que cruzan el cambio de mes (ver docstring)
+no_overlap_ddl = "EXCLUDE USING gist (veterinarian_id WITH =, time_slot WITH &&) WHERE (status IN ('scheduled', 'completed'))"
+
+# --- Funciones de mantenimiento de particiones ---
+partition_functions_sql = f"""
+CREATE OR REPLACE FUNCTION create_monthly_partition(parent text, month_start date)
+RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+    range_start date := date_trunc('month', month_start)::date;
+    range_end date := (date_trunc('month', month_start) + interval '1 month')::date;
+    partition_name text := format('%s_%s', parent, to_char(range_start, 'YYYY_MM'));
+    key_column text;
+    copy_columns text;
+BEGIN
+    -- Evita que dos procesos creen la misma partición a la vez
+    PERFORM pg_advisory_xact_lock(hashtext('create_monthly_partition:' || parent));
+
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    SELECT a.attname INTO key_column
+    FROM pg_partitioned_table pt
+    JOIN pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0]
+    WHERE pt.partrelid = parent::regclass;
+
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO copy_columns
+    FROM pg_attribute
+    WHERE attrelid = parent::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+
+    -- Si la partición DEFAULT ya tiene filas de ese mes, hay que sacarlas antes
+    -- de crear la partición y volver a insertarlas después. Los triggers de
+    -- integridad se desactivan durante el movimiento (no es un borrado real).
+    PERFORM set_config('clinica.moving_partition_rows', 'on', true);
+    EXECUTE format(
+        'CREATE TEMP TABLE _partition_rows ON COMMIT DROP AS SELECT %s FROM %I WHERE %I >= %L AND %I < %L',
+        copy_columns, parent || '_default', key_column, range_start, key_column, range_end
+    );
+    EXECUTE format(
+        'DELETE FROM %I WHERE %I >= %L AND %I < %L',
+        parent || '_default', key_column, range_start, key_column, range_end
+    );
+
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, parent, range_start, range_end
+    );
+    IF parent = 'appointments' THEN
+        -- PostgreSQL no admite EXCLUDE en la tabla particionada: va en cada partición
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I {no_overlap_ddl.replace("'", "''")}',
+                       partition_name, partition_name || '_no_overlap');
+    END IF;
+
+    EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM _partition_rows', parent, copy_columns, copy_columns);
+    DROP TABLE _partition_rows;
+    PERFORM set_config('clinica.moving_partition_rows', 'off', true);
+
+    RETURN partition_name;
+END $$;
+
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(parent text, months_ahead integer DEFAULT {MONTHS_AHEAD})
+RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    month date;
+    created integer := 0;
+BEGIN
+    FOR month IN
+        SELECT generate_series(date_trunc('month', current_date),
+                               date_trunc('month', current_date) + make_interval(months => months_ahead),
+                               interval '1 month')::date
+    LOOP
+        IF to_regclass(format('%s_%s', parent, to_char(month, 'YYYY_MM'))) IS NULL THEN
+            PERFORM create_monthly_partition(parent, month);
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END $$;
+"""
+
+# --- Integridad referencial hacia tablas particionadas ---
+# PostgreSQL exige que una FK apunte a un UNIQUE completo, y en una tabla
+# particionada todo UNIQUE incluye la fecha. Se reemplazan las FKs
+# medical_records/invoices -> appointments por triggers equivalentes, y la
+# unicidad global de invoices (número y cita) por la tabla 'invoice_keys'.
+integrity_triggers_sql = """
+CREATE OR REPLACE FUNCTION check_appointment_exists()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.appointment_id IS NOT NULL THEN
+        -- Mismo bloqueo que usaría una FK: impide borrar la cita mientras tanto
+        PERFORM 1 FROM appointments WHERE appointment_id = NEW.appointment_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE foreign_key_violation USING MESSAGE = format(
+                'insert or update on table "%s" violates foreign key: appointment_id=%s is not present in table "appointments"',
+                TG_TABLE_NAME, NEW.appointment_id);
+        END IF;
+    END IF;
+    RETURN NEW;
+END $$;
+
+CREATE OR REPLACE FUNCTION cascade_appointment_delete()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('clinica.moving_partition_rows', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    -- Un cambio de fecha a otro mes mueve la fila de partición (DELETE + INSERT): no es un borrado
+    IF EXISTS (SELECT 1 FROM appointments WHERE appointment_id = OLD.appointment_id) THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM medical_records WHERE appointment_id = OLD.appointment_id;   -- ON DELETE CASCADE
+    UPDATE invoices SET appointment_id = NULL WHERE appointment_id = OLD.appointment_id;  -- ON DELETE SET NULL
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION sync_invoice_keys()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('clinica.moving_partition_rows', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM invoices WHERE invoice_id = OLD.invoice_id) THEN
+            DELETE FROM invoice_keys WHERE invoice_id = OLD.invoice_id;
+        END IF;
+    ELSE
+        INSERT INTO invoice_keys (invoice_id, invoice_number, appointment_id)
+        VALUES (NEW.invoice_id, NEW.invoice_number, NEW.appointment_id)
+        ON CONFLICT (invoice_id) DO UPDATE
+        SET invoice_number = EXCLUDED.invoice_number,
+            appointment_id = EXCLUDED.appointment_id;
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER medical_records_appointment_fk
+    BEFORE INSERT OR UPDATE OF appointment_id ON medical_records
+    FOR EACH ROW EXECUTE FUNCTION check_appointment_exists();
+
+CREATE TRIGGER invoices_appointment_fk
+    BEFORE INSERT OR UPDATE OF appointment_id ON invoices
+    FOR EACH ROW EXECUTE FUNCTION check_appointment_exists();
+
+CREATE TRIGGER appointments_cascade_delete
+    AFTER DELETE ON appointments
+    FOR EACH ROW EXECUTE FUNCTION cascade_appointment_delete();
+
+CREATE TRIGGER invoices_sync_keys
+    AFTER INSERT OR UPDATE OF invoice_id, invoice_number, appointment_id OR DELETE ON invoices
+    FOR EACH ROW EXECUTE FUNCTION sync_invoice_keys();
+"""
+
+
+def _rename_indexes(table: str, suffix: str) -> None:
+    """Renombra todos los índices de 'table' para liberar sus nombres."""
+    op.execute(f"""
+        DO $$
+        DECLARE idx record;
+        BEGIN
+            FOR idx IN SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = '{table}' LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.indexname, idx.indexname || '{suffix}');
+            END LOOP;
+        END $$;
+    """)
+
+
+def _copy_in_batches(source: str, target: str, key: str, columns: list) -> None:
+    """Copia 'source' -> 'target' en rangos de 'key' de BATCH_SIZE filas.
+    Todo en la transacción de la migración: las tablas siguen bloqueadas hasta el final."""
+    bind = op.get_bind()
+    low, high = bind.execute(text(f"SELECT min({key}), max({key}) FROM {source}")).one()
+    if low is None:
+        print(f"  {source} está vacía, nada que copiar.")
+        return
+    column_list = ", ".join(columns)
+    copied = 0
+    for start in range(low, high + 1, BATCH_SIZE):
+        result = bind.execute(
+            text(f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {source} "
+                 f"WHERE {key} >= :start AND {key} < :end"),
+            {"start": start, "end": start + BATCH_SIZE}
+        )
+        copied += result.rowcount
+        print(f"  {target}: {copied} filas copiadas (hasta {key} {min(start + BATCH_SIZE - 1, high)}/{high})")
+
+
+def _create_partitions_for(source: str, parent: str, key: str) -> None:
+    """Crea las particiones mensuales que cubren los datos de 'source' y los próximos meses."""
+    op.execute(f"""
+        SELECT create_monthly_partition('{parent}', month::date)
+        FROM generate_series(
+            date_trunc('month', coalesce((SELECT min({key}) FROM {source}), current_date)),
+            greatest(date_trunc('month', coalesce((SELECT max({key}) FROM {source}), current_date)),
+                     date_trunc('month', current_date) + interval '{MONTHS_AHEAD} months'),
+            interval '1 month'
+        ) AS month
+    """)
+
+
+def upgrade() -> None:
+    # ### Paso 1: Quitar las FKs que apuntan a appointments (se reemplazan por triggers) ###
+    op.execute("ALTER TABLE medical_records DROP CONSTRAINT IF EXISTS medical_records_appointment_id_fkey")
+    op.execute("ALTER TABLE invoices DROP CONSTRAINT IF EXISTS invoices_appointment_id_fkey")
+
+    # ### Paso 2: Apartar las tablas actuales ###
+    print("Renombrando 'appointments' e 'invoices' a *_legacy...")
+    for table in ('appointments', 'invoices'):
+        _rename_indexes(table, '_legacy')
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+
+    # ### Paso 3: Crear las tablas particionadas por mes ###
+    print("Creando tablas particionadas...")
+    op.execute(f"""
+        CREATE TABLE appointments (
+            {appointments_columns_ddl},
+            CONSTRAINT appointments_pkey PRIMARY KEY (appointment_id, appointment_date)
+        ) PARTITION BY RANGE (appointment_date)
+    """)
+    op.execute("CREATE INDEX ix_appointments_appointment_id ON appointments (appointment_id)")
+    op.execute("CREATE INDEX ix_appointments_appointment_date ON appointments (appointment_date)")
+    op.execute("CREATE INDEX ix_appointments_veterinarian_id_appointment_date ON appointments (veterinarian_id, appointment_date)")
+    op.execute("CREATE INDEX ix_appointments_pet_id ON appointments (pet_id)")
+    op.execute("CREATE TABLE appointments_default PARTITION OF appointments DEFAULT")
+    op.execute(f"ALTER TABLE appointments_default ADD CONSTRAINT appointments_default_no_overlap {no_overlap_ddl}")
+
+    op.execute(f"""
+        CREATE TABLE invoices (
+            {invoices_columns_ddl},
+            CONSTRAINT invoices_pkey PRIMARY KEY (invoice_id, issue_date)
+        ) PARTITION BY RANGE (issue_date)
+    """)
+    op.execute("CREATE INDEX ix_invoices_invoice_id ON invoices (invoice_id)")
+    op.execute("CREATE INDEX ix_invoices_invoice_number ON invoices (invoice_number)")
+    op.execute("CREATE INDEX ix_invoices_appointment_id ON invoices (appointment_id)")
+    op.execute("CREATE INDEX ix_invoices_issue_date ON invoices (issue_date)")
+    op.execute("CREATE TABLE invoices_default PARTITION OF invoices DEFAULT")
+
+    op.execute(partition_functions_sql)
+    _create_partitions_for('appointments_legacy', 'appointments', 'appointment_date')
+    _create_partitions_for('invoices_legacy', 'invoices', 'issue_date')
+
+    # ### Paso 4: Mover los datos por lotes ###
+    print("Copiando datos a las tablas particionadas...")
+    _copy_in_batches('appointments_legacy', 'appointments', 'appointment_id', appointments_copy_columns)
+    _copy_in_batches('invoices_legacy', 'invoices', 'invoice_id', invoices_copy_columns)
+
+    # Las secuencias pasan a pertenecer a las nuevas columnas antes de borrar las viejas
+    op.execute("ALTER SEQUENCE appointments_appointment_id_seq OWNED BY appointments.appointment_id")
+    op.execute("ALTER SEQUENCE invoices_invoice_id_seq OWNED BY invoices.invoice_id")
+    op.execute("DROP TABLE appointments_legacy")
+    op.execute("DROP TABLE invoices_legacy")
+
+    # ### Paso 5: Unicidad global de invoices e integridad referencial ###
+    op.execute("""
+        CREATE TABLE invoice_keys (
+            invoice_id integer PRIMARY KEY,
+            invoice_number varchar(50) NOT NULL UNIQUE,
+            appointment_id integer UNIQUE
+        )
+    """)
+    op.execute("INSERT INTO invoice_keys SELECT invoice_id, invoice_number, appointment_id FROM invoices")
+    op.execute(integrity_triggers_sql)
+    print("Particionado completado.")
+
+
+def downgrade() -> None:
+    # ### Paso 1: Quitar triggers, funciones y la tabla de claves ###
+    op.execute("DROP TRIGGER IF EXISTS medical_records_appointment_fk ON medical_records")
+    op.execute("DROP TRIGGER IF EXISTS invoices_appointment_fk ON invoices")
+    op.execute("DROP TRIGGER IF EXISTS appointments_cascade_delete ON appointments")
+    op.execute("DROP TRIGGER IF EXISTS invoices_sync_keys ON invoices")
+    op.execute("DROP FUNCTION IF EXISTS check_appointment_exists()")
+    op.execute("DROP FUNCTION IF EXISTS cascade_appointment_delete()")
+    op.execute("DROP FUNCTION IF EXISTS sync_invoice_keys()")
+    op.execute("DROP TABLE IF EXISTS invoice_keys")
+
+    # ### Paso 2: Apartar las tablas particionadas ###
+    print("Renombrando tablas particionadas a *_partitioned...")
+    for table in ('appointments', 'invoices'):
+        _rename_indexes(table, '_partitioned')
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_partitioned")
+
+    # ### Paso 3: Recrear las tablas simples (estado M7) ###
+    op.execute(f"""
+        CREATE TABLE appointments (
+            {appointments_columns_ddl},
+            CONSTRAINT appointments_pkey PRIMARY KEY (appointment_id),
+            CONSTRAINT appointments_no_overlap {no_overlap_ddl}
+        )
+    """)
+    op.execute("CREATE INDEX ix_appointments_appointment_id ON appointments (appointment_id)")
+    op.execute("CREATE INDEX ix_appointments_veterinarian_id_appointment_date ON appointments (veterinarian_id, appointment_date)")
+    op.execute("CREATE INDEX ix_appointments_pet_id ON appointments (pet_id)")
+
+    op.execute(f"""
+        CREATE TABLE invoices (
+            {invoices_columns_ddl},
+            CONSTRAINT invoices_pkey PRIMARY KEY (invoice_id),
+            CONSTRAINT invoices_appointment_id_key UNIQUE (appointment_id),
+            CONSTRAINT invoices_invoice_number_key UNIQUE (invoice_number)
+        )
+    """)
+    op.execute("CREATE INDEX ix_invoices_invoice_id ON invoices (invoice_id)")
+    op.execute("CREATE UNIQUE INDEX ix_invoices_invoice_number ON invoices (invoice_number)")
+
+    # ### Paso 4: Copiar datos por lotes y borrar las particionadas ###
+    print("Copiando datos a las tablas simples...")
+    _copy_in_batches('appointments_partitioned', 'appointments', 'appointment_id', appointments_copy_columns)
+    _copy_in_batches('invoices_partitioned', 'invoices', 'invoice_id', invoices_copy_columns)
+
+    op.execute("ALTER SEQUENCE appointments_appointment_id_seq OWNED BY appointments.appointment_id")
+    op.execute("ALTER SEQUENCE invoices_invoice_id_seq OWNED BY invoices.invoice_id")
+    op.execute("DROP TABLE appointments_partitioned CASCADE")
+    op.execute("DROP TABLE invoices_partitioned CASCADE")
+    op.execute("DROP FUNCTION IF EXISTS ensure_monthly_partitions(text, integer)")
+    op.execute("DROP FUNCTION IF EXISTS create_monthly_partition(text, date)")
+
+    # ### Paso 5: Restaurar las FKs originales ###
+    op.create_foreign_key('medical_records_appointment_id_fkey', 'medical_records', 'appointments',
+                          ['appointment_id'], ['appointment_id'], ondelete='CASCADE')
+    op.create_foreign_key('invoices_appointment_id_fkey', 'invoices', 'appointments',
+                          ['appointment_id'], ['appointment_id'], ondelete='SET NULL')
+    print("Downgrade completado. 'appointments' e 'invoices' vuelven a ser tablas simples.")
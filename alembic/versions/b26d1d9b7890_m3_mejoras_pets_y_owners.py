@@ -10,6 +10,9 @@ from typing import Sequence, Union
 from alembic import op
 import sqlalchemy as sa
 
+from app import online_migrations
+from app.backfill import run_backfill, table_exists
+
 
 # revision identifiers, used by Alembic.
 revision: str = 'b26d1d9b7890'
@@ -32,53 +35,69 @@ def upgrade() -> None:
     payment_method_enum.create(op.get_bind(), checkfirst=True)
     
     # 2. Añadir las nuevas columnas a 'owners'
-    op.add_column('owners', sa.Column('emergency_contact', sa.String(length=50), nullable=True))
-    op.add_column('owners', sa.Column('preferred_payment_method', payment_method_enum, nullable=True))
+    # (if_not_exists: los backfills confirman lo anterior, así la migración se puede relanzar)
+    op.add_column('owners', sa.Column('emergency_contact', sa.String(length=50), nullable=True), if_not_exists=True)
+    op.add_column('owners', sa.Column('preferred_payment_method', payment_method_enum, nullable=True), if_not_exists=True)
 
     # --- PETS ---
     # 3. Añadir las nuevas columnas a 'pets'
-    op.add_column('pets', sa.Column('microchip_number', sa.String(length=50), nullable=True))
-    op.add_column('pets', sa.Column('is_neutered', sa.Boolean(), nullable=True))
-    op.add_column('pets', sa.Column('blood_type', sa.String(length=10), nullable=True))
+    op.add_column('pets', sa.Column('microchip_number', sa.String(length=50), nullable=True), if_not_exists=True)
+    op.add_column('pets', sa.Column('is_neutered', sa.Boolean(), nullable=True), if_not_exists=True)
+    op.add_column('pets', sa.Column('blood_type', sa.String(length=10), nullable=True), if_not_exists=True)
     
-    # 4. Establecer valores por defecto para filas existentes
-    op.execute("UPDATE pets SET is_neutered = FALSE WHERE is_neutered IS NULL")
+    # 4. Establecer valores por defecto para filas existentes (por lotes, ver app/backfill.py)
+    run_backfill(
+        name=f'{revision}_is_neutered_default',
+        table='pets', key='pet_id',
+        sql="""
+        UPDATE pets SET is_neutered = FALSE
+        WHERE is_neutered IS NULL AND pet_id >= :start AND pet_id < :end
+        RETURNING 1
+        """
+    )
     # Cambiamos la columna para que no sea nullable en el futuro, pero primero asignamos default
-    op.alter_column('pets', 'is_neutered', nullable=False, server_default='false')
+    online_migrations.set_not_null('pets', 'is_neutered', server_default='false')
     
     # 5. Crear el índice único para microchip
-    op.create_index(op.f('ix_pets_microchip_number'), 'pets', ['microchip_number'], unique=True)
+    online_migrations.create_index(op.f('ix_pets_microchip_number'), 'pets', ['microchip_number'], unique=True, if_not_exists=True)
     
     # ### Lógica Manual de Restauración (si venimos de un downgrade) ###
     
-    # 6. Intentar restaurar datos desde las tablas de backup (si existen)
-    op.execute(f"""
-        DO $$
-        BEGIN
-           IF EXISTS (SELECT FROM information_schema.tables WHERE table_name = '{owners_backup_table}') THEN
-              UPDATE owners o
-              SET 
-                emergency_contact = b.emergency_contact,
-                preferred_payment_method = b.preferred_payment_method::payment_method_enum
-              FROM {owners_backup_table} b
-              WHERE o.owner_id = b.owner_id;
-              
-              DROP TABLE {owners_backup_table};
-           END IF;
-           
-           IF EXISTS (SELECT FROM information_schema.tables WHERE table_name = '{pets_backup_table}') THEN
-              UPDATE pets p
-              SET 
-                microchip_number = b.microchip_number,
-                is_neutered = b.is_neutered,
-                blood_type = b.blood_type
-              FROM {pets_backup_table} b
-              WHERE p.pet_id = b.pet_id;
-              
-              DROP TABLE {pets_backup_table};
-           END IF;
-        END $$;
-    """)
+    # 6. Intentar restaurar datos desde las tablas de backup (si existen), por lotes
+    if table_exists(owners_backup_table):
+        run_backfill(
+            name=f'{revision}_restaurar_owners',
+            table='owners', key='owner_id',
+            sql=f"""
+            UPDATE owners o
+            SET 
+              emergency_contact = b.emergency_contact,
+              preferred_payment_method = b.preferred_payment_method::payment_method_enum
+            FROM {owners_backup_table} b
+            WHERE o.owner_id = b.owner_id
+              AND o.owner_id >= :start AND o.owner_id < :end
+            RETURNING 1
+            """
+        )
+        op.execute(f"DROP TABLE {owners_backup_table}")
+
+    if table_exists(pets_backup_table):
+        run_backfill(
+            name=f'{revision}_restaurar_pets',
+            table='pets', key='pet_id',
+            sql=f"""
+            UPDATE pets p
+            SET 
+              microchip_number = b.microchip_number,
+              is_neutered = b.is_neutered,
+              blood_type = b.blood_type
+            FROM {pets_backup_table} b
+            WHERE p.pet_id = b.pet_id
+              AND p.pet_id >= :start AND p.pet_id < :end
+            RETURNING 1
+            """
+        )
+        op.execute(f"DROP TABLE {pets_backup_table}")
     # ### end Alembic commands ###
 
 
@@ -0,0 +1,88 @@
+"""M12_Registro_de_cambios
+
+Revision ID: b85408b81c2e
+Revises: 7ef96dbec491
+Create Date: 2026-10-19 15:12:44.067391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b85408b81c2e'
+down_revision: Union[str, Sequence[str], None] = '7ef96dbec491'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tablas cuyos cambios se publican en /changes: (tabla, columna PK)
+# (deben coincidir con crud.CHANGE_FEED_TABLES)
+change_feed_tables = [
+    ('owners', 'owner_id'),
+    ('pets', 'pet_id'),
+    ('appointments', 'appointment_id'),
+    ('invoices', 'invoice_id'),
+]
+
+# Cada fila guarda el id de la transacción que la escribió: el endpoint solo
+# entrega filas de transacciones anteriores al xmin del snapshot (todas
+# confirmadas o abortadas), ordenadas por (txid, seq). Así una transacción
+# lenta que confirma tarde no queda detrás del cursor de un cliente.
+log_change_sql = """
+CREATE OR REPLACE FUNCTION log_change()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- Mover filas entre particiones (M8) no es un cambio de datos
+    IF current_setting('clinica.moving_partition_rows', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO change_log (txid, table_name, row_id, op)
+    VALUES (
+        pg_current_xact_id()::text::bigint,
+        TG_ARGV[1], -- no TG_TABLE_NAME: en tablas particionadas sería el nombre de la partición
+        (to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END) ->> TG_ARGV[0])::integer,
+        left(TG_OP, 1)
+    );
+    RETURN NULL;
+END $$;
+"""
+
+
+def upgrade() -> None:
+    # ### Paso 1: Tabla de cambios (append-only) ###
+    print("Creando tabla 'change_log'...")
+    op.create_table('change_log',
+        sa.Column('seq', sa.BigInteger(), sa.Identity(always=True), nullable=False),
+        sa.Column('txid', sa.BigInteger(), nullable=False),
+        sa.Column('table_name', sa.String(length=63), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('op', sa.CHAR(length=1), nullable=False), # I / U / D
+        sa.Column('changed_at', sa.TIMESTAMP(), server_default=sa.text('clock_timestamp()'), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+        if_not_exists=True
+    )
+    op.create_index('ix_change_log_txid_seq', 'change_log', ['txid', 'seq'], unique=False, if_not_exists=True)
+    # BRIN: la tabla solo crece en el tiempo; sirve para la purga por fecha y apenas ocupa
+    op.create_index('ix_change_log_changed_at', 'change_log', ['changed_at'], unique=False,
+                    postgresql_using='brin', if_not_exists=True)
+
+    # ### Paso 2: Triggers en las tablas publicadas ###
+    print("Creando triggers de registro de cambios...")
+    op.execute(log_change_sql)
+    for table, pk in change_feed_tables:
+        op.execute(f"""
+            CREATE OR REPLACE TRIGGER {table}_log_change
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION log_change('{pk}', '{table}')
+        """)
+
+
+def downgrade() -> None:
+    for table, _ in change_feed_tables:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_log_change ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS log_change()")
+    op.drop_table('change_log')
+    print("Downgrade completado. Tabla 'change_log' y sus triggers eliminados.")
@@ -10,7 +10,9 @@ from typing import Sequence, Union
 from alembic import op
 import sqlalchemy as sa
 from sqlalchemy.dialects import postgresql
-from sqlalchemy.sql import text
+
+from app import online_migrations
+from app.backfill import run_backfill, table_exists
 
 # revision identifiers, used by Alembic.
 revision: str = 'b9d925015eb2'
@@ -27,113 +29,124 @@ def upgrade() -> None:
     # ### Paso 1: Añadir las nuevas columnas (auto-generado) ###
     
     # --- Columnas de PETS ---
-    op.add_column('pets', sa.Column('last_visit_date', sa.Date(), nullable=True))
+    op.add_column('pets', sa.Column('last_visit_date', sa.Date(), nullable=True), if_not_exists=True)
     # Añadimos la columna como nullable=True primero, la poblamos, y luego la hacemos non-nullable
-    op.add_column('pets', sa.Column('visit_count', sa.Integer(), nullable=True)) 
+    op.add_column('pets', sa.Column('visit_count', sa.Integer(), nullable=True), if_not_exists=True)
 
     # --- Columnas de VETERINARIANS ---
-    op.add_column('veterinarians', sa.Column('consultation_fee', sa.Numeric(precision=8, scale=2), nullable=True))
-    op.add_column('veterinarians', sa.Column('rating', sa.Numeric(precision=3, scale=2), nullable=True))
+    op.add_column('veterinarians', sa.Column('consultation_fee', sa.Numeric(precision=8, scale=2), nullable=True), if_not_exists=True)
+    op.add_column('veterinarians', sa.Column('rating', sa.Numeric(precision=3, scale=2), nullable=True), if_not_exists=True)
     # Añadimos la columna como nullable=True primero
-    op.add_column('veterinarians', sa.Column('total_appointments', sa.Integer(), nullable=True))
+    op.add_column('veterinarians', sa.Column('total_appointments', sa.Integer(), nullable=True), if_not_exists=True)
 
     # ### Paso 2: Migración de Datos Históricos (Requisito Especial) ###
+    # Por lotes de clave, con un COMMIT por lote (ver app/backfill.py).
+    # Las columnas nuevas quedan confirmadas antes del primer lote; por eso los
+    # add_column llevan if_not_exists=True (la migración se puede relanzar y reanudar).
     
     print("Calculando y poblando métricas históricas...")
 
-    # 1. Poner defaults (0) para todos, antes de calcular
-    op.execute("UPDATE pets SET visit_count = 0 WHERE visit_count IS NULL")
-    op.execute("UPDATE veterinarians SET total_appointments = 0 WHERE total_appointments IS NULL")
-
-    # 2. Calcular 'visit_count' y 'last_visit_date' para Pets
-    # Usamos solo citas 'completadas' como "visitas"
-    op.execute(
-        text("""
-        WITH pet_stats AS (
-            SELECT 
-                pet_id,
-                COUNT(appointment_id) AS total_visits,
-                MAX(appointment_date::date) AS last_visit
-            FROM 
-                appointments
-            WHERE 
-                status = 'completed'
-            GROUP BY 
-                pet_id
-        )
+    # 1. Calcular 'visit_count' y 'last_visit_date' para Pets
+    # Usamos solo citas 'completadas' como "visitas"; las mascotas sin visitas quedan en 0.
+    run_backfill(
+        name=f'{revision}_pet_stats',
+        table='pets', key='pet_id',
+        sql="""
         UPDATE pets p
         SET
             visit_count = ps.total_visits,
             last_visit_date = ps.last_visit
-        FROM 
-            pet_stats ps
-        WHERE 
-            p.pet_id = ps.pet_id;
-        """)
-    )
-    
-    # 3. Calcular 'total_appointments' para Veterinarians
-    # Contamos *todas* las citas (incluyendo canceladas, etc.)
-    op.execute(
-        text("""
-        WITH vet_stats AS (
+        FROM (
             SELECT 
-                veterinarian_id,
-                COUNT(appointment_id) AS total_appts
+                pp.pet_id,
+                COUNT(a.appointment_id) AS total_visits,
+                MAX(a.appointment_date::date) AS last_visit
             FROM 
-                appointments
+                pets pp
+                LEFT JOIN appointments a ON a.pet_id = pp.pet_id AND a.status = 'completed'
+            WHERE 
+                pp.pet_id >= :start AND pp.pet_id < :end
             GROUP BY 
-                veterinarian_id
-        )
+                pp.pet_id
+        ) ps
+        WHERE 
+            p.pet_id = ps.pet_id
+        RETURNING 1
+        """
+    )
+    
+    # 2. Calcular 'total_appointments' para Veterinarians
+    # Contamos *todas* las citas (incluyendo canceladas, etc.); sin citas queda en 0.
+    run_backfill(
+        name=f'{revision}_vet_stats',
+        table='veterinarians', key='veterinarian_id',
+        sql="""
         UPDATE veterinarians v
         SET
             total_appointments = vs.total_appts
-        FROM 
-            vet_stats vs
+        FROM (
+            SELECT 
+                vv.veterinarian_id,
+                COUNT(a.appointment_id) AS total_appts
+            FROM 
+                veterinarians vv
+                LEFT JOIN appointments a ON a.veterinarian_id = vv.veterinarian_id
+            WHERE 
+                vv.veterinarian_id >= :start AND vv.veterinarian_id < :end
+            GROUP BY 
+                vv.veterinarian_id
+        ) vs
         WHERE 
-            v.veterinarian_id = vs.veterinarian_id;
-        """)
+            v.veterinarian_id = vs.veterinarian_id
+        RETURNING 1
+        """
     )
 
     # ### Paso 3: Alterar columnas a NOT NULL (como en el modelo) ###
-    op.alter_column('pets', 'visit_count',
+    # (en modo online, sin bloquear la tabla mientras se valida; ver app/online_migrations.py)
+    online_migrations.set_not_null('pets', 'visit_count',
                existing_type=sa.INTEGER(),
-               nullable=False,
                server_default='0') # Establecer default para futuras inserciones
                
-    op.alter_column('veterinarians', 'total_appointments',
+    online_migrations.set_not_null('veterinarians', 'total_appointments',
                existing_type=sa.INTEGER(),
-               nullable=False,
                server_default='0') # Establecer default para futuras inserciones
 
     # ### Paso 4: Lógica de Restauración (si venimos de un downgrade) ###
-    op.execute(f"""
-        DO $$
-        BEGIN
-           IF EXISTS (SELECT FROM information_schema.tables WHERE table_name = '{vets_backup_table}') THEN
-              UPDATE veterinarians v
-              SET 
-                consultation_fee = b.consultation_fee,
-                rating = b.rating,
-                total_appointments = b.total_appointments
-              FROM {vets_backup_table} b
-              WHERE v.veterinarian_id = b.veterinarian_id;
-              
-              DROP TABLE {vets_backup_table};
-           END IF;
-           
-           IF EXISTS (SELECT FROM information_schema.tables WHERE table_name = '{pets_backup_table}') THEN
-              UPDATE pets p
-              SET 
-                last_visit_date = b.last_visit_date,
-                visit_count = b.visit_count
-              FROM {pets_backup_table} b
-              WHERE p.pet_id = b.pet_id;
-              
-              DROP TABLE {pets_backup_table};
-           END IF;
-        END $$;
-    """)
+    if table_exists(vets_backup_table):
+        run_backfill(
+            name=f'{revision}_restaurar_vets',
+            table='veterinarians', key='veterinarian_id',
+            sql=f"""
+            UPDATE veterinarians v
+            SET 
+              consultation_fee = b.consultation_fee,
+              rating = b.rating,
+              total_appointments = b.total_appointments
+            FROM {vets_backup_table} b
+            WHERE v.veterinarian_id = b.veterinarian_id
+              AND v.veterinarian_id >= :start AND v.veterinarian_id < :end
+            RETURNING 1
+            """
+        )
+        op.execute(f"DROP TABLE {vets_backup_table}")
+
+    if table_exists(pets_backup_table):
+        run_backfill(
+            name=f'{revision}_restaurar_pets',
+            table='pets', key='pet_id',
+            sql=f"""
+            UPDATE pets p
+            SET 
+              last_visit_date = b.last_visit_date,
+              visit_count = b.visit_count
+            FROM {pets_backup_table} b
+            WHERE p.pet_id = b.pet_id
+              AND p.pet_id >= :start AND p.pet_id < :end
+            RETURNING 1
+            """
+        )
+        op.execute(f"DROP TABLE {pets_backup_table}")
 
 def downgrade() -> None:
     # ### Requisito especial: Backup de datos ###
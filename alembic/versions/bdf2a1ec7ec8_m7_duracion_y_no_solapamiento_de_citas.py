@@ -0,0 +1,79 @@
+"""M7_Duracion_y_no_solapamiento_de_citas
+
+Revision ID: bdf2a1ec7ec8
+Revises: ffa2ddee5702
+Create Date: 2026-10-19 10:03:17.554102
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import text
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bdf2a1ec7ec8'
+down_revision: Union[str, Sequence[str], None] = 'ffa2ddee5702'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Estados que ocupan la agenda del veterinario (deben coincidir con crud.BUSY_APPOINTMENT_STATUSES)
+busy_statuses_sql = "status IN ('scheduled', 'completed')"
+
+time_slot_expression = "tsrange(appointment_date, appointment_date + duration_minutes * interval '1 minute')"
+
+
+def upgrade() -> None:
+    # ### Paso 1: Duración de la cita (30 min por defecto para las existentes) ###
+    print("Añadiendo 'duration_minutes' y 'time_slot' a 'appointments'...")
+    op.add_column('appointments', sa.Column('duration_minutes', sa.Integer(), nullable=False, server_default='30'))
+    op.create_check_constraint('ck_appointments_duration_positive', 'appointments', 'duration_minutes > 0')
+
+    # ### Paso 2: Rango de tiempo como columna generada ###
+    op.add_column('appointments', sa.Column(
+        'time_slot',
+        postgresql.TSRANGE(),
+        sa.Computed(time_slot_expression, persisted=True),
+        nullable=True
+    ))
+
+    # ### Paso 3: Verificar que no haya solapamientos previos ###
+    # Si los hay, el EXCLUDE fallaría con un error poco claro; mejor avisar con los ids.
+    conflicts = op.get_bind().execute(text(f"""
+        SELECT a.appointment_id, b.appointment_id
+        FROM appointments a
+        JOIN appointments b
+          ON a.veterinarian_id = b.veterinarian_id
+         AND a.appointment_id < b.appointment_id
+         AND a.time_slot && b.time_slot
+        WHERE a.{busy_statuses_sql} AND b.{busy_statuses_sql}
+        LIMIT 20
+    """)).fetchall()
+    if conflicts:
+        pairs = ", ".join(f"{a}/{b}" for a, b in conflicts)
+        raise RuntimeError(
+            "Existen citas solapadas para un mismo veterinario (ids: "
+            f"{pairs}). Reprogramarlas o cancelarlas antes de aplicar esta migración."
+        )
+
+    # ### Paso 4: Restricción de exclusión (GiST) ###
+    # btree_gist permite combinar '=' sobre el entero con '&&' sobre el rango.
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.execute(f"""
+        ALTER TABLE appointments
+        ADD CONSTRAINT appointments_no_overlap
+        EXCLUDE USING gist (veterinarian_id WITH =, time_slot WITH &&)
+        WHERE ({busy_statuses_sql})
+    """)
+
+
+def downgrade() -> None:
+    # La duración se pierde al bajar (v1.0 no la tiene); el rango es derivado.
+    op.execute("ALTER TABLE appointments DROP CONSTRAINT IF EXISTS appointments_no_overlap")
+    op.drop_column('appointments', 'time_slot')
+    op.drop_constraint('ck_appointments_duration_positive', 'appointments', type_='check')
+    op.drop_column('appointments', 'duration_minutes')
+    # La extensión btree_gist se deja instalada: puede estar en uso por otros objetos.
+    print("Downgrade completado. Columnas 'duration_minutes' y 'time_slot' eliminadas.")
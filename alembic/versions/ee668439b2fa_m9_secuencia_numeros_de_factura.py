@@ -0,0 +1,33 @@
+"""M9_Secuencia_numeros_de_factura
+
+Revision ID: ee668439b2fa
+Revises: 8e8305643ba4
+Create Date: 2026-10-19 12:41:06.318275
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ee668439b2fa'
+down_revision: Union[str, Sequence[str], None] = '8e8305643ba4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ### Secuencia para numerar las facturas nuevas ###
+    # La facturación por lotes (crud.generate_pending_invoices) toma el número con
+    # nextval() dentro del INSERT ... SELECT: sin carreras entre procesos y sin
+    # consultar el último número emitido. Las facturas históricas de M4 usan el
+    # prefijo 'INV-HIST-', así que no pueden chocar con 'INV-AAAA-NNNNNNNN'.
+    print("Creando secuencia 'invoice_number_seq'...")
+    op.execute(sa.schema.CreateSequence(sa.Sequence('invoice_number_seq'), if_not_exists=True))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('invoice_number_seq'), if_exists=True))
+    print("Downgrade completado. Secuencia 'invoice_number_seq' eliminada.")
@@ -0,0 +1,63 @@
+"""M6_Busqueda_full_text_medical_records
+
+Revision ID: ffa2ddee5702
+Revises: b9d925015eb2
+Create Date: 2026-10-19 09:12:41.220413
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app import online_migrations
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ffa2ddee5702'
+down_revision: Union[str, Sequence[str], None] = 'b9d925015eb2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# --- Expresión del vector de búsqueda ---
+# Debe coincidir con models.MedicalRecord.search_vector y con crud.FTS_CONFIG.
+# Pesos: diagnóstico (A) > tratamiento (B) > receta (C), para que ts_rank
+# priorice las coincidencias en el diagnóstico.
+search_vector_expression = (
+    "setweight(to_tsvector('spanish', coalesce(diagnosis, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(treatment, '')), 'B') || "
+    "setweight(to_tsvector('spanish', coalesce(prescription, '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    # --- Columna generada (STORED) ---
+    # PostgreSQL la recalcula en cada INSERT/UPDATE, así que no hace falta
+    # poblarla a mano: el ADD COLUMN ya la calcula para las filas existentes.
+    print("Añadiendo columna 'search_vector' a 'medical_records'...")
+    op.add_column('medical_records', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(search_vector_expression, persisted=True),
+        nullable=True
+    ))
+
+    # --- Índice GIN para las búsquedas @@ ---
+    online_migrations.create_index('ix_medical_records_search_vector', 'medical_records', ['search_vector'],
+                                   unique=False, postgresql_using='gin')
+
+    # --- Índices de apoyo para los filtros del endpoint de búsqueda ---
+    # (filtro por veterinario + rango de fechas, y el join por mascota)
+    online_migrations.create_index('ix_appointments_veterinarian_id_appointment_date', 'appointments',
+                                   ['veterinarian_id', 'appointment_date'], unique=False)
+    online_migrations.create_index('ix_appointments_pet_id', 'appointments', ['pet_id'], unique=False)
+
+
+def downgrade() -> None:
+    # La columna es derivada (se recalcula al volver a subir), no hace falta backup.
+    op.drop_index('ix_appointments_pet_id', table_name='appointments')
+    op.drop_index('ix_appointments_veterinarian_id_appointment_date', table_name='appointments')
+    op.drop_index('ix_medical_records_search_vector', table_name='medical_records')
+    op.drop_column('medical_records', 'search_vector')
+    print("Downgrade completado. Columna 'search_vector' eliminada.")
@@ -0,0 +1,155 @@
+"""
+Control de admisión por clase de ruta.
+
+Cada clase (recepción, reportes, exportaciones, procesos masivos) tiene su
+propio límite de peticiones concurrentes y de cola. Así unos pocos reportes
+o exportaciones pesados no agotan el pool de conexiones ni el threadpool y
+las operaciones de recepción mantienen su latencia.
+
+- Si la clase está al límite, la petición espera en cola hasta MAX_WAIT.
+- Si la cola está llena, o la espera se agota, se responde al instante
+  503 con Retry-After (load shedding) en vez de acumular trabajo.
+- /events (SSE, tiene su propio límite en app/events.py), /metrics y
+  /debug quedan fuera.
+
+Los límites son por worker; se pueden cambiar con variables de entorno:
+CLINICA_ADMISSION_<CLASE>=<concurrencia>,<cola>  (ej. CLINICA_ADMISSION_REPORTS=2,4)
+"""
+import asyncio
+import json
+import os
+import time
+
+# clase -> (concurrencia, cola máxima, espera máxima en cola en segundos, Retry-After)
+ROUTE_CLASSES = {
+    "frontdesk": (32, 64, 2.0, 1),
+    "reports": (4, 8, 5.0, 5),
+    "exports": (2, 2, 1.0, 30),
+    "bulk": (2, 4, 1.0, 30),
+}
+
+EXEMPT_PREFIXES = ("/events", "/metrics", "/debug/", "/docs", "/openapi.json", "/redoc")
+BULK_ROUTES = (
+    ("POST", "/invoices/generate"),
+    ("POST", "/invoices/mark-overdue"),
+    ("POST", "/invoices/pay-batch"),
+    ("POST", "/invoices/pay-batch/upload"),
+)
+
+
+def classify(method: str, path: str):
+    """Clase de la ruta, o None si no pasa por el control de admisión."""
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if path.startswith("/reports/"):
+        return "reports"
+    if path.startswith("/exports/"):
+        return "exports"
+    if (method, path.rstrip("/")) in BULK_ROUTES:
+        return "bulk"
+    return "frontdesk"
+
+
+class RouteClassLimiter:
+    """Semáforo con cola acotada y métricas de espera y rechazos."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait: float, retry_after: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def acquire(self) -> bool:
+        """True si la petición entra; False si se descarta."""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.shed += 1
+            return False
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - started
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.admitted += 1
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "queue_wait_avg_ms": round(self.wait_seconds_total / self.admitted * 1000, 3) if self.admitted else 0.0,
+            "queue_wait_max_ms": round(self.wait_seconds_max * 1000, 3),
+        }
+
+
+def _limits(name: str, defaults: tuple) -> tuple:
+    override = os.getenv(f"CLINICA_ADMISSION_{name.upper()}")
+    if not override:
+        return defaults
+    concurrency, max_queue = (int(value) for value in override.split(","))
+    return (concurrency, max_queue, *defaults[2:])
+
+
+limiters = {name: RouteClassLimiter(name, *_limits(name, defaults)) for name, defaults in ROUTE_CLASSES.items()}
+
+
+def stats() -> dict:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+class AdmissionControlMiddleware:
+    """
+    Middleware ASGI. El cupo se mantiene hasta que termina de enviarse la
+    respuesta completa (incluidas las respuestas en streaming).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = limiters[route_class]
+        if not await limiter.acquire():
+            body = json.dumps({"detail": f"Server busy ({route_class}), retry later"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(limiter.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
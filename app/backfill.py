@@ -0,0 +1,134 @@
+"""
+Backfills por lotes para los pasos de datos de las migraciones de Alembic.
+
+Un UPDATE/INSERT monolítico sobre una tabla grande mantiene los bloqueos y
+genera WAL durante minutos. 'run_backfill' recorre la tabla por rangos de
+clave y hace un COMMIT por lote, guardando un checkpoint para poder reanudar
+si la migración se interrumpe.
+
+Uso dentro de una migración:
+
+    from app.backfill import run_backfill
+
+    run_backfill(
+        name='m4_facturas_historicas',
+        table='appointments', key='appointment_id',
+        sql='''
+            INSERT INTO invoices (...)
+            SELECT ... FROM appointments app
+            WHERE app.appointment_id >= :start AND app.appointment_id < :end
+            RETURNING 1
+        ''',
+    )
+
+Reglas para 'sql':
+  - Debe filtrar por el rango [:start, :end) de la clave.
+  - Debe terminar en RETURNING (lo que sea) para poder contar las filas.
+  - Debe ser idempotente: al reanudar, el último lote puede repetirse.
+
+Cada lote corre en autocommit, así que lo anterior de la migración queda
+confirmado antes del primer lote. Para que la migración se pueda relanzar
+tras un fallo, los pasos de esquema previos deben ser idempotentes
+(ej. 'if_not_exists=True').
+"""
+import time
+
+from alembic import op
+from sqlalchemy.sql import text
+
+CHECKPOINT_TABLE = "alembic_backfill_checkpoints"
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def run_backfill(name: str, table: str, key: str, sql: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 pause_seconds: float = 0.0, params: dict = None) -> int:
+    """
+    Ejecuta 'sql' por lotes sobre los rangos de 'table.key' y devuelve las filas afectadas.
+
+    - name: identificador único del backfill (clave del checkpoint).
+    - pause_seconds: espera entre lotes, para dejar respirar a la BD en producción.
+    - params: parámetros extra para 'sql' además de :start y :end.
+    """
+    params = params or {}
+    context = op.get_context()
+
+    if context.as_sql:
+        # Modo offline (--sql): no hay BD para calcular rangos; se emite una sola sentencia.
+        op.execute(text(sql).bindparams(start=-2147483648, end=2147483647, **params))
+        return 0
+
+    with context.autocommit_block():
+        bind = op.get_bind()
+        bind.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                name varchar(200) PRIMARY KEY,
+                last_key bigint NOT NULL,
+                rows_done bigint NOT NULL DEFAULT 0,
+                updated_at timestamp NOT NULL DEFAULT now()
+            )
+        """))
+
+        low, high = bind.execute(text(f"SELECT min({key}), max({key}) FROM {table}")).one()
+        if low is None:
+            print(f"[backfill {name}] {table} está vacía, nada que hacer.")
+            return 0
+
+        checkpoint = bind.execute(
+            text(f"SELECT last_key, rows_done FROM {CHECKPOINT_TABLE} WHERE name = :name"),
+            {"name": name}
+        ).one_or_none()
+        if checkpoint:
+            start, rows_done = checkpoint
+            print(f"[backfill {name}] Reanudando desde {key}={start} ({rows_done} filas ya procesadas).")
+        else:
+            start, rows_done = low, 0
+
+        # El lote y su checkpoint van en la misma sentencia: o se confirman los dos o ninguno.
+        batch_stmt = text(f"""
+            WITH batch AS ({sql})
+            INSERT INTO {CHECKPOINT_TABLE} (name, last_key, rows_done, updated_at)
+            SELECT :name, :end, count(*), now() FROM batch
+            ON CONFLICT (name) DO UPDATE
+            SET last_key = EXCLUDED.last_key,
+                rows_done = {CHECKPOINT_TABLE}.rows_done + EXCLUDED.rows_done,
+                updated_at = EXCLUDED.updated_at
+            RETURNING rows_done
+        """)
+
+        first_key = start
+        started_at = time.monotonic()
+        while start <= high:
+            end = start + batch_size
+            rows_done = bind.execute(batch_stmt, {"name": name, "start": start, "end": end, **params}).scalar()
+
+            elapsed = time.monotonic() - started_at
+            keys_done = min(end, high + 1) - first_key
+            keys_left = max(high + 1 - end, 0)
+            eta = elapsed / keys_done * keys_left if keys_done else 0
+            progress = 100.0 * (min(end, high + 1) - low) / (high + 1 - low)
+            print(f"[backfill {name}] {progress:5.1f}% ({key} {min(end - 1, high)}/{high}) · "
+                  f"{rows_done} filas · {rows_done / elapsed if elapsed else 0:.0f} filas/s · "
+                  f"ETA {_format_seconds(eta)}")
+
+            start = end
+            if pause_seconds and start <= high:
+                time.sleep(pause_seconds)
+
+        # Terminado: se borra el checkpoint para que un upgrade futuro (tras un downgrade) vuelva a correr.
+        bind.execute(text(f"DELETE FROM {CHECKPOINT_TABLE} WHERE name = :name"), {"name": name})
+        print(f"[backfill {name}] Completado: {rows_done} filas en {_format_seconds(time.monotonic() - started_at)}.")
+        return rows_done
+
+
+def table_exists(table: str) -> bool:
+    """True si la tabla existe (para pasos condicionales como restaurar backups)."""
+    if op.get_context().as_sql:
+        # Modo offline: no se puede consultar; se asume que no hay backups que restaurar
+        return False
+    return op.get_bind().execute(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": table}).scalar()
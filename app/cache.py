@@ -0,0 +1,49 @@
+"""
+Caché en memoria para reportes caros de calcular.
+
+Las entradas valen solo durante el día en que se calcularon (los reportes
+dependen de 'hoy', ej. la antigüedad de las facturas) y se invalidan a mano
+desde las escrituras que cambian su resultado.
+
+La caché es por proceso: con varios workers cada uno tiene la suya, y cada
+worker invalida la propia al escribir. Las escrituras de otro worker se ven
+a más tardar al día siguiente, o en cuanto este worker escriba algo.
+"""
+import threading
+from datetime import date
+
+# Claves de reportes cacheados (prefijo común para invalidarlos juntos)
+RECEIVABLES_REPORT = "receivables"
+
+
+class DailyCache:
+    """Diccionario clave -> valor cuyas entradas caducan al cambiar el día."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Valor cacheado hoy para 'key', o None."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] != date.today():
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (date.today(), value)
+        return value
+
+    def invalidate(self, prefix: str = None):
+        """Borra las entradas cuya clave (o primer elemento, si es tupla) sea 'prefix'; todas si es None."""
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if (k[0] if isinstance(k, tuple) else k) == prefix]:
+                del self._entries[key]
+
+
+report_cache = DailyCache()
@@ -0,0 +1,138 @@
+"""
+Compresión de respuestas (gzip, y brotli si está instalado el paquete 'brotli').
+
+- CompressionMiddleware comprime las respuestas JSON/texto a partir de
+  MINIMUM_SIZE bytes según el Accept-Encoding del cliente. Los listados
+  (/appointments/, /invoices/...) repiten las mismas claves y objetos anidados
+  en cada elemento y se reducen a una fracción de su tamaño.
+- Las respuestas en streaming (SSE de /events) y las que ya traen
+  Content-Encoding pasan sin tocar.
+- cached_response sirve reportes cacheados en report_cache ya comprimidos: una
+  petición repetida no consulta la BD ni vuelve a comprimir. Las entradas se
+  guardan bajo el mismo prefijo del reporte, así que las invalidaciones
+  existentes (ver app/cache.py) también las borran.
+"""
+import gzip
+import os
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .cache import report_cache
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+MINIMUM_SIZE = int(os.getenv("CLINICA_COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Calidades altas comprimen poco más y cuestan mucho más CPU por petición
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Codificación a usar según Accept-Encoding: 'br', 'gzip' o None."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        offered[name.strip()] = quality
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+class CompressionMiddleware:
+    """Middleware ASGI: comprime respuestas completas de tipo compresible y tamaño >= minimum_size."""
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES) \
+                        or content_type.startswith("text/event-stream"):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Se retiene hasta ver el cuerpo: hace falta para decidir y para el Content-Length
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # Streaming o respuesta pequeña: se envía tal cual
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def cached_response(request: Request, key, build: Callable[[], bytes],
+                    media_type: str = "application/json") -> Response:
+    """
+    Respuesta con el cuerpo de 'build()' comprimido según el cliente y cacheado
+    en report_cache bajo (key, 'response', codificación). 'key' debe empezar por
+    el prefijo del reporte (ej. RECEIVABLES_REPORT) para heredar su invalidación.
+    """
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    cache_key = (*((key,) if isinstance(key, str) else key), "response", encoding)
+    cached = report_cache.get(cache_key)
+    if cached is None:
+        body = build()
+        if len(body) < MINIMUM_SIZE:
+            encoding = None
+        cached = report_cache.set(cache_key, (compress(body, encoding), encoding))
+    body, encoding = cached
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -1,10 +1,88 @@
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, extract
+from sqlalchemy.sql import lambda_stmt
+from sqlalchemy import func, extract, tuple_, cast, select, literal, null, union_all, text, case, String, TIMESTAMP
+from sqlalchemy.types import REAL
 from . import models, schemas
-from datetime import date, datetime, timedelta
+from .cache import report_cache, RECEIVABLES_REPORT
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
+from itertools import groupby, islice
+import base64
+import json
+from time import perf_counter
+
+from sqlalchemy.exc import IntegrityError
+
+# Configuración de texto de PostgreSQL usada por la columna generada
+# 'medical_records.search_vector' (migración M6). Deben coincidir.
+FTS_CONFIG = 'spanish'
+
+# Estados de cita que ocupan la agenda (mismo predicado que 'appointments_no_overlap', M7)
+BUSY_APPOINTMENT_STATUSES = ('scheduled', 'completed')
+
+# Tablas particionadas por mes (M8) y meses futuros que deben tener partición
+PARTITIONED_TABLES = ('appointments', 'invoices')
+PARTITION_MONTHS_AHEAD = 3
+
+# Días hacia atrás que /appointments/pending mira por defecto: acota la
+# consulta a las particiones recientes y futuras (M8)
+PENDING_APPOINTMENTS_LOOKBACK_DAYS = 30
+
+# Horario de atención usado para calcular huecos libres
+CLINIC_OPENING_TIME = time(8, 0)
+CLINIC_CLOSING_TIME = time(18, 0)
+
+# Facturación por lotes (M9): precio si el veterinario no tiene 'consultation_fee', e impuesto
+DEFAULT_CONSULTATION_FEE = Decimal('150.00')
+INVOICE_TAX_RATE = Decimal('0.13')
+INVOICE_BATCH_SIZE = 1000
+
+# Máximo de pagos por conciliación (POST /invoices/pay-batch)
+PAYMENT_BATCH_MAX_SIZE = 10000
+
+# Facturas por cobrar (mismo predicado que el índice parcial 'ix_invoices_open_issue_date', M11)
+OPEN_INVOICE_STATUSES = ('pending', 'partial', 'overdue')
+# Días de plazo de pago: pasado este plazo una factura 'pending' pasa a 'overdue'
+INVOICE_PAYMENT_TERMS_DAYS = 30
+OVERDUE_BATCH_SIZE = 1000
+
+# Feed de cambios (M12): tablas con trigger en change_log
+CHANGE_FEED_TABLES = ('owners', 'pets', 'appointments', 'invoices')
+# Días que se conservan en change_log; un cursor más viejo obliga a recargar todo
+CHANGE_LOG_RETENTION_DAYS = 7
+# seq máximo, para cursores que deben quedar detrás de todo un txid
+MAX_CHANGE_SEQ = 2 ** 63 - 1
+
+# Tramos de antigüedad de las cuentas por cobrar: (etiqueta, días máximos desde la emisión)
+AGING_BUCKETS = (('0-30', 30), ('31-60', 60), ('61-90', 90), ('90+', None))
+
+# Eager loads por defecto de las lecturas ('?fields=' las sustituye, ver
+# app/fieldsets.py). Se construyen una vez y se pasan a Session.get: si el
+# objeto ya está en el identity map de la sesión (lo normal cuando un endpoint
+# valida y después recarga) no se emite ninguna consulta, y si no, SQLAlchemy
+# reutiliza la sentencia ya compilada.
+OWNER_LOAD = (joinedload(models.Owner.pets),)
+PET_LOAD = (joinedload(models.Pet.owner),)
+APPOINTMENT_LOAD = (
+    joinedload(models.Appointment.pet),
+    joinedload(models.Appointment.veterinarian),
+    joinedload(models.Appointment.invoice),
+    joinedload(models.Appointment.medical_record),
+)
+# Listados: solo lo que serializa schemas.Appointment
+APPOINTMENT_LIST_LOAD = (joinedload(models.Appointment.pet), joinedload(models.Appointment.veterinarian))
+VACCINATION_RECORD_LOAD = (
+    joinedload(models.VaccinationRecord.pet),
+    joinedload(models.VaccinationRecord.vaccine),
+    joinedload(models.VaccinationRecord.veterinarian),
+)
+INVOICE_LOAD = (joinedload(models.Invoice.appointment).joinedload(models.Appointment.pet),)
 
 # --- Utils ---
+def first_by(db: Session, stmt):
+    """Primera entidad de una búsqueda por columna única construida con lambda_stmt (sentencia cacheada)."""
+    return db.execute(stmt).scalars().first()
+
 def update_db_item(db_item, update_data):
     """Actualiza un item de la BD con datos de un schema Update."""
     update_data_dict = update_data.model_dump(exclude_unset=True)
@@ -12,18 +90,46 @@ def update_db_item(db_item, update_data):
         setattr(db_item, key, value)
     return db_item
 
+def day_range(day: date):
+    """[inicio, fin) de un día como timestamps. Filtrar por rango (y no con func.date())
+    permite usar índices y la poda de particiones (M8)."""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+def encode_cursor(*values) -> str:
+    """Codifica la posición de paginación (keyset) como un token opaco."""
+    raw = json.dumps(list(values), default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """
+    Decodifica un token de encode_cursor convirtiendo cada valor con 'types'
+    (ej. decode_cursor(c, float, int)). Lanza ValueError si es inválido.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("Invalid cursor")
+        return tuple(convert(value) for convert, value in zip(types, values))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
 # --- CRUD Veterinarians ---
-def get_veterinarian(db: Session, vet_id: int):
-    return db.query(models.Veterinarian).filter(models.Veterinarian.veterinarian_id == vet_id).first()
+def get_veterinarian(db: Session, vet_id: int, options: tuple = ()):
+    return db.get(models.Veterinarian, vet_id, options=options)
 
 def get_veterinarian_by_email(db: Session, email: str):
-    return db.query(models.Veterinarian).filter(models.Veterinarian.email == email).first()
+    return first_by(db, lambda_stmt(lambda: select(models.Veterinarian).where(models.Veterinarian.email == email)))
 
 def get_veterinarian_by_license(db: Session, license_number: str):
-    return db.query(models.Veterinarian).filter(models.Veterinarian.license_number == license_number).first()
+    return first_by(db, lambda_stmt(
+        lambda: select(models.Veterinarian).where(models.Veterinarian.license_number == license_number)))
 
-def get_veterinarians(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Veterinarian).offset(skip).limit(limit).all()
+def get_veterinarians(db: Session, skip: int = 0, limit: int = 100, options: tuple = ()):
+    return db.query(models.Veterinarian).options(*options).offset(skip).limit(limit).all()
+
+def get_veterinarians_by_ids(db: Session, ids: list, options: tuple = ()):
+    return db.query(models.Veterinarian).options(*options).filter(models.Veterinarian.veterinarian_id.in_(ids)).all()
 
 def create_veterinarian(db: Session, vet: schemas.VeterinarianCreate):
     db_vet = models.Veterinarian(**vet.model_dump())
@@ -51,25 +157,113 @@ def delete_veterinarian(db: Session, db_vet: models.Veterinarian):
     db.commit()
     return db_vet
 
+def _free_slots(busy, window_start: datetime, window_end: datetime, min_duration: timedelta):
+    """
+    Resta los intervalos ocupados (ordenados por inicio) de una ventana y
+    devuelve los huecos de al menos 'min_duration'. Los intervalos pueden solaparse.
+    """
+    slots = []
+    cursor = window_start
+    for busy_start, busy_end in busy:
+        if busy_end <= cursor:
+            continue
+        if busy_start >= window_end:
+            break
+        if busy_start - cursor >= min_duration:
+            slots.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if window_end - cursor >= min_duration:
+        slots.append((cursor, window_end))
+    return slots
+
+def get_veterinarians_availability(db: Session, start_date: date, end_date: date, vet_ids: list = None,
+                                   min_duration_minutes: int = 30,
+                                   opening_time: time = CLINIC_OPENING_TIME, closing_time: time = CLINIC_CLOSING_TIME):
+    """
+    Huecos libres de varios veterinarios en un rango de días.
+    Trae todas las citas activas del rango en una sola consulta (usa el índice
+    GiST de 'appointments_no_overlap') y recorre cada agenda una sola vez.
+    Devuelve una lista de (veterinario, [(inicio, fin), ...]).
+    """
+    vets_query = db.query(models.Veterinarian).filter(models.Veterinarian.is_active.is_(True))
+    if vet_ids:
+        vets_query = vets_query.filter(models.Veterinarian.veterinarian_id.in_(vet_ids))
+    vets = vets_query.order_by(models.Veterinarian.veterinarian_id).all()
+    if not vets:
+        return []
+
+    range_start = datetime.combine(start_date, time.min)
+    range_end = datetime.combine(end_date + timedelta(days=1), time.min)
+    appointment_end = models.Appointment.appointment_date + models.Appointment.duration_minutes * timedelta(minutes=1)
+
+    busy_rows = db.query(
+        models.Appointment.veterinarian_id,
+        models.Appointment.appointment_date,
+        appointment_end.label('appointment_end')
+    ).filter(
+        models.Appointment.veterinarian_id.in_([vet.veterinarian_id for vet in vets]),
+        models.Appointment.status.in_(BUSY_APPOINTMENT_STATUSES),
+        models.Appointment.time_slot.op('&&')(func.tsrange(range_start, range_end))
+    ).order_by(models.Appointment.veterinarian_id, models.Appointment.appointment_date).all()
+
+    busy_by_vet = {
+        vet_id: [(row.appointment_date, row.appointment_end) for row in rows]
+        for vet_id, rows in groupby(busy_rows, key=lambda row: row.veterinarian_id)
+    }
+
+    min_duration = timedelta(minutes=min_duration_minutes)
+    days = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+    availability = []
+    for vet in vets:
+        busy = busy_by_vet.get(vet.veterinarian_id, [])
+        free = []
+        first = 0  # Primer intervalo que aún puede afectar al día actual
+        for day in days:
+            window_start = datetime.combine(day, opening_time)
+            window_end = datetime.combine(day, closing_time)
+            while first < len(busy) and busy[first][1] <= window_start:
+                first += 1
+            free.extend(_free_slots(islice(busy, first, None), window_start, window_end, min_duration))
+        availability.append((vet, free))
+    return availability
+
+def get_conflicting_appointment(db: Session, vet_id: int, start: datetime, duration_minutes: int, exclude_id: int = None):
+    """Devuelve una cita activa del veterinario que se solape con [start, start + duración), o None."""
+    end = start + timedelta(minutes=duration_minutes)
+    query = db.query(models.Appointment).filter(
+        models.Appointment.veterinarian_id == vet_id,
+        models.Appointment.status.in_(BUSY_APPOINTMENT_STATUSES),
+        models.Appointment.time_slot.op('&&')(func.tsrange(start, end))
+    )
+    if exclude_id:
+        query = query.filter(models.Appointment.appointment_id != exclude_id)
+    return query.first()
+
 def get_appointments_by_veterinarian(db: Session, vet_id: int):
     return db.query(models.Appointment).filter(models.Appointment.veterinarian_id == vet_id).all()
 
 def get_appointments_by_vet_and_date(db: Session, vet_id: int, date: date):
-     return db.query(models.Appointment).filter(
+    start, end = day_range(date)
+    return db.query(models.Appointment).filter(
         models.Appointment.veterinarian_id == vet_id,
-        func.date(models.Appointment.appointment_date) == date
+        models.Appointment.appointment_date >= start,
+        models.Appointment.appointment_date < end
     ).order_by(models.Appointment.appointment_date).all()
 
 
 # --- CRUD Owners ---
-def get_owner(db: Session, owner_id: int):
-    return db.query(models.Owner).options(joinedload(models.Owner.pets)).filter(models.Owner.owner_id == owner_id).first()
+def get_owner(db: Session, owner_id: int, options: tuple = OWNER_LOAD):
+    return db.get(models.Owner, owner_id, options=options)
 
 def get_owner_by_email(db: Session, email: str):
-    return db.query(models.Owner).filter(models.Owner.email == email).first()
+    return first_by(db, lambda_stmt(lambda: select(models.Owner).where(models.Owner.email == email)))
+
+def get_owners(db: Session, skip: int = 0, limit: int = 100, options: tuple = OWNER_LOAD):
+    # Orden estable por PK: paginar con skip/limit recorre cada dueño una vez
+    return db.query(models.Owner).options(*options).order_by(models.Owner.owner_id).offset(skip).limit(limit).all()
 
-def get_owners(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Owner).options(joinedload(models.Owner.pets)).offset(skip).limit(limit).all()
+def get_owners_by_ids(db: Session, ids: list, options: tuple = OWNER_LOAD):
+    return db.query(models.Owner).options(*options).filter(models.Owner.owner_id.in_(ids)).all()
 
 def create_owner(db: Session, owner: schemas.OwnerCreate):
     db_owner = models.Owner(**owner.model_dump())
@@ -100,11 +294,15 @@ def get_appointments_by_owner(db: Session, owner_id: int):
 
 
 # --- CRUD Pets ---
-def get_pet(db: Session, pet_id: int):
-    return db.query(models.Pet).options(joinedload(models.Pet.owner)).filter(models.Pet.pet_id == pet_id).first()
+def get_pet(db: Session, pet_id: int, options: tuple = PET_LOAD):
+    return db.get(models.Pet, pet_id, options=options)
 
-def get_pets(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Pet).options(joinedload(models.Pet.owner)).offset(skip).limit(limit).all()
+def get_pets(db: Session, skip: int = 0, limit: int = 100, options: tuple = PET_LOAD):
+    # Orden estable por PK: paginar con skip/limit recorre cada mascota una vez
+    return db.query(models.Pet).options(*options).order_by(models.Pet.pet_id).offset(skip).limit(limit).all()
+
+def get_pets_by_ids(db: Session, ids: list, options: tuple = PET_LOAD):
+    return db.query(models.Pet).options(*options).filter(models.Pet.pet_id.in_(ids)).all()
 
 def create_pet(db: Session, pet: schemas.PetCreate):
     db_pet = models.Pet(**pet.model_dump())
@@ -132,20 +330,93 @@ def delete_pet(db: Session, db_pet: models.Pet):
     return db_pet
 
 
+def get_pet_timeline(db: Session, pet_id: int, limit: int = 50, before: str = None):
+    """
+    Historial cronológico de una mascota: citas, historiales médicos,
+    vacunas y facturas en un único UNION ALL, del más reciente al más antiguo.
+    Pagina hacia atrás con keyset sobre (event_date, event_type, event_id).
+    Devuelve (eventos, next_cursor); next_cursor es None en la última página.
+    """
+    A = models.Appointment
+    MR = models.MedicalRecord
+    VR = models.VaccinationRecord
+    INV = models.Invoice
+
+    appointments = select(
+        literal('appointment', String).label('event_type'),
+        A.appointment_id.label('event_id'),
+        A.appointment_date.label('event_date'),
+        A.reason.label('title'),
+        cast(A.status, String).label('status'),
+        A.veterinarian_id.label('veterinarian_id'),
+        A.notes.label('detail'),
+        cast(null(), INV.total_amount.type).label('amount')
+    ).where(A.pet_id == pet_id)
+
+    medical_records = select(
+        literal('medical_record', String),
+        MR.record_id,
+        A.appointment_date,
+        MR.diagnosis,
+        cast(null(), String),
+        A.veterinarian_id,
+        MR.treatment,
+        cast(null(), INV.total_amount.type)
+    ).join(A, MR.appointment_id == A.appointment_id).where(A.pet_id == pet_id)
+
+    vaccinations = select(
+        literal('vaccination', String),
+        VR.vaccination_id,
+        cast(VR.vaccination_date, TIMESTAMP),
+        models.Vaccine.name,
+        cast(null(), String),
+        VR.veterinarian_id,
+        VR.batch_number,
+        cast(null(), INV.total_amount.type)
+    ).join(models.Vaccine, VR.vaccine_id == models.Vaccine.vaccine_id).where(VR.pet_id == pet_id)
+
+    invoices = select(
+        literal('invoice', String),
+        INV.invoice_id,
+        cast(INV.issue_date, TIMESTAMP),
+        INV.invoice_number,
+        cast(INV.payment_status, String),
+        A.veterinarian_id,
+        cast(null(), String),
+        INV.total_amount
+    ).join(A, INV.appointment_id == A.appointment_id).where(A.pet_id == pet_id)
+
+    events = union_all(appointments, medical_records, vaccinations, invoices).subquery('events')
+    position = tuple_(events.c.event_date, events.c.event_type, events.c.event_id)
+
+    stmt = select(events)
+    if before:
+        last_date, last_type, last_id = decode_cursor(before, datetime.fromisoformat, str, int)
+        stmt = stmt.where(position < tuple_(last_date, last_type, last_id))
+    stmt = stmt.order_by(
+        events.c.event_date.desc(), events.c.event_type.desc(), events.c.event_id.desc()
+    ).limit(limit + 1)
+
+    rows = db.execute(stmt).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.event_date.isoformat(), last.event_type, last.event_id)
+    return rows, next_cursor
+
+
 # --- CRUD Appointments ---
-def get_appointment(db: Session, appt_id: int):
-    return db.query(models.Appointment).options(
-        joinedload(models.Appointment.pet),
-        joinedload(models.Appointment.veterinarian),
-        joinedload(models.Appointment.invoice),
-        joinedload(models.Appointment.medical_record)
-    ).filter(models.Appointment.appointment_id == appt_id).first()
-
-def get_appointments(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Appointment).options(
-        joinedload(models.Appointment.pet),
-        joinedload(models.Appointment.veterinarian)
-    ).order_by(models.Appointment.appointment_date.desc()).offset(skip).limit(limit).all()
+def get_appointment(db: Session, appt_id: int, options: tuple = APPOINTMENT_LOAD):
+    return db.get(models.Appointment, appt_id, options=options)
+
+def get_appointments(db: Session, skip: int = 0, limit: int = 100, options: tuple = APPOINTMENT_LIST_LOAD):
+    return db.query(models.Appointment).options(*options).order_by(
+        models.Appointment.appointment_date.desc()).offset(skip).limit(limit).all()
+
+def get_appointments_by_ids(db: Session, ids: list, options: tuple = APPOINTMENT_LIST_LOAD):
+    return db.query(models.Appointment).options(*options).filter(models.Appointment.appointment_id.in_(ids)).all()
 
 def create_appointment(db: Session, appt: schemas.AppointmentCreate):
     """Crea una nueva cita y actualiza las métricas (M5)."""
@@ -156,6 +427,7 @@ def create_appointment(db: Session, appt: schemas.AppointmentCreate):
         return None 
 
     db_appt = models.Appointment(**appt.model_dump())
+    db.add(db_appt)
     
     # --- LÓGICA M5 ---
 #    db_pet.visit_count += 1
@@ -195,23 +467,75 @@ def delete_appointment(db: Session, db_appt: models.Appointment):
     db.commit()
     return db_appt
 
-def get_appointments_by_status_or_date(db: Session, status: str = None, date: date = None):
+def get_appointments_by_status_or_date(db: Session, status: str = None, date: date = None, since: date = None):
     query = db.query(models.Appointment)
     if status:
         query = query.filter(models.Appointment.status == status)
+    if since:
+        # Cota inferior sobre la clave de partición: las particiones anteriores se podan
+        query = query.filter(models.Appointment.appointment_date >= datetime.combine(since, time.min))
     if date:
-        query = query.filter(func.date(models.Appointment.appointment_date) == date)
+        start, end = day_range(date)
+        query = query.filter(models.Appointment.appointment_date >= start,
+                             models.Appointment.appointment_date < end)
     return query.all()
 
 # --- CRUD Medical Records (M1) ---
 def get_medical_record(db: Session, record_id: int):
-    return db.query(models.MedicalRecord).filter(models.MedicalRecord.record_id == record_id).first()
+    return db.get(models.MedicalRecord, record_id)
 
 def get_medical_record_by_appointment(db: Session, appointment_id: int):
-    return db.query(models.MedicalRecord).filter(models.MedicalRecord.appointment_id == appointment_id).first()
+    return first_by(db, lambda_stmt(
+        lambda: select(models.MedicalRecord).where(models.MedicalRecord.appointment_id == appointment_id)))
 
 def get_medical_records_by_pet(db: Session, pet_id: int):
-    return db.query(models.MedicalRecord).join(models.Appointment).filter(models.Appointment.pet_id == pet_id).order_by(models.MedicalRecord.created_at.desc()).all()
+    return db.query(models.MedicalRecord).join(models.MedicalRecord.appointment).filter(models.Appointment.pet_id == pet_id).order_by(models.MedicalRecord.created_at.desc()).all()
+
+def search_medical_records(db: Session, q: str, species: str = None, vet_id: int = None,
+                           start_date: date = None, end_date: date = None,
+                           limit: int = 20, cursor: str = None):
+    """
+    Búsqueda full-text (M6) sobre diagnóstico, tratamiento y receta.
+    Ordena por relevancia (ts_rank) y pagina por keyset sobre (rank, record_id).
+    Devuelve (filas, next_cursor); next_cursor es None en la última página.
+    """
+    ts_query = func.websearch_to_tsquery(FTS_CONFIG, q)
+    rank = func.ts_rank(models.MedicalRecord.search_vector, ts_query)
+
+    query = db.query(
+        models.MedicalRecord,
+        rank.label('rank'),
+        models.Appointment.pet_id,
+        models.Appointment.veterinarian_id,
+        models.Appointment.appointment_date,
+        models.Pet.species
+    ).join(
+        models.Appointment, models.MedicalRecord.appointment_id == models.Appointment.appointment_id
+    ).join(
+        models.Pet, models.Appointment.pet_id == models.Pet.pet_id
+    ).filter(models.MedicalRecord.search_vector.op('@@')(ts_query))
+
+    if species:
+        query = query.filter(models.Pet.species == species)
+    if vet_id:
+        query = query.filter(models.Appointment.veterinarian_id == vet_id)
+    if start_date:
+        query = query.filter(models.Appointment.appointment_date >= start_date)
+    if end_date:
+        query = query.filter(models.Appointment.appointment_date < end_date + timedelta(days=1))
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, float, int)
+        query = query.filter(
+            tuple_(rank, models.MedicalRecord.record_id) < tuple_(cast(last_rank, REAL), last_id)
+        )
+
+    rows = query.order_by(rank.desc(), models.MedicalRecord.record_id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].MedicalRecord.record_id)
+    return rows, next_cursor
 
 def create_medical_record(db: Session, record: schemas.MedicalRecordCreate):
     db_record = models.MedicalRecord(**record.model_dump())
@@ -228,10 +552,10 @@ def update_medical_record(db: Session, db_record: models.MedicalRecord, record_u
 
 # --- CRUD Vaccines (M2) ---
 def get_vaccine(db: Session, vaccine_id: int):
-    return db.query(models.Vaccine).filter(models.Vaccine.vaccine_id == vaccine_id).first()
+    return db.get(models.Vaccine, vaccine_id)
 
 def get_vaccine_by_name(db: Session, name: str):
-    return db.query(models.Vaccine).filter(models.Vaccine.name == name).first()
+    return first_by(db, lambda_stmt(lambda: select(models.Vaccine).where(models.Vaccine.name == name)))
 
 def get_vaccines(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Vaccine).offset(skip).limit(limit).all()
@@ -245,11 +569,7 @@ def create_vaccine(db: Session, vaccine: schemas.VaccineCreate):
 
 # --- CRUD Vaccination Records (M2) ---
 def get_vaccination_record(db: Session, record_id: int):
-    return db.query(models.VaccinationRecord).options(
-        joinedload(models.VaccinationRecord.pet),
-        joinedload(models.VaccinationRecord.vaccine),
-        joinedload(models.VaccinationRecord.veterinarian)
-    ).filter(models.VaccinationRecord.vaccination_id == record_id).first()
+    return db.get(models.VaccinationRecord, record_id, options=VACCINATION_RECORD_LOAD)
 
 def get_vaccination_records(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.VaccinationRecord).options(
@@ -282,28 +602,256 @@ def get_vaccination_schedule_by_pet(db: Session, pet_id: int):
 
 # --- CRUD Invoices (M4) ---
 def get_invoice(db: Session, invoice_id: int):
-    return db.query(models.Invoice).options(
-        joinedload(models.Invoice.appointment).joinedload(models.Appointment.pet)
-    ).filter(models.Invoice.invoice_id == invoice_id).first()
+    return db.get(models.Invoice, invoice_id, options=INVOICE_LOAD)
 
 def get_invoices(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Invoice).options(
         joinedload(models.Invoice.appointment).joinedload(models.Appointment.pet)
     ).order_by(models.Invoice.issue_date.desc()).offset(skip).limit(limit).all()
 
+def get_invoices_by_ids(db: Session, ids: list):
+    return db.query(models.Invoice).options(
+        joinedload(models.Invoice.appointment).joinedload(models.Appointment.pet)
+    ).filter(models.Invoice.invoice_id.in_(ids)).all()
+
 def get_pending_invoices(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Invoice).filter(
-        models.Invoice.payment_status.in_(['pending', 'overdue'])
-    ).order_by(models.Invoice.issue_date.desc()).offset(skip).limit(limit).all()
+        models.Invoice.payment_status.in_(OPEN_INVOICE_STATUSES)
+    ).order_by(models.Invoice.issue_date.desc(), models.Invoice.invoice_id.desc()).offset(skip).limit(limit).all()
 
 def mark_invoice_as_paid(db: Session, db_invoice: models.Invoice):
     db_invoice.payment_status = 'paid'
     db_invoice.payment_date = datetime.now()
+    db_invoice.amount_paid = db_invoice.total_amount
     db.add(db_invoice)
     db.commit()
+    report_cache.invalidate(RECEIVABLES_REPORT)
     db.refresh(db_invoice)
     return db_invoice
 
+# Un solo INSERT ... SELECT por lote. 'FOR UPDATE SKIP LOCKED' reparte las citas
+# entre procesos concurrentes: cada uno se salta las que otro ya está facturando.
+GENERATE_INVOICES_SQL = text("""
+    WITH to_invoice AS (
+        SELECT app.appointment_id, coalesce(v.consultation_fee, :default_fee) AS subtotal
+        FROM appointments app
+        JOIN veterinarians v ON v.veterinarian_id = app.veterinarian_id
+        WHERE app.status = 'completed'
+          AND NOT EXISTS (SELECT 1 FROM invoice_keys k WHERE k.appointment_id = app.appointment_id)
+        ORDER BY app.appointment_id
+        LIMIT :batch_size
+        FOR UPDATE OF app SKIP LOCKED
+    ), inserted AS (
+        INSERT INTO invoices (appointment_id, invoice_number, issue_date,
+                              subtotal, tax_amount, total_amount, payment_status)
+        SELECT appointment_id,
+               'INV-' || to_char(current_date, 'YYYY') || '-' || lpad(nextval('invoice_number_seq')::text, 8, '0'),
+               current_date,
+               subtotal, round(subtotal * :tax_rate, 2), subtotal + round(subtotal * :tax_rate, 2),
+               'pending'
+        FROM to_invoice
+        RETURNING total_amount
+    )
+    SELECT count(*), coalesce(sum(total_amount), 0) FROM inserted
+""")
+
+def generate_pending_invoices(db: Session, batch_size: int = INVOICE_BATCH_SIZE, max_batches: int = None):
+    """
+    Factura las citas completadas que aún no tienen factura, por lotes (un COMMIT por lote).
+    Devuelve un resumen con cantidades y rendimiento.
+    """
+    params = {"batch_size": batch_size, "default_fee": DEFAULT_CONSULTATION_FEE, "tax_rate": INVOICE_TAX_RATE}
+    created, batches, total_amount, conflicts = 0, 0, Decimal('0.00'), 0
+    started = perf_counter()
+    while max_batches is None or batches < max_batches:
+        try:
+            count, amount = db.execute(GENERATE_INVOICES_SQL, params).one()
+            db.commit()
+        except IntegrityError:
+            # Otro proceso facturó alguna de estas citas entre nuestro snapshot y el bloqueo
+            # (invoice_keys lo detecta); el lote se deshace y el siguiente ya no las verá.
+            db.rollback()
+            conflicts += 1
+            if conflicts > 3:
+                raise
+            continue
+        if count == 0:
+            break
+        created += count
+        total_amount += amount
+        batches += 1
+    if created:
+        report_cache.invalidate(RECEIVABLES_REPORT)
+    elapsed = perf_counter() - started
+    return {
+        "invoices_created": created,
+        "batches": batches,
+        "total_amount": total_amount,
+        "elapsed_seconds": round(elapsed, 3),
+        "invoices_per_second": round(created / elapsed, 1) if elapsed else 0.0,
+    }
+
+# Conciliación: un solo UPDATE para todo el lote. Los pagos llegan como arrays
+# paralelos (unnest), así el lote entero va en 3 parámetros. Varios pagos a la
+# misma factura se suman antes de aplicar.
+APPLY_PAYMENTS_SQL = text("""
+    WITH payments AS (
+        SELECT invoice_number, sum(amount) AS amount, max(payment_date) AS payment_date
+        FROM unnest(CAST(:numbers AS varchar[]), CAST(:amounts AS numeric[]), CAST(:dates AS timestamp[]))
+             AS p(invoice_number, amount, payment_date)
+        GROUP BY invoice_number
+    ), updated AS (
+        UPDATE invoices inv
+        SET amount_paid = inv.amount_paid + p.amount,
+            -- Un pago parcial no saca a una factura vencida de 'overdue'
+            payment_status = CASE WHEN inv.amount_paid + p.amount >= inv.total_amount THEN 'paid'
+                                  WHEN inv.payment_status = 'overdue' THEN 'overdue'
+                                  ELSE 'partial' END::invoice_payment_status_enum,
+            payment_date = CASE WHEN inv.amount_paid + p.amount >= inv.total_amount
+                                THEN p.payment_date ELSE inv.payment_date END
+        FROM payments p
+        WHERE inv.invoice_number = p.invoice_number AND inv.payment_status <> 'paid'
+        RETURNING inv.invoice_id, inv.invoice_number, inv.amount_paid, inv.total_amount, inv.payment_status
+    )
+    SELECT p.invoice_number, p.amount, u.invoice_id, u.amount_paid, u.total_amount, u.payment_status,
+           CASE WHEN u.invoice_id IS NULL THEN
+                     CASE WHEN EXISTS (SELECT 1 FROM invoice_keys k WHERE k.invoice_number = p.invoice_number)
+                          THEN 'already_paid' ELSE 'not_found' END
+                WHEN u.amount_paid > u.total_amount THEN 'overpaid'
+                ELSE 'applied' END AS result
+    FROM payments p
+    LEFT JOIN updated u ON u.invoice_number = p.invoice_number
+    ORDER BY p.invoice_number
+""")
+
+def apply_invoice_payments(db: Session, payments: list):
+    """
+    Aplica un lote de schemas.InvoicePayment (pagos parciales o completos) en un solo UPDATE.
+    Devuelve un resultado por número de factura.
+    """
+    if not payments:
+        return []
+    now = datetime.now()
+    rows = db.execute(APPLY_PAYMENTS_SQL, {
+        "numbers": [p.invoice_number for p in payments],
+        "amounts": [p.amount for p in payments],
+        "dates": [p.payment_date or now for p in payments],
+    }).mappings().all()
+    db.commit()
+    report_cache.invalidate(RECEIVABLES_REPORT)
+    return rows
+
+# Lotes acotados y SKIP LOCKED: no compite con pagos en curso ni con otro barrido
+MARK_OVERDUE_SQL = text("""
+    WITH due AS (
+        SELECT invoice_id, issue_date FROM invoices
+        WHERE payment_status IN ('pending', 'partial') AND issue_date < :cutoff
+        ORDER BY issue_date
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE invoices inv SET payment_status = 'overdue'
+    FROM due
+    WHERE inv.invoice_id = due.invoice_id AND inv.issue_date = due.issue_date
+""")
+
+def mark_overdue_invoices(db: Session, terms_days: int = INVOICE_PAYMENT_TERMS_DAYS,
+                          batch_size: int = OVERDUE_BATCH_SIZE, max_batches: int = None):
+    """Pasa a 'overdue' las facturas 'pending' o 'partial' emitidas hace más de 'terms_days' días, por lotes."""
+    cutoff = date.today() - timedelta(days=terms_days)
+    marked, batches = 0, 0
+    started = perf_counter()
+    while max_batches is None or batches < max_batches:
+        count = db.execute(MARK_OVERDUE_SQL, {"cutoff": cutoff, "batch_size": batch_size}).rowcount
+        db.commit()
+        if count == 0:
+            break
+        marked += count
+        batches += 1
+    return {
+        "invoices_marked": marked,
+        "batches": batches,
+        "cutoff_date": cutoff,
+        "elapsed_seconds": round(perf_counter() - started, 3),
+    }
+
+# --- Mantenimiento de particiones (M8) ---
+def ensure_future_partitions(db: Session, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """Crea las particiones mensuales que falten hasta 'months_ahead' meses. Devuelve cuántas creó."""
+    created = 0
+    for table in PARTITIONED_TABLES:
+        created += db.execute(
+            text("SELECT ensure_monthly_partitions(:table, :months_ahead)"),
+            {"table": table, "months_ahead": months_ahead}
+        ).scalar()
+    db.commit()
+    return created
+
+# --- Feed de cambios (M12) ---
+# Tabla -> (carga de filas por id, atributo PK); mismas relaciones que los listados
+CHANGE_FEED_LOADERS = {
+    'owners': (get_owners_by_ids, 'owner_id'),
+    'pets': (get_pets_by_ids, 'pet_id'),
+    'appointments': (get_appointments_by_ids, 'appointment_id'),
+    'invoices': (get_invoices_by_ids, 'invoice_id'),
+}
+
+def get_change_feed_head(db: Session):
+    """
+    Cursor (txid, seq) que deja fuera todo lo que ya ve este snapshot: lo que se
+    lee justo después (las listas completas) más los cambios desde este cursor no
+    pierde nada. Puede repetir algún cambio, pero aplicar un cambio es idempotente.
+    """
+    xmin = db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+    return xmin - 1, MAX_CHANGE_SEQ
+
+def get_changes(db: Session, since_txid: int, since_seq: int, limit: int = 500):
+    """
+    Cambios posteriores al cursor, ordenados por (txid, seq), solo de transacciones
+    anteriores al xmin del snapshot (ya terminadas). Varios cambios de una misma
+    fila se reducen a uno; la fila se lee en su estado actual (None si se borró).
+    Devuelve ([(tabla, row_id, fila)], siguiente cursor, hay_más).
+    """
+    entries = db.execute(text("""
+        SELECT txid, seq, table_name, row_id FROM change_log
+        WHERE (txid, seq) > (:txid, :seq)
+          AND txid < pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+        ORDER BY txid, seq
+        LIMIT :limit
+    """), {"txid": since_txid, "seq": since_seq, "limit": limit + 1}).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], (since_txid, since_seq), False
+
+    # Último cambio de cada fila, en orden de aparición
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.table_name, entry.row_id), None)
+        latest[(entry.table_name, entry.row_id)] = entry
+    ids_by_table = {}
+    for table, row_id in latest:
+        ids_by_table.setdefault(table, []).append(row_id)
+
+    current = {}
+    for table, ids in ids_by_table.items():
+        loader, pk = CHANGE_FEED_LOADERS[table]
+        for row in loader(db, ids):
+            current[(table, getattr(row, pk))] = row
+
+    changes = [(table, row_id, current.get((table, row_id))) for table, row_id in latest]
+    last = entries[-1]
+    return changes, (last.txid, last.seq), has_more
+
+def prune_change_log(db: Session, retention_days: int = CHANGE_LOG_RETENTION_DAYS):
+    """Borra de change_log los cambios más viejos que 'retention_days'. Devuelve cuántos borró."""
+    deleted = db.execute(
+        text("DELETE FROM change_log WHERE changed_at < now() - make_interval(days => :days)"),
+        {"days": retention_days}
+    ).rowcount
+    db.commit()
+    return deleted
+
 # --- CRUD Reports (M5) ---
 def get_revenue_report(db: Session, start_date: date, end_date: date):
     # Suma el total_amount de las facturas pagadas en el rango de fechas
@@ -313,6 +861,80 @@ def get_revenue_report(db: Session, start_date: date, end_date: date):
     ).scalar()
     return total_revenue or Decimal('0.00')
 
+def get_receivables_report(db: Session, as_of: date = None):
+    """
+    Cuentas por cobrar por tramo de antigüedad, con subtotales por método de pago
+    y por veterinario. Todo sale de una sola consulta con GROUPING SETS.
+    Se cachea por día (ver app/cache.py); los pagos y la facturación la invalidan.
+    """
+    as_of = as_of or date.today()
+    cache_key = (RECEIVABLES_REPORT, as_of)
+    cached = report_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    INV, APP, VET = models.Invoice, models.Appointment, models.Veterinarian
+    age = literal(as_of) - INV.issue_date
+    bucket_label = case(
+        *[(age <= max_days, label) for label, max_days in AGING_BUCKETS if max_days is not None],
+        else_=AGING_BUCKETS[-1][0]
+    )
+    open_invoices = select(
+        bucket_label.label('bucket'),
+        models.Owner.preferred_payment_method.label('payment_method'),
+        APP.veterinarian_id,
+        func.concat(VET.first_name, ' ', VET.last_name).label('veterinarian_name'),
+        (INV.total_amount - INV.amount_paid).label('outstanding')
+    ).select_from(INV).outerjoin(INV.appointment).outerjoin(APP.pet).outerjoin(models.Pet.owner).outerjoin(
+        VET, VET.veterinarian_id == APP.veterinarian_id
+    ).where(
+        INV.payment_status.in_(OPEN_INVOICE_STATUSES),
+        INV.issue_date <= as_of
+    ).subquery('open_invoices')
+
+    bucket, method = open_invoices.c.bucket, open_invoices.c.payment_method
+    vet_id, vet_name = open_invoices.c.veterinarian_id, open_invoices.c.veterinarian_name
+    rows = db.execute(select(
+        bucket, method, vet_id, vet_name,
+        func.grouping(method).label('by_method'),
+        func.grouping(vet_id).label('by_vet'),
+        func.grouping(bucket).label('by_bucket'),
+        func.count().label('invoice_count'),
+        func.sum(open_invoices.c.outstanding).label('outstanding')
+    ).group_by(func.grouping_sets(
+        tuple_(bucket), tuple_(),
+        tuple_(method, bucket), tuple_(method),
+        tuple_(vet_id, vet_name, bucket), tuple_(vet_id, vet_name),
+    ))).all()
+
+    # Cada fila es un tramo o un subtotal; se reparten en total / por método / por vet
+    def empty_breakdown(**keys):
+        return {**keys, "invoice_count": 0, "outstanding": Decimal('0.00'),
+                "buckets": {label: Decimal('0.00') for label, _ in AGING_BUCKETS}}
+    total = empty_breakdown()
+    by_method, by_vet = {}, {}
+    for row in rows:
+        if row.by_method == 0:
+            target = by_method.setdefault(row.payment_method, empty_breakdown(payment_method=row.payment_method))
+        elif row.by_vet == 0:
+            target = by_vet.setdefault(row.veterinarian_id, empty_breakdown(
+                veterinarian_id=row.veterinarian_id, veterinarian_name=row.veterinarian_name))
+        else:
+            target = total
+        if row.by_bucket == 0:
+            target["buckets"][row.bucket] = row.outstanding
+        else:
+            target["invoice_count"] = row.invoice_count
+            target["outstanding"] = row.outstanding
+
+    report = {
+        "as_of": as_of,
+        "total": total,
+        "by_payment_method": sorted(by_method.values(), key=lambda b: b["outstanding"], reverse=True),
+        "by_veterinarian": sorted(by_vet.values(), key=lambda b: b["outstanding"], reverse=True),
+    }
+    return report_cache.set(cache_key, report)
+
 def get_popular_veterinarians(db: Session, limit: int = 5):
     # Reutiliza el contador 'total_appointments' que ya calculamos
     return db.query(models.Veterinarian).order_by(
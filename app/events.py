@@ -0,0 +1,211 @@
+"""
+Push de cambios en tiempo real: LISTEN/NOTIFY de Postgres -> Server-Sent Events.
+
+Cada worker mantiene UNA conexión dedicada con LISTEN sobre CHANNEL (los
+triggers de la migración M13 hacen NOTIFY al confirmar cambios en appointments,
+invoices y vaccination_records) y reparte cada evento entre sus suscriptores
+SSE (GET /events en main.py).
+
+- La conexión se integra en el event loop con 'add_reader': no ocupa un hilo
+  y miles de clientes inactivos solo cuestan una corrutina y una cola cada uno.
+- Cada suscriptor tiene una cola acotada. Si un cliente lento la llena, se le
+  envía 'resync' y se cierra su stream: debe reconectar y ponerse al día con
+  /changes (M12). Así un cliente lento no frena al resto ni acumula memoria.
+- Si se cae la conexión LISTEN se reintenta con espera creciente y todos los
+  suscriptores reciben 'resync', porque pudieron perderse eventos.
+"""
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Optional
+
+import psycopg2
+
+from .database import SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "clinica_changes"
+EVENT_TABLES = ("appointments", "invoices", "vaccination_records")
+
+QUEUE_SIZE = int(os.getenv("CLINICA_EVENTS_QUEUE_SIZE", "100"))
+MAX_SUBSCRIBERS = int(os.getenv("CLINICA_EVENTS_MAX_SUBSCRIBERS", "10000"))
+HEARTBEAT_SECONDS = 15.0
+RECONNECT_MAX_SECONDS = 30.0
+# Sin límite, un Postgres que no responde deja cada intento colgado el timeout de TCP
+CONNECT_TIMEOUT_SECONDS = int(os.getenv("CLINICA_EVENTS_CONNECT_TIMEOUT", "5"))
+
+# Evento de control: el cliente debe recargar (vía /changes) y reconectar
+RESYNC = {"table": None, "op": "resync"}
+
+
+@dataclass(eq=False)
+class Subscription:
+    tables: tuple = EVENT_TABLES
+    veterinarian_id: Optional[int] = None
+    day: Optional[date] = None
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=QUEUE_SIZE))
+    closed: bool = False
+
+    def matches(self, event: dict) -> bool:
+        if event["table"] not in self.tables:
+            return False
+        if self.veterinarian_id is not None and event.get("veterinarian_id") != self.veterinarian_id:
+            return False
+        if self.day is not None and event.get("date") != self.day.isoformat():
+            return False
+        return True
+
+    def push(self, event: dict):
+        """Encola sin bloquear; si la cola está llena, se cierra con 'resync'."""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(RESYNC)
+
+
+class EventBroker:
+    """Una conexión LISTEN por proceso, repartida entre todas las suscripciones."""
+
+    def __init__(self, dsn: str = SQLALCHEMY_DATABASE_URL):
+        self.dsn = dsn
+        self.subscriptions = set()
+        self.connection = None
+        self.loop = None
+        self._reconnect_task = None
+        self.events_received = 0
+
+    # --- Conexión ---
+    def start(self):
+        # La conexión se abre en segundo plano: el arranque del worker no espera a Postgres
+        self.loop = asyncio.get_running_loop()
+        self._schedule_reconnect(first_delay=0.0)
+
+    def stop(self):
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        self._disconnect()
+        for subscription in list(self.subscriptions):
+            subscription.close()
+
+    def _open_connection(self):
+        """Abre la conexión y hace LISTEN. Bloqueante: se ejecuta fuera del event loop."""
+        # Siempre contra el primario: los NOTIFY no llegan a las réplicas
+        connection = psycopg2.connect(self.dsn, connect_timeout=CONNECT_TIMEOUT_SECONDS)
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+        except psycopg2.Error:
+            connection.close()
+            raise
+        return connection
+
+    async def _connect(self):
+        self.connection = await self.loop.run_in_executor(None, self._open_connection)
+        self.loop.add_reader(self.connection.fileno(), self._on_readable)
+        logger.info("Escuchando '%s'", CHANNEL)
+
+    def _disconnect(self):
+        if self.connection is None:
+            return
+        try:
+            self.loop.remove_reader(self.connection.fileno())
+            self.connection.close()
+        except (psycopg2.Error, ValueError):
+            pass
+        self.connection = None
+
+    def _schedule_reconnect(self, first_delay: float = 1.0):
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = self.loop.create_task(self._reconnect(first_delay))
+
+    async def _reconnect(self, first_delay: float):
+        delay = first_delay
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                return
+            except psycopg2.Error as e:
+                delay = min(max(delay * 2, 1.0), RECONNECT_MAX_SECONDS)
+                logger.warning("Conexión LISTEN fallida (%s), reintento en %.0fs", str(e).strip(), delay)
+
+    def _on_readable(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.exception("Se perdió la conexión LISTEN")
+            self._disconnect()
+            # Pudieron perderse eventos: todos los clientes deben resincronizar
+            for subscription in list(self.subscriptions):
+                subscription.close()
+            self._schedule_reconnect()
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                logger.warning("Payload NOTIFY inválido: %r", notify.payload)
+                continue
+            self.publish(event)
+
+    # --- Suscripciones ---
+    def publish(self, event: dict):
+        self.events_received += 1
+        for subscription in list(self.subscriptions):
+            if subscription.matches(event):
+                subscription.push(event)
+
+    def subscribe(self, **filters) -> Subscription:
+        """Nueva suscripción; ValueError si el worker ya tiene MAX_SUBSCRIBERS."""
+        if len(self.subscriptions) >= MAX_SUBSCRIBERS:
+            raise ValueError("Too many subscribers")
+        subscription = Subscription(**filters)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+
+broker = EventBroker()
+
+
+def format_sse(event: dict, event_id: int) -> str:
+    """Serializa un evento con el formato de text/event-stream."""
+    name = event["op"] if event is RESYNC else event["table"]
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream(subscription: Subscription, is_disconnected):
+    """Generador SSE: eventos de 'subscription', un comentario de heartbeat si no hay tráfico."""
+    event_id = 0
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                # Mantiene viva la conexión a través de proxies
+                yield ": keepalive\n\n"
+                continue
+            event_id += 1
+            yield format_sse(event, event_id)
+            if event is RESYNC:
+                break
+    finally:
+        broker.unsubscribe(subscription)
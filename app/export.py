@@ -0,0 +1,233 @@
+"""
+Exportación analítica en Arrow IPC o Parquet (requiere el paquete 'pyarrow').
+
+    GET /exports/appointments?format=parquet&start_date=2026-01-01&end_date=2026-03-31
+    python -m app.export invoices --format arrow --after-id 120000 -o invoices.arrows
+
+En vez de paginar JSON, la consulta se lee con un cursor de servidor en lotes
+de BATCH_SIZE filas; cada lote se convierte en un RecordBatch y se escribe en
+cuanto está listo. La memoria queda acotada a un lote, sea cual sea el tamaño
+de la exportación.
+
+- Tipos a partir de app/models.py: Numeric -> decimal128(p, s), Enum ->
+  dictionary con los valores del enum (el mismo diccionario en todos los
+  lotes), Date -> date32, TIMESTAMP -> timestamp[us], Integer -> int32...
+- Rango de fechas sobre la columna de fecha de cada dataset. En citas y
+  facturas es la clave de partición (M8): solo se leen los meses pedidos.
+- Incremental: after_id devuelve solo las filas con id mayor (el orden es
+  siempre por id; el último id del fichero es el siguiente after_id). Las
+  filas que cambian después de creadas (estado de una cita, pago de una
+  factura) se recogen volviendo a exportar su rango de fechas.
+- Las columnas calculadas y diferidas (time_slot, search_vector) no se exportan.
+
+En pandas:  pd.read_parquet(path)  o  pyarrow.ipc.open_stream(path).read_pandas()
+"""
+import argparse
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Enum, Float, Integer, Numeric, SmallInteger, inspect, select
+
+from . import models
+from .database import read_engine
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él la exportación responde 501
+    pa = None
+
+BATCH_SIZE = int(os.getenv("CLINICA_EXPORT_BATCH_SIZE", "50000"))
+
+# dataset -> (modelo, columna de fecha para start_date/end_date)
+DATASETS = {
+    "appointments": (models.Appointment, "appointment_date"),
+    "invoices": (models.Invoice, "issue_date"),
+    "vaccinations": (models.VaccinationRecord, "vaccination_date"),
+    "medical_records": (models.MedicalRecord, "created_at"),
+}
+
+# formato -> (media type, extensión)
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def _arrow_type(column_type):
+    """Tipo Arrow para un tipo de columna de SQLAlchemy (string si no hay uno mejor)."""
+    # Enum hereda de String: va primero
+    if isinstance(column_type, Enum):
+        return pa.dictionary(pa.int8(), pa.string())
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, Numeric):
+        if column_type.precision is None:
+            return pa.decimal128(38, 10)
+        return pa.decimal128(column_type.precision, column_type.scale or 0)
+    if isinstance(column_type, BigInteger):
+        return pa.int64()
+    if isinstance(column_type, SmallInteger):
+        return pa.int16()
+    if isinstance(column_type, Integer):
+        return pa.int32()
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us", tz="UTC" if column_type.timezone else None)
+    if isinstance(column_type, Date):
+        return pa.date32()
+    # String, Text y cualquier otro tipo: texto
+    return pa.string()
+
+
+def _columns(model) -> list:
+    """Columnas exportables del modelo (sin las diferidas), en orden de declaración."""
+    return [prop.columns[0] for prop in inspect(model).column_attrs if not prop.deferred]
+
+
+def arrow_schema(dataset: str):
+    model, _ = DATASETS[dataset]
+    return pa.schema([pa.field(column.key, _arrow_type(column.type), nullable=column.nullable)
+                      for column in _columns(model)])
+
+
+def _to_array(column, values, field):
+    if pa.types.is_dictionary(field.type):
+        # Diccionario fijo (valores del enum): igual en todos los lotes, como exige el formato
+        dictionary = list(column.type.enums)
+        codes = {value: i for i, value in enumerate(dictionary)}
+        indices = pa.array([None if value is None else codes[value] for value in values], type=pa.int8())
+        return pa.DictionaryArray.from_arrays(indices, pa.array(dictionary, type=pa.string()))
+    if pa.types.is_string(field.type):
+        values = [None if value is None else str(value) for value in values]
+    return pa.array(values, type=field.type)
+
+
+def export_query(dataset: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                 after_id: Optional[int] = None):
+    """SELECT del dataset con los filtros, ordenado por id."""
+    model, date_attr = DATASETS[dataset]
+    pk = inspect(model).primary_key[0]
+    stmt = select(*_columns(model)).order_by(pk)
+    date_column = getattr(model, date_attr)
+    if isinstance(date_column.type, DateTime):
+        # Día completo en columnas TIMESTAMP: [start 00:00, end+1 00:00)
+        if start_date:
+            stmt = stmt.where(date_column >= datetime.combine(start_date, time.min))
+        if end_date:
+            stmt = stmt.where(date_column < datetime.combine(end_date + timedelta(days=1), time.min))
+    else:
+        if start_date:
+            stmt = stmt.where(date_column >= start_date)
+        if end_date:
+            stmt = stmt.where(date_column <= end_date)
+    if after_id is not None:
+        stmt = stmt.where(pk > after_id)
+    return stmt
+
+
+def record_batches(dataset: str, batch_size: int = BATCH_SIZE, **filters):
+    """RecordBatches del dataset leídos con un cursor de servidor (réplica de lectura)."""
+    model, _ = DATASETS[dataset]
+    columns = _columns(model)
+    schema = arrow_schema(dataset)
+    with read_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+            export_query(dataset, **filters))
+        for rows in result.partitions(batch_size):
+            values = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [_to_array(column, values[i], schema.field(i)) for i, column in enumerate(columns)],
+                schema=schema,
+            )
+
+
+class _ChunkSink:
+    """Destino de escritura para pyarrow que acumula bytes hasta que se recogen con drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream(dataset: str, export_format: str, batch_size: int = BATCH_SIZE, **filters):
+    """Genera los bytes del fichero (Arrow IPC stream o Parquet) lote a lote."""
+    schema = arrow_schema(dataset)
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode="w")
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(output, schema)
+    else:
+        writer = pa.ipc.new_stream(output, schema)
+    try:
+        for batch in record_batches(dataset, batch_size=batch_size, **filters):
+            # Parquet: un row group por lote
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def filename(dataset: str, export_format: str, start_date: Optional[date] = None,
+             end_date: Optional[date] = None, after_id: Optional[int] = None) -> str:
+    parts = [dataset]
+    if start_date or end_date:
+        parts.append(f"{start_date or 'inicio'}_{end_date or 'hoy'}")
+    if after_id is not None:
+        parts.append(f"after{after_id}")
+    return f"{'_'.join(parts)}.{FORMATS[export_format][1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta un dataset de la clínica a Arrow IPC o Parquet")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--format", dest="export_format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--start-date", type=date.fromisoformat)
+    parser.add_argument("--end-date", type=date.fromisoformat)
+    parser.add_argument("--after-id", type=int, help="Solo filas con id mayor (exportación incremental)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("-o", "--output", help="Fichero de salida (por defecto, nombre según filtros)")
+    args = parser.parse_args(argv)
+
+    if not available():
+        sys.exit("La exportación requiere 'pip install pyarrow'")
+    filters = {"start_date": args.start_date, "end_date": args.end_date, "after_id": args.after_id}
+    path = args.output or filename(args.dataset, args.export_format, **filters)
+    with open(path, "wb") as f:
+        for chunk in stream(args.dataset, args.export_format, batch_size=args.batch_size, **filters):
+            f.write(chunk)
+    print(f"{path}: {os.path.getsize(path)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Respuestas parciales: '?fields=pet_id,name,owner'.
+
+El parámetro recorta la respuesta y también la consulta:
+- solo se cargan las columnas de los campos pedidos (load_only; la PK siempre);
+- solo se hace JOIN de las relaciones pedidas, y el objeto anidado carga
+  solo las columnas de su schema (ej. OwnerSimple);
+- las relaciones no pedidas quedan en lazy load y nadie las toca.
+
+Los campos son los de primer nivel del schema de respuesta. Un campo anidado
+se pide entero ('owner'), no por partes. Los modelos parciales de Pydantic
+y las opciones de carga se crean una vez por combinación de campos y se
+reutilizan.
+"""
+import typing
+from functools import lru_cache
+
+from fastapi import Response
+from pydantic import BaseModel, ConfigDict, TypeAdapter, create_model
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, lazyload, load_only
+
+MAX_CACHED_SCHEMAS = 256
+
+
+def _nested_schema(annotation):
+    """Schema Pydantic dentro de una anotación (OwnerSimple, Optional[...], List[...]) o None."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in typing.get_args(annotation):
+        schema = _nested_schema(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+def _loader_options(model, schema, names) -> list:
+    """Opciones de carga del ORM para los campos 'names' de 'schema' sobre 'model'."""
+    mapper = inspect(model)
+    options, columns, full_columns = [], [], False
+    for name in names:
+        if name in mapper.column_attrs:
+            columns.append(getattr(model, name))
+        elif name in mapper.relationships:
+            loader = joinedload(getattr(model, name))
+            nested = _nested_schema(schema.model_fields[name].annotation)
+            if nested is not None:
+                target = mapper.relationships[name].mapper.class_
+                loader = loader.options(*_loader_options(target, nested, nested.model_fields))
+            options.append(loader)
+        elif hasattr(model, name):
+            # Propiedad de Python: puede leer cualquier columna o relación
+            full_columns = True
+        # Si el modelo no tiene el atributo, el schema usa su valor por defecto
+    if full_columns:
+        return options
+    options.append(load_only(*(columns or mapper.primary_key)))
+    options.append(lazyload("*"))
+    return options
+
+
+@lru_cache(maxsize=MAX_CACHED_SCHEMAS)
+def _partial(schema, names: frozenset):
+    """(modelo parcial, adaptador para listas) con solo los campos pedidos, en el orden del schema."""
+    fields = {name: (info.annotation, info) for name, info in schema.model_fields.items() if name in names}
+    partial = create_model(f"{schema.__name__}Fields", __config__=ConfigDict(from_attributes=True), **fields)
+    return partial, TypeAdapter(typing.List[partial])
+
+
+class FieldSet:
+    """Selección de campos de un schema de respuesta sobre un modelo."""
+
+    def __init__(self, schema, model, names: frozenset):
+        self.schema = schema
+        self.names = names
+        self.options = tuple(_loader_options(model, schema, names))
+
+    def render(self, result) -> Response:
+        """JSON con solo los campos pedidos, para un objeto o una lista de objetos."""
+        partial, list_adapter = _partial(self.schema, self.names)
+        if isinstance(result, list):
+            body = list_adapter.dump_json(list_adapter.validate_python(result, from_attributes=True))
+        else:
+            body = partial.model_validate(result).model_dump_json().encode()
+        return Response(content=body, media_type="application/json")
+
+
+@lru_cache(maxsize=MAX_CACHED_SCHEMAS)
+def _field_set(schema, model, names: frozenset) -> FieldSet:
+    return FieldSet(schema, model, names)
+
+
+def parse(raw: str, schema, model) -> FieldSet:
+    """FieldSet para '?fields=a,b,c'; ValueError si algún campo no existe en el schema."""
+    names = frozenset(name.strip() for name in raw.split(",") if name.strip())
+    if not names:
+        raise ValueError("fields must list at least one field")
+    unknown = names - schema.model_fields.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. "
+                         f"Allowed: {', '.join(schema.model_fields)}")
+    return _field_set(schema, model, names)
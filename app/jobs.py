@@ -0,0 +1,186 @@
+"""
+Tareas de mantenimiento de la clínica.
+
+Se pueden lanzar a mano (o desde cron):
+    python -m app.jobs partitions
+    python -m app.jobs partitions --interval 86400   # repetir cada día
+    python -m app.jobs invoices
+    python -m app.jobs overdue
+    python -m app.jobs prune-changes
+
+La API también ejecuta PERIODIC_JOBS en segundo plano mientras está arriba
+(ver 'lifespan' en main.py), pero solo en un proceso de todo el cluster: el
+que consigue el advisory lock PERIODIC_JOBS_LOCK_KEY en una conexión
+dedicada. El resto de workers (y de réplicas de la API) lo reintenta cada
+LEADER_CHECK_SECONDS y toma el relevo si el que lo tenía cae. Las tareas
+son idempotentes, así que tampoco pasa nada si además corren desde cron.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import psycopg2
+from starlette.concurrency import run_in_threadpool
+
+from . import crud
+from .database import SQLALCHEMY_DATABASE_URL, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Desactivar con CLINICA_RUN_PERIODIC_JOBS=0 si las tareas corren en cron
+RUN_PERIODIC_JOBS = os.getenv("CLINICA_RUN_PERIODIC_JOBS", "1") == "1"
+
+# Clave de pg_try_advisory_lock que elige el único proceso que ejecuta PERIODIC_JOBS
+PERIODIC_JOBS_LOCK_KEY = 7346021
+# Cada cuánto reintenta el lock un proceso sin él (y el que lo tiene comprueba que sigue vivo)
+LEADER_CHECK_SECONDS = 60.0
+
+
+# --- Tareas ---
+def ensure_partitions():
+    """Crea las particiones mensuales futuras de appointments e invoices (M8)."""
+    db = SessionLocal()
+    try:
+        created = crud.ensure_future_partitions(db)
+    finally:
+        db.close()
+    logger.info("Particiones creadas: %s", created)
+    return {"partitions_created": created}
+
+
+def generate_invoices():
+    """Factura las citas completadas que aún no tienen factura (M9)."""
+    db = SessionLocal()
+    try:
+        report = crud.generate_pending_invoices(db)
+    finally:
+        db.close()
+    logger.info("Facturas generadas: %(invoices_created)s (%(invoices_per_second)s/s)", report)
+    return report
+
+
+def mark_overdue_invoices():
+    """Marca como 'overdue' las facturas pendientes fuera de plazo (M11)."""
+    db = SessionLocal()
+    try:
+        report = crud.mark_overdue_invoices(db)
+    finally:
+        db.close()
+    logger.info("Facturas vencidas: %(invoices_marked)s en %(batches)s lotes", report)
+    return report
+
+
+def prune_change_log():
+    """Purga change_log más allá de la retención (M12)."""
+    db = SessionLocal()
+    try:
+        deleted = crud.prune_change_log(db)
+    finally:
+        db.close()
+    logger.info("Cambios purgados: %s", deleted)
+    return {"changes_pruned": deleted}
+
+
+JOBS = {
+    "partitions": ensure_partitions,
+    "invoices": generate_invoices,
+    "overdue": mark_overdue_invoices,
+    "prune-changes": prune_change_log,
+}
+
+# (tarea, intervalo en segundos) que la API ejecuta en segundo plano
+PERIODIC_JOBS = [
+    (ensure_partitions, 24 * 3600),
+    (generate_invoices, 15 * 60),
+    (mark_overdue_invoices, 3600),
+    (prune_change_log, 24 * 3600),
+]
+
+
+# --- Ejecución periódica dentro de la API ---
+async def run_periodically(job, interval: float):
+    """Ejecuta 'job' en el threadpool cada 'interval' segundos; los errores se registran y se reintenta."""
+    while True:
+        try:
+            await run_in_threadpool(job)
+        except Exception:
+            logger.exception("Falló la tarea periódica %s", job.__name__)
+        await asyncio.sleep(interval)
+
+def acquire_leadership(dsn: str = SQLALCHEMY_DATABASE_URL):
+    """Conexión dedicada con el advisory lock de las tareas periódicas, o None si lo tiene otro proceso.
+    El lock es de sesión: dura lo que la conexión."""
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (PERIODIC_JOBS_LOCK_KEY,))
+            acquired = cursor.fetchone()[0]
+    except Exception:
+        connection.close()
+        raise
+    if not acquired:
+        connection.close()
+        return None
+    return connection
+
+def still_leader(connection) -> bool:
+    """Si la conexión del lock se cayó, el lock se liberó y otro proceso puede tenerlo."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+async def run_as_leader():
+    """Espera a tener el advisory lock y entonces ejecuta PERIODIC_JOBS mientras lo conserve."""
+    while True:
+        connection = None
+        try:
+            connection = await run_in_threadpool(acquire_leadership)
+        except Exception:
+            logger.warning("No se pudo intentar el lock de tareas periódicas", exc_info=True)
+        if connection is None:
+            await asyncio.sleep(LEADER_CHECK_SECONDS)
+            continue
+
+        logger.info("Este proceso ejecuta las tareas periódicas")
+        tasks = [asyncio.create_task(run_periodically(job, interval)) for job, interval in PERIODIC_JOBS]
+        try:
+            while await run_in_threadpool(still_leader, connection):
+                await asyncio.sleep(LEADER_CHECK_SECONDS)
+            logger.warning("Perdida la conexión del lock de tareas periódicas; se vuelve a intentar")
+        finally:
+            for task in tasks:
+                task.cancel()
+            connection.close()
+
+def start_periodic_jobs():
+    """Lanza la elección de PERIODIC_JOBS como tarea asyncio. Devuelve las tareas para cancelarlas al apagar."""
+    if not RUN_PERIODIC_JOBS:
+        return []
+    return [asyncio.create_task(run_as_leader())]
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tareas de mantenimiento de la clínica")
+    parser.add_argument("job", choices=sorted(JOBS))
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Repetir la tarea cada N segundos (por defecto se ejecuta una vez)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    job = JOBS[args.job]
+    while True:
+        print(job())
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,126 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List
-from datetime import date, datetime
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+import csv
+import io
+import math
+import time
 
 # Importaciones locales
-from . import crud, models, schemas
-from .database import engine, get_db
-
-app = FastAPI(title="API Clínica Veterinaria")
+from . import admission, crud, events, export, fieldsets, jobs, models, schemas, sql_debug, warmup
+from .cache import RECEIVABLES_REPORT
+from .compression import CompressionMiddleware, cached_response
+from .singleflight import report_flight
+from .database import engine, read_engine, get_db, get_read_db, LAST_WRITE_COOKIE, READ_YOUR_WRITES_SECONDS
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mappers, pool y consultas calientes listos antes de aceptar tráfico (ver app/warmup.py)
+    warmup.run()
+    # Tareas de mantenimiento en segundo plano (particiones futuras, etc.)
+    periodic_tasks = jobs.start_periodic_jobs()
+    # Conexión LISTEN para el push de cambios por SSE (M13)
+    events.broker.start()
+    yield
+    events.broker.stop()
+    for task in periodic_tasks:
+        task.cancel()
+
+app = FastAPI(title="API Clínica Veterinaria", lifespan=lifespan)
 
 # --- Alias de Dependencia ---
 DbDep = Depends(get_db)
+ReadDbDep = Depends(get_read_db) # Endpoints GET: réplica de lectura
+
+# --- Paginación: máximos impuestos en el servidor ---
+MAX_PAGE_SIZE = 500
+SkipQuery = Query(0, ge=0)
+LimitQuery = Query(100, ge=1, le=MAX_PAGE_SIZE)
+# Multi-get: '?ids=1,2,3' en los listados sustituye a skip/limit
+IdsQuery = Query(None, description=f"Comma-separated ids (max {MAX_PAGE_SIZE}); ignores skip/limit")
+# Respuestas parciales: '?fields=a,b' recorta la respuesta y las columnas leídas (app/fieldsets.py)
+FieldsQuery = Query(None, description="Comma-separated top-level response fields")
+
+# --- Compresión gzip/brotli de respuestas grandes ---
+app.add_middleware(CompressionMiddleware)
+
+# --- Middleware read-your-writes ---
+@app.middleware("http")
+async def mark_recent_write(request: Request, call_next):
+    """Tras una escritura correcta, marca al cliente para que sus GET lean del primario."""
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(LAST_WRITE_COOKIE, str(time.time()),
+                            max_age=math.ceil(READ_YOUR_WRITES_SECONDS), httponly=True)
+    return response
+
+# --- Trazas de SQL por petición (solo con CLINICA_DEBUG_SQL=1, ver app/sql_debug.py) ---
+if sql_debug.ENABLED:
+    sql_debug.install(engine, read_engine)
+
+    @app.middleware("http")
+    async def debug_sql(request: Request, call_next):
+        mode = request.headers.get(sql_debug.HEADER, "").lower()
+        if mode not in sql_debug.MODES:
+            return await call_next(request)
+        token = sql_debug.start_trace(mode, request.method, request.url.path)
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            trace = sql_debug.end_trace(token, time.perf_counter() - started)
+        response.headers["X-Debug-SQL-Id"] = trace["id"]
+        response.headers["X-Debug-SQL-Summary"] = f"{len(trace['statements'])} statements; {trace['sql_ms']} ms"
+        return response
+
+@app.get("/debug/sql/{trace_id}", tags=["Debug"], include_in_schema=sql_debug.ENABLED)
+def read_sql_trace(trace_id: str):
+    trace = sql_debug.get_trace(trace_id) if sql_debug.ENABLED else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+# --- Control de admisión por clase de ruta (app/admission.py) ---
+# Se añade el último para ser el más externo: una petición descartada no pasa por nada más
+app.add_middleware(admission.AdmissionControlMiddleware)
+
+# --- Utils ---
+def parse_ids(raw: str) -> List[int]:
+    """Convierte '1,2,3' en [1, 2, 3]; 400 si algún valor no es entero."""
+    try:
+        return [int(value) for value in raw.split(',') if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+
+def get_many(db: Session, fetch, raw_ids: str, pk: str, **kwargs) -> list:
+    """Multi-get de '?ids=': una sola consulta, sin duplicados y en el orden pedido (los ids inexistentes se omiten)."""
+    ids = list(dict.fromkeys(parse_ids(raw_ids)))
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {MAX_PAGE_SIZE})")
+    if not ids:
+        return []
+    rows = {getattr(row, pk): row for row in fetch(db, ids, **kwargs)}
+    return [rows[i] for i in ids if i in rows]
+
+def field_set(raw_fields: Optional[str], schema, model, default_options: tuple):
+    """(FieldSet, opciones de carga) para '?fields='; (None, default_options) sin el parámetro."""
+    if raw_fields is None:
+        return None, default_options
+    try:
+        selection = fieldsets.parse(raw_fields, schema, model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return selection, selection.options
+
+def respond(selection, result):
+    """Con '?fields=' solo los campos pedidos; sin él, el response_model completo."""
+    return result if selection is None else selection.render(result)
 
 # === Endpoints Veterinarians ===
 @app.post("/veterinarians/", response_model=schemas.Veterinarian, status_code=status.HTTP_201_CREATED, tags=["Veterinarians"])
@@ -23,15 +132,41 @@ def create_veterinarian(vet: schemas.VeterinarianCreate, db: Session = DbDep):
     return crud.create_veterinarian(db=db, vet=vet)
 
 @app.get("/veterinarians/", response_model=List[schemas.Veterinarian], tags=["Veterinarians"])
-def read_veterinarians(skip: int = 0, limit: int = 100, db: Session = DbDep):
-    return crud.get_veterinarians(db, skip=skip, limit=limit)
+def read_veterinarians(skip: int = SkipQuery, limit: int = LimitQuery, ids: Optional[str] = IdsQuery,
+                       fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Veterinarian, models.Veterinarian, ())
+    if ids is not None:
+        return respond(selection, get_many(db, crud.get_veterinarians_by_ids, ids, "veterinarian_id", options=options))
+    return respond(selection, crud.get_veterinarians(db, skip=skip, limit=limit, options=options))
+
+# Debe ir antes de /veterinarians/{vet_id} para que 'availability' no se tome como id
+@app.get("/veterinarians/availability", response_model=List[schemas.VeterinarianAvailability], tags=["Veterinarians"])
+def read_veterinarians_availability(start_date: date, end_date: date, vet_ids: Optional[str] = None,
+                                    duration_minutes: int = Query(30, gt=0, le=480), db: Session = ReadDbDep):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must be on or after start_date")
+    if (end_date - start_date).days > 31:
+        raise HTTPException(status_code=400, detail="Date range cannot exceed 31 days")
+    availability = crud.get_veterinarians_availability(
+        db, start_date=start_date, end_date=end_date,
+        vet_ids=parse_ids(vet_ids) if vet_ids else None,
+        min_duration_minutes=duration_minutes
+    )
+    return [
+        schemas.VeterinarianAvailability(
+            veterinarian=schemas.VeterinarianSimple.model_validate(vet),
+            free_slots=[schemas.TimeSlot(start=start, end=end) for start, end in slots]
+        )
+        for vet, slots in availability
+    ]
 
 @app.get("/veterinarians/{vet_id}", response_model=schemas.Veterinarian, tags=["Veterinarians"])
-def read_veterinarian(vet_id: int, db: Session = DbDep):
-    db_vet = crud.get_veterinarian(db, vet_id=vet_id)
+def read_veterinarian(vet_id: int, fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Veterinarian, models.Veterinarian, ())
+    db_vet = crud.get_veterinarian(db, vet_id=vet_id, options=options)
     if db_vet is None:
         raise HTTPException(status_code=404, detail="Veterinarian not found")
-    return db_vet
+    return respond(selection, db_vet)
 
 @app.put("/veterinarians/{vet_id}", response_model=schemas.Veterinarian, tags=["Veterinarians"])
 def update_veterinarian(vet_id: int, vet: schemas.VeterinarianUpdate, db: Session = DbDep):
@@ -55,13 +190,13 @@ def delete_veterinarian(vet_id: int, db: Session = DbDep):
     return deleted_vet
 
 @app.get("/veterinarians/{vet_id}/appointments", response_model=List[schemas.Appointment], tags=["Veterinarians"])
-def read_vet_appointments(vet_id: int, db: Session = DbDep):
+def read_vet_appointments(vet_id: int, db: Session = ReadDbDep):
     if not crud.get_veterinarian(db, vet_id=vet_id):
         raise HTTPException(status_code=404, detail="Veterinarian not found")
     return crud.get_appointments_by_veterinarian(db=db, vet_id=vet_id)
 
 @app.get("/veterinarians/{vet_id}/schedule", response_model=List[schemas.Appointment], tags=["Veterinarians"])
-def read_vet_schedule(vet_id: int, date: date, db: Session = DbDep):
+def read_vet_schedule(vet_id: int, date: date, db: Session = ReadDbDep):
     if not crud.get_veterinarian(db, vet_id=vet_id):
         raise HTTPException(status_code=404, detail="Veterinarian not found")
     return crud.get_appointments_by_vet_and_date(db=db, vet_id=vet_id, date=date)
@@ -74,15 +209,20 @@ def create_owner(owner: schemas.OwnerCreate, db: Session = DbDep):
     return crud.create_owner(db=db, owner=owner)
 
 @app.get("/owners/", response_model=List[schemas.Owner], tags=["Owners"])
-def read_owners(skip: int = 0, limit: int = 100, db: Session = DbDep):
-    return crud.get_owners(db, skip=skip, limit=limit)
+def read_owners(skip: int = SkipQuery, limit: int = LimitQuery, ids: Optional[str] = IdsQuery,
+                fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Owner, models.Owner, crud.OWNER_LOAD)
+    if ids is not None:
+        return respond(selection, get_many(db, crud.get_owners_by_ids, ids, "owner_id", options=options))
+    return respond(selection, crud.get_owners(db, skip=skip, limit=limit, options=options))
 
 @app.get("/owners/{owner_id}", response_model=schemas.Owner, tags=["Owners"])
-def read_owner(owner_id: int, db: Session = DbDep):
-    db_owner = crud.get_owner(db, owner_id=owner_id)
+def read_owner(owner_id: int, fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Owner, models.Owner, crud.OWNER_LOAD)
+    db_owner = crud.get_owner(db, owner_id=owner_id, options=options)
     if db_owner is None:
         raise HTTPException(status_code=404, detail="Owner not found")
-    return db_owner
+    return respond(selection, db_owner)
 
 @app.put("/owners/{owner_id}", response_model=schemas.Owner, tags=["Owners"])
 def update_owner(owner_id: int, owner: schemas.OwnerUpdate, db: Session = DbDep):
@@ -104,13 +244,13 @@ def delete_owner(owner_id: int, db: Session = DbDep):
     return deleted_owner
 
 @app.get("/owners/{owner_id}/pets", response_model=List[schemas.Pet], tags=["Owners"])
-def read_owner_pets(owner_id: int, db: Session = DbDep):
+def read_owner_pets(owner_id: int, db: Session = ReadDbDep):
     if not crud.get_owner(db, owner_id=owner_id):
         raise HTTPException(status_code=404, detail="Owner not found")
     return crud.get_pets_by_owner(db=db, owner_id=owner_id)
 
 @app.get("/owners/{owner_id}/appointments", response_model=List[schemas.Appointment], tags=["Owners"])
-def read_owner_appointments(owner_id: int, db: Session = DbDep):
+def read_owner_appointments(owner_id: int, db: Session = ReadDbDep):
     if not crud.get_owner(db, owner_id=owner_id):
         raise HTTPException(status_code=404, detail="Owner not found")
     return crud.get_appointments_by_owner(db=db, owner_id=owner_id)
@@ -124,15 +264,20 @@ def create_pet(pet: schemas.PetCreate, db: Session = DbDep):
     return crud.get_pet(db, created_pet.pet_id)
 
 @app.get("/pets/", response_model=List[schemas.Pet], tags=["Pets"])
-def read_pets(skip: int = 0, limit: int = 100, db: Session = DbDep):
-    return crud.get_pets(db, skip=skip, limit=limit)
+def read_pets(skip: int = SkipQuery, limit: int = LimitQuery, ids: Optional[str] = IdsQuery,
+              fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Pet, models.Pet, crud.PET_LOAD)
+    if ids is not None:
+        return respond(selection, get_many(db, crud.get_pets_by_ids, ids, "pet_id", options=options))
+    return respond(selection, crud.get_pets(db, skip=skip, limit=limit, options=options))
 
 @app.get("/pets/{pet_id}", response_model=schemas.Pet, tags=["Pets"])
-def read_pet(pet_id: int, db: Session = DbDep):
-    db_pet = crud.get_pet(db, pet_id=pet_id)
+def read_pet(pet_id: int, fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Pet, models.Pet, crud.PET_LOAD)
+    db_pet = crud.get_pet(db, pet_id=pet_id, options=options)
     if db_pet is None:
         raise HTTPException(status_code=404, detail="Pet not found")
-    return db_pet
+    return respond(selection, db_pet)
 
 @app.put("/pets/{pet_id}", response_model=schemas.Pet, tags=["Pets"])
 def update_pet(pet_id: int, pet: schemas.PetUpdate, db: Session = DbDep):
@@ -156,19 +301,35 @@ def delete_pet(pet_id: int, db: Session = DbDep):
 
 # --- Endpoints Relacionales de Pets (M1, M2) ---
 @app.get("/pets/{pet_id}/medical-history", response_model=List[schemas.MedicalRecord], tags=["Pets", "Medical Records"])
-def read_pet_medical_history(pet_id: int, db: Session = DbDep):
+def read_pet_medical_history(pet_id: int, db: Session = ReadDbDep):
     if not crud.get_pet(db, pet_id=pet_id):
         raise HTTPException(status_code=404, detail="Pet not found")
     return crud.get_medical_records_by_pet(db=db, pet_id=pet_id)
 
 @app.get("/pets/{pet_id}/vaccinations", response_model=List[schemas.VaccinationRecord], tags=["Pets", "Vaccination Records"])
-def read_pet_vaccinations(pet_id: int, db: Session = DbDep):
+def read_pet_vaccinations(pet_id: int, db: Session = ReadDbDep):
     if not crud.get_pet(db, pet_id=pet_id):
         raise HTTPException(status_code=404, detail="Pet not found")
     return crud.get_vaccinations_by_pet(db=db, pet_id=pet_id)
 
+@app.get("/pets/{pet_id}/timeline", response_model=schemas.PetTimeline, tags=["Pets"])
+def read_pet_timeline(pet_id: int, limit: int = Query(50, ge=1, le=200), before: Optional[str] = None,
+                      db: Session = ReadDbDep):
+    db_pet = crud.get_pet(db, pet_id=pet_id)
+    if db_pet is None:
+        raise HTTPException(status_code=404, detail="Pet not found")
+    try:
+        events, next_cursor = crud.get_pet_timeline(db, pet_id=pet_id, limit=limit, before=before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return schemas.PetTimeline(
+        pet=db_pet,
+        events=[schemas.TimelineEvent.model_validate(event) for event in events],
+        next_cursor=next_cursor
+    )
+
 @app.get("/pets/{pet_id}/vaccination-schedule", response_model=List[schemas.VaccinationRecord], tags=["Pets", "Vaccination Records"])
-def read_pet_vaccination_schedule(pet_id: int, db: Session = DbDep):
+def read_pet_vaccination_schedule(pet_id: int, db: Session = ReadDbDep):
     if not crud.get_pet(db, pet_id=pet_id):
         raise HTTPException(status_code=404, detail="Pet not found")
     return crud.get_vaccination_schedule_by_pet(db=db, pet_id=pet_id)
@@ -177,30 +338,47 @@ def read_pet_vaccination_schedule(pet_id: int, db: Session = DbDep):
 # === Endpoints Appointments ===
 @app.post("/appointments/", response_model=schemas.Appointment, status_code=status.HTTP_201_CREATED, tags=["Appointments"])
 def create_appointment(appt: schemas.AppointmentCreate, db: Session = DbDep):
-    created_appt = crud.create_appointment(db=db, appt=appt)
+    if appt.status in crud.BUSY_APPOINTMENT_STATUSES and \
+            crud.get_conflicting_appointment(db, vet_id=appt.veterinarian_id, start=appt.appointment_date,
+                                             duration_minutes=appt.duration_minutes):
+        raise HTTPException(status_code=409, detail="Veterinarian already has an appointment in that time slot")
+    try:
+        created_appt = crud.create_appointment(db=db, appt=appt)
+    except IntegrityError:
+        # Carrera con otra reserva: la restricción 'appointments_no_overlap' (M7) la rechazó
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Veterinarian already has an appointment in that time slot")
     if created_appt is None:
         raise HTTPException(status_code=404, detail="Pet or Veterinarian not found")
     # Recargar para obtener relaciones
     return crud.get_appointment(db, created_appt.appointment_id)
 
 @app.get("/appointments/", response_model=List[schemas.Appointment], tags=["Appointments"])
-def read_appointments(skip: int = 0, limit: int = 100, db: Session = DbDep):
-    return crud.get_appointments(db, skip=skip, limit=limit)
+def read_appointments(skip: int = SkipQuery, limit: int = LimitQuery, ids: Optional[str] = IdsQuery,
+                      fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Appointment, models.Appointment, crud.APPOINTMENT_LIST_LOAD)
+    if ids is not None:
+        return respond(selection, get_many(db, crud.get_appointments_by_ids, ids, "appointment_id", options=options))
+    return respond(selection, crud.get_appointments(db, skip=skip, limit=limit, options=options))
 
 @app.get("/appointments/today", response_model=List[schemas.Appointment], tags=["Appointments"])
-def read_appointments_today(db: Session = DbDep):
+def read_appointments_today(db: Session = ReadDbDep):
     return crud.get_appointments_by_status_or_date(db=db, date=date.today())
 
 @app.get("/appointments/pending", response_model=List[schemas.Appointment], tags=["Appointments"])
-def read_pending_appointments(db: Session = DbDep):
-    return crud.get_appointments_by_status_or_date(db=db, status='scheduled')
+def read_pending_appointments(since: Optional[date] = None, db: Session = ReadDbDep):
+    # Sin 'since', las de los últimos PENDING_APPOINTMENTS_LOOKBACK_DAYS días y futuras
+    if since is None:
+        since = date.today() - timedelta(days=crud.PENDING_APPOINTMENTS_LOOKBACK_DAYS)
+    return crud.get_appointments_by_status_or_date(db=db, status='scheduled', since=since)
 
 @app.get("/appointments/{appt_id}", response_model=schemas.Appointment, tags=["Appointments"])
-def read_appointment(appt_id: int, db: Session = DbDep):
-    db_appt = crud.get_appointment(db, appt_id=appt_id)
+def read_appointment(appt_id: int, fields: Optional[str] = FieldsQuery, db: Session = ReadDbDep):
+    selection, options = field_set(fields, schemas.Appointment, models.Appointment, crud.APPOINTMENT_LOAD)
+    db_appt = crud.get_appointment(db, appt_id=appt_id, options=options)
     if db_appt is None:
         raise HTTPException(status_code=404, detail="Appointment not found")
-    return db_appt
+    return respond(selection, db_appt)
 
 @app.put("/appointments/{appt_id}", response_model=schemas.Appointment, tags=["Appointments"])
 def update_appointment(appt_id: int, appt: schemas.AppointmentUpdate, db: Session = DbDep):
@@ -211,8 +389,20 @@ def update_appointment(appt_id: int, appt: schemas.AppointmentUpdate, db: Sessio
         raise HTTPException(status_code=400, detail=f"Pet with id {appt.pet_id} not found")
     if appt.veterinarian_id and appt.veterinarian_id != db_appt.veterinarian_id and not crud.get_veterinarian(db, vet_id=appt.veterinarian_id):
         raise HTTPException(status_code=400, detail=f"Veterinarian with id {appt.veterinarian_id} not found")
-    
-    updated_appt = crud.update_appointment(db=db, db_appt=db_appt, appt_update=appt)
+
+    # Validar solapamiento con la franja resultante (M7)
+    new_status = appt.status or db_appt.status
+    if new_status in crud.BUSY_APPOINTMENT_STATUSES and \
+            crud.get_conflicting_appointment(db, vet_id=appt.veterinarian_id or db_appt.veterinarian_id,
+                                             start=appt.appointment_date or db_appt.appointment_date,
+                                             duration_minutes=appt.duration_minutes or db_appt.duration_minutes,
+                                             exclude_id=db_appt.appointment_id):
+        raise HTTPException(status_code=409, detail="Veterinarian already has an appointment in that time slot")
+    try:
+        updated_appt = crud.update_appointment(db=db, db_appt=db_appt, appt_update=appt)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Veterinarian already has an appointment in that time slot")
     return crud.get_appointment(db, updated_appt.appointment_id) # Recargar
 
 @app.put("/appointments/{appt_id}/complete", response_model=schemas.Appointment, tags=["Appointments"])
@@ -260,11 +450,34 @@ def create_medical_record(record: schemas.MedicalRecordCreate, db: Session = DbD
     return crud.create_medical_record(db=db, record=record)
 
 @app.get("/medical-records/", response_model=List[schemas.MedicalRecord], tags=["Medical Records"])
-def read_medical_records(skip: int = 0, limit: int = 100, db: Session = DbDep):
+def read_medical_records(skip: int = SkipQuery, limit: int = LimitQuery, db: Session = ReadDbDep):
     return db.query(models.MedicalRecord).offset(skip).limit(limit).all()
 
+# Debe ir antes de /medical-records/{record_id} para que 'search' no se tome como id
+@app.get("/medical-records/search", response_model=schemas.MedicalRecordSearchPage, tags=["Medical Records"])
+def search_medical_records(q: str = Query(..., min_length=2), species: Optional[schemas.SpeciesEnum] = None,
+                           vet_id: Optional[int] = None, start_date: Optional[date] = None,
+                           end_date: Optional[date] = None, limit: int = Query(20, ge=1, le=100),
+                           cursor: Optional[str] = None, db: Session = ReadDbDep):
+    try:
+        rows, next_cursor = crud.search_medical_records(
+            db, q=q, species=species.value if species else None, vet_id=vet_id,
+            start_date=start_date, end_date=end_date, limit=limit, cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    items = [
+        schemas.MedicalRecordSearchHit(
+            **schemas.MedicalRecord.model_validate(row.MedicalRecord).model_dump(),
+            rank=row.rank, pet_id=row.pet_id, species=row.species,
+            veterinarian_id=row.veterinarian_id, appointment_date=row.appointment_date
+        )
+        for row in rows
+    ]
+    return schemas.MedicalRecordSearchPage(items=items, next_cursor=next_cursor)
+
 @app.get("/medical-records/{record_id}", response_model=schemas.MedicalRecord, tags=["Medical Records"])
-def read_medical_record(record_id: int, db: Session = DbDep):
+def read_medical_record(record_id: int, db: Session = ReadDbDep):
     db_record = crud.get_medical_record(db, record_id=record_id)
     if db_record is None:
         raise HTTPException(status_code=404, detail="Medical record not found")
@@ -287,7 +500,7 @@ def create_vaccine(vaccine: schemas.VaccineCreate, db: Session = DbDep):
     return crud.create_vaccine(db=db, vaccine=vaccine)
 
 @app.get("/vaccines/", response_model=List[schemas.Vaccine], tags=["Vaccines"])
-def read_vaccines(skip: int = 0, limit: int = 100, db: Session = DbDep):
+def read_vaccines(skip: int = SkipQuery, limit: int = LimitQuery, db: Session = ReadDbDep):
     return crud.get_vaccines(db, skip=skip, limit=limit)
 
 
@@ -305,21 +518,72 @@ def create_vaccination_record(record: schemas.VaccinationRecordCreate, db: Sessi
     return crud.get_vaccination_record(db, record_id=created_record.vaccination_id)
 
 @app.get("/vaccination-records/", response_model=List[schemas.VaccinationRecord], tags=["Vaccination Records"])
-def read_vaccination_records(skip: int = 0, limit: int = 100, db: Session = DbDep):
+def read_vaccination_records(skip: int = SkipQuery, limit: int = LimitQuery, db: Session = ReadDbDep):
     return crud.get_vaccination_records(db, skip=skip, limit=limit)
 
 
 # === Endpoints Invoices (M4) ===
 @app.get("/invoices/", response_model=List[schemas.Invoice], tags=["Invoices"])
-def read_invoices(skip: int = 0, limit: int = 100, db: Session = DbDep):
+def read_invoices(skip: int = SkipQuery, limit: int = LimitQuery, db: Session = ReadDbDep):
     return crud.get_invoices(db, skip=skip, limit=limit)
 
 @app.get("/invoices/pending", response_model=List[schemas.Invoice], tags=["Invoices"])
-def read_pending_invoices(skip: int = 0, limit: int = 100, db: Session = DbDep):
+def read_pending_invoices(skip: int = SkipQuery, limit: int = LimitQuery, db: Session = ReadDbDep):
     return crud.get_pending_invoices(db, skip=skip, limit=limit)
 
+@app.post("/invoices/generate", response_model=schemas.InvoiceGenerationReport, tags=["Invoices"])
+def generate_invoices(batch_size: int = Query(1000, ge=1, le=10000), max_batches: Optional[int] = Query(None, ge=1),
+                      db: Session = DbDep):
+    # Factura las citas completadas sin factura (también lo hace la tarea periódica de jobs.py)
+    return crud.generate_pending_invoices(db, batch_size=batch_size, max_batches=max_batches)
+
+@app.post("/invoices/mark-overdue", response_model=schemas.OverdueSweepReport, tags=["Invoices"])
+def mark_overdue_invoices(terms_days: int = Query(30, ge=0), batch_size: int = Query(1000, ge=1, le=10000),
+                          db: Session = DbDep):
+    # Lo mismo que la tarea periódica 'overdue' de jobs.py, a demanda
+    return crud.mark_overdue_invoices(db, terms_days=terms_days, batch_size=batch_size)
+
+def pay_invoices_batch(payments: List[schemas.InvoicePayment], db: Session) -> schemas.InvoicePaymentBatchReport:
+    if len(payments) > crud.PAYMENT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"A batch cannot exceed {crud.PAYMENT_BATCH_MAX_SIZE} payments")
+    results = [schemas.InvoicePaymentResult(**row) for row in crud.apply_invoice_payments(db, payments)]
+    counts = {result: 0 for result in schemas.InvoicePaymentResultEnum}
+    for r in results:
+        counts[r.result] += 1
+    return schemas.InvoicePaymentBatchReport(
+        applied=counts[schemas.InvoicePaymentResultEnum.applied],
+        overpaid=counts[schemas.InvoicePaymentResultEnum.overpaid],
+        already_paid=counts[schemas.InvoicePaymentResultEnum.already_paid],
+        not_found=counts[schemas.InvoicePaymentResultEnum.not_found],
+        total_applied=sum((r.amount for r in results if r.invoice_id is not None), Decimal('0.00')),
+        results=results
+    )
+
+@app.post("/invoices/pay-batch", response_model=schemas.InvoicePaymentBatchReport, tags=["Invoices"])
+def pay_invoices(payments: List[schemas.InvoicePayment], db: Session = DbDep):
+    return pay_invoices_batch(payments, db)
+
+@app.post("/invoices/pay-batch/upload", response_model=schemas.InvoicePaymentBatchReport, tags=["Invoices"])
+def pay_invoices_upload(file: UploadFile = File(...), db: Session = DbDep):
+    # CSV con cabecera: invoice_number,amount,payment_date (payment_date opcional)
+    try:
+        # strict: una comilla mal cerrada es un error, no un campo mal partido en silencio
+        reader = csv.DictReader(io.StringIO(file.file.read().decode('utf-8-sig')), strict=True)
+        payments = []
+        for line, row in enumerate(reader, start=2):
+            try:
+                payments.append(schemas.InvoicePayment(**{k: v for k, v in row.items() if k and v}))
+            except ValidationError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid payment on line {line}: {e.errors()[0]['msg']}")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded CSV")
+    except csv.Error as e:
+        # Comilla sin cerrar, campo enorme, byte NUL (Python < 3.11)...
+        raise HTTPException(status_code=400, detail=f"Malformed CSV: {e}")
+    return pay_invoices_batch(payments, db)
+
 @app.get("/invoices/{invoice_id}", response_model=schemas.Invoice, tags=["Invoices"])
-def read_invoice(invoice_id: int, db: Session = DbDep):
+def read_invoice(invoice_id: int, db: Session = ReadDbDep):
     db_invoice = crud.get_invoice(db, invoice_id=invoice_id)
     if db_invoice is None:
         raise HTTPException(status_code=404, detail="Invoice not found")
@@ -335,18 +599,148 @@ def pay_invoice(invoice_id: int, db: Session = DbDep):
     return crud.mark_invoice_as_paid(db=db, db_invoice=db_invoice)
 
 
+# === Endpoints Feed de Cambios (M12) ===
+# Sincronización incremental: el cliente carga los listados una vez, pide
+# /changes/head y después solo /changes?since=<cursor> con el cursor devuelto.
+CHANGE_FEED_SCHEMAS = {
+    'owners': schemas.Owner,
+    'pets': schemas.Pet,
+    'appointments': schemas.Appointment,
+    'invoices': schemas.Invoice,
+}
+
+def change_cursor(txid: int, seq: int) -> str:
+    # Se guarda cuándo se emitió para detectar cursores más viejos que la retención de change_log
+    return crud.encode_cursor(txid, seq, int(time.time()))
+
+@app.get("/changes/head", response_model=schemas.ChangeFeedHead, tags=["Changes"])
+def read_changes_head(db: Session = ReadDbDep):
+    # Pedirlo ANTES de cargar los listados completos
+    return schemas.ChangeFeedHead(cursor=change_cursor(*crud.get_change_feed_head(db)))
+
+@app.get("/changes", response_model=schemas.ChangeFeedPage, tags=["Changes"])
+def read_changes(since: str, limit: int = Query(500, ge=1, le=5000), db: Session = ReadDbDep):
+    try:
+        since_txid, since_seq, issued_at = crud.decode_cursor(since, int, int, int)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Un día de margen: un cambio puede registrarse algo antes de que el cursor lo alcance
+    if time.time() - issued_at > (crud.CHANGE_LOG_RETENTION_DAYS - 1) * 86400:
+        raise HTTPException(status_code=410, detail="Cursor expired; reload the full lists and call /changes/head")
+
+    changes, (txid, seq), has_more = crud.get_changes(db, since_txid, since_seq, limit=limit)
+    return schemas.ChangeFeedPage(
+        changes=[
+            schemas.Change(
+                table=table, row_id=row_id,
+                op=schemas.ChangeOpEnum.delete if row is None else schemas.ChangeOpEnum.upsert,
+                data=None if row is None else CHANGE_FEED_SCHEMAS[table].model_validate(row).model_dump(mode='json')
+            )
+            for table, row_id, row in changes
+        ],
+        next_cursor=change_cursor(txid, seq),
+        has_more=has_more
+    )
+
+
+# === Endpoints Eventos en tiempo real (M13) ===
+# Server-Sent Events alimentados por LISTEN/NOTIFY. Sin sesión de BD: un
+# cliente conectado no ocupa conexión del pool. Ante un evento 'resync' el
+# cliente debe ponerse al día con /changes y volver a conectar.
+@app.get("/events", tags=["Events"])
+async def stream_events(
+    request: Request,
+    tables: Optional[str] = None,
+    vet_id: Optional[int] = None,
+    day: Optional[date] = Query(None, alias="date"),
+):
+    filters = {"veterinarian_id": vet_id, "day": day}
+    if tables:
+        selected = tuple(t.strip() for t in tables.split(',') if t.strip())
+        unknown = set(selected) - set(events.EVENT_TABLES)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown tables: {', '.join(sorted(unknown))}")
+        filters["tables"] = selected
+    try:
+        subscription = events.broker.subscribe(**filters)
+    except ValueError:
+        raise HTTPException(status_code=503, detail="Too many event subscribers, retry later",
+                            headers={"Retry-After": "30"})
+    return StreamingResponse(
+        events.stream(subscription, request.is_disconnected),
+        media_type="text/event-stream",
+        # Sin buffering en proxies (nginx) para que los eventos salgan al instante
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# === Endpoints Exportaciones analíticas ===
+# Arrow IPC / Parquet en streaming, con cursor de servidor en la réplica (ver app/export.py).
+# Clase 'exports' del control de admisión: pocas a la vez.
+@app.get("/exports/{dataset}", tags=["Exports"])
+def export_dataset(dataset: str, format: str = "parquet", start_date: Optional[date] = None,
+                   end_date: Optional[date] = None, after_id: Optional[int] = Query(None, ge=0)):
+    if not export.available():
+        raise HTTPException(status_code=501, detail="Export requires the pyarrow package")
+    if dataset not in export.DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset. Available: {', '.join(export.DATASETS)}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(export.FORMATS)}")
+    if start_date and end_date and end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must be on or after start_date")
+    filters = {"start_date": start_date, "end_date": end_date, "after_id": after_id}
+    media_type, _ = export.FORMATS[format]
+    return StreamingResponse(
+        export.stream(dataset, format, **filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(dataset, format, **filters)}"'},
+    )
+
+
 # === Endpoints Reports (M5) ===
+# Peticiones idénticas simultáneas comparten una sola ejecución (app/singleflight.py)
+def flight_params(db: Session, **params) -> dict:
+    """Parámetros normalizados para la clave de coalescencia, incluida la BD de origen:
+    un cliente que lee del primario (read-your-writes) no recibe un resultado de la réplica."""
+    return {**params, "primary": db.get_bind() is engine}
+
+
 @app.get("/reports/revenue", response_model=schemas.RevenueReport, tags=["Reports"])
-def report_revenue(start_date: date, end_date: date, db: Session = DbDep):
-    total = crud.get_revenue_report(db, start_date=start_date, end_date=end_date)
-    return schemas.RevenueReport(start_date=start_date, end_date=end_date, total_revenue=total)
+def report_revenue(start_date: date, end_date: date, db: Session = ReadDbDep):
+    return report_flight.do("reports/revenue", flight_params(db, start_date=start_date, end_date=end_date), lambda: (
+        schemas.RevenueReport(start_date=start_date, end_date=end_date,
+                              total_revenue=crud.get_revenue_report(db, start_date=start_date, end_date=end_date))
+    ))
+
+@app.get("/reports/receivables", response_model=schemas.ReceivablesReport, tags=["Reports"])
+def report_receivables(request: Request, db: Session = DbDep):
+    # Lee del primario: el resultado se cachea todo el día, y calcularlo en una
+    # réplica atrasada dejaría cacheado un dato viejo hasta la próxima invalidación.
+    # Se cachean los bytes ya comprimidos: repetir la petición no consulta ni comprime.
+    return cached_response(request, (RECEIVABLES_REPORT, date.today()), lambda: (
+        schemas.ReceivablesReport.model_validate(crud.get_receivables_report(db)).model_dump_json().encode()
+    ))
 
 @app.get("/reports/popular-veterinarians", response_model=List[schemas.Veterinarian], tags=["Reports"])
-def report_popular_veterinarians(db: Session = DbDep):
+def report_popular_veterinarians(db: Session = ReadDbDep):
     # Simplemente devuelve los Vets ordenados por 'total_appointments'
-    return crud.get_popular_veterinarians(db)
+    return report_flight.do("reports/popular-veterinarians", flight_params(db), lambda: [
+        schemas.Veterinarian.model_validate(vet) for vet in crud.get_popular_veterinarians(db)
+    ])
 
 @app.get("/reports/vaccination-alerts", response_model=List[schemas.VaccinationRecord], tags=["Reports"])
-def report_vaccination_alerts(db: Session = DbDep):
+def report_vaccination_alerts(db: Session = ReadDbDep):
     # Por defecto, busca vacunas para los próximos 30 días
-    return crud.get_vaccination_alerts(db)
\ No newline at end of file
+    return report_flight.do("reports/vaccination-alerts", flight_params(db), lambda: [
+        schemas.VaccinationRecord.model_validate(record) for record in crud.get_vaccination_alerts(db)
+    ])
+
+# === Métricas ===
+@app.get("/metrics", tags=["Metrics"])
+def read_metrics():
+    """Contadores del proceso (cada worker tiene los suyos)."""
+    return {
+        "admission": admission.stats(),
+        "coalescing": report_flight.stats(),
+        "event_subscribers": len(events.broker.subscriptions),
+    }
\ No newline at end of file
@@ -0,0 +1,482 @@
+"""
+Ensayo con perfilado de migraciones sobre una copia de la BD.
+
+Antes de aplicar una migración en producción, se ensaya en una BD scratch:
+
+    python -m app.migration_profiler b9d925015eb2
+    python -m app.migration_profiler head --fraction 0.05 --downgrade --online
+
+Pasos:
+  1. Crea (o recrea) la BD scratch en el mismo servidor y la sube con Alembic
+     hasta la revisión actual de la BD origen (mismo esquema).
+  2. Copia una muestra de los datos: una fracción de 'owners' y todo lo que
+     cuelga de ellos (pets, appointments, ...); las tablas maestras que no
+     dependen de owners (veterinarians, vaccines) se copian completas.
+  3. Ejecuta el upgrade (y el downgrade con --downgrade) migración a migración
+     y, por cada sentencia, mide tiempo, filas, bloqueos tomados y cambio de
+     tamaño de tablas e índices.
+  4. Extrapola tiempos y tamaños al volumen real con el factor
+     (filas en origen / filas en la muestra) de las tablas afectadas.
+
+La BD origen solo se lee. La scratch se borra al final salvo con --keep.
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import MetaData, Table, create_engine, event, text
+from sqlalchemy.engine import make_url
+
+from .database import SQLALCHEMY_DATABASE_URL
+
+DEFAULT_SCRATCH_DB = "clinica_db_profile"
+DEFAULT_FRACTION = 0.1
+
+# Raíces del muestreo: de estas tablas se copia solo una fracción
+SAMPLE_ROOTS = ("owners",)
+
+# Tablas que no se copian (metadatos de Alembic, backups, tablas que llenan triggers)
+SKIP_TABLES = ("alembic_version", "alembic_backfill_checkpoints", "invoice_keys")
+SKIP_PREFIXES = ("backup_",)
+
+# Relaciones sin FK real (desde M8 las mantienen triggers): (tabla, columna) -> (tabla, columna)
+EXTRA_REFERENCES = {
+    ("medical_records", "appointment_id"): ("appointments", "appointment_id"),
+    ("invoices", "appointment_id"): ("appointments", "appointment_id"),
+}
+
+COPY_BATCH_SIZE = 1000
+LOCK_POLL_SECONDS = 0.02
+
+# Modos de bloqueo de menor a mayor
+LOCK_MODES = [
+    "AccessShareLock", "RowShareLock", "RowExclusiveLock", "ShareUpdateExclusiveLock",
+    "ShareLock", "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock",
+]
+
+# Relación (tabla, índice o partición) -> tabla "lógica" a la que pertenece
+RELATION_OWNER_SQL = """
+    SELECT c.relname, coalesce(parent.relname, tbl.relname, c.relname)
+    FROM pg_class c
+    LEFT JOIN pg_index i ON i.indexrelid = c.oid
+    LEFT JOIN pg_class tbl ON tbl.oid = i.indrelid
+    LEFT JOIN pg_inherits h ON h.inhrelid = coalesce(tbl.oid, c.oid)
+    LEFT JOIN pg_class parent ON parent.oid = h.inhparent
+    WHERE c.relnamespace = 'public'::regnamespace
+"""
+
+SIZES_SQL = """
+    SELECT c.relname, pg_relation_size(c.oid)
+    FROM pg_class c
+    WHERE c.relnamespace = 'public'::regnamespace AND c.relkind IN ('r', 'i', 'p', 'I', 't')
+"""
+
+LOCKS_SQL = """
+    SELECT c.relname, l.mode
+    FROM pg_locks l JOIN pg_class c ON c.oid = l.relation
+    WHERE l.pid = %s AND l.granted AND l.locktype = 'relation'
+      AND c.relnamespace = 'public'::regnamespace
+"""
+
+
+def _format_bytes(size: float) -> str:
+    sign = "-" if size < 0 else "+"
+    size = abs(size)
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{sign}{size:.0f}{unit}" if unit == "B" else f"{sign}{size:.1f}{unit}"
+        size /= 1024
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    if seconds < 120:
+        return f"{seconds:.1f}s"
+    return f"{seconds / 60:.1f}min"
+
+
+def _strongest(modes) -> str:
+    return max(modes, key=LOCK_MODES.index)
+
+
+# --- BD scratch ---
+def create_scratch_database(source_url, name: str):
+    """(Re)crea la BD 'name' en el mismo servidor que 'source_url' y devuelve su URL."""
+    admin_engine = create_engine(source_url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    with admin_engine.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    admin_engine.dispose()
+    return source_url.set(database=name)
+
+
+def drop_scratch_database(source_url, name: str):
+    admin_engine = create_engine(source_url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    with admin_engine.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    admin_engine.dispose()
+
+
+def alembic_config(connection, online: bool = False) -> Config:
+    """Config de Alembic que corre sobre 'connection' (ver alembic/env.py)."""
+    cfg = Config("alembic.ini")
+    cfg.attributes["connection"] = connection
+    cfg.attributes["online_migrations"] = online
+    return cfg
+
+
+def _table_references(conn, tables: list) -> dict:
+    """{tabla: [(columnas, tabla_padre, columnas_padre)]} con las FK reales más EXTRA_REFERENCES."""
+    rows = conn.execute(text("""
+        SELECT con.conrelid::regclass::text, con.confrelid::regclass::text,
+               array(SELECT attname FROM pg_attribute WHERE attrelid = con.conrelid AND attnum = ANY(con.conkey) ORDER BY array_position(con.conkey, attnum)),
+               array(SELECT attname FROM pg_attribute WHERE attrelid = con.confrelid AND attnum = ANY(con.confkey) ORDER BY array_position(con.confkey, attnum))
+        FROM pg_constraint con
+        WHERE con.contype = 'f' AND con.connamespace = 'public'::regnamespace
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits h WHERE h.inhrelid = con.conrelid)
+    """)).fetchall()
+    references = defaultdict(list)
+    for child, parent, columns, parent_columns in rows:
+        if child in tables and parent in tables and child != parent:
+            references[child].append((tuple(columns), parent, tuple(parent_columns)))
+    for (child, column), (parent, parent_column) in EXTRA_REFERENCES.items():
+        if child in tables and parent in tables:
+            references[child].append(((column,), parent, (parent_column,)))
+    return references
+
+
+def _sorted_tables(tables: list, references: dict) -> list:
+    """Ordena 'tables' para que cada tabla vaya después de las que referencia."""
+    ordered, pending = [], list(tables)
+    while pending:
+        ready = [t for t in pending if all(parent in ordered for _, parent, _ in references.get(t, []))]
+        if not ready:
+            raise RuntimeError(f"Referencias circulares entre: {', '.join(pending)}")
+        ordered.extend(ready)
+        pending = [t for t in pending if t not in ready]
+    return ordered
+
+
+def copy_sample(source_engine, scratch_engine, fraction: float) -> dict:
+    """
+    Copia una muestra coherente (sin referencias colgadas) de origen a scratch.
+    Devuelve {tabla: (filas_origen, filas_copiadas)}.
+    """
+    with scratch_engine.connect() as scratch, source_engine.connect() as source:
+        tables = [name for (name,) in scratch.execute(text("""
+            SELECT relname FROM pg_class
+            WHERE relnamespace = 'public'::regnamespace AND relkind IN ('r', 'p') AND NOT relispartition
+        """))
+            if name not in SKIP_TABLES and not name.startswith(SKIP_PREFIXES)]
+        references = _table_references(scratch, tables)
+
+        # Claves copiadas de cada tabla referenciada, para filtrar a los hijos
+        needed_keys = {(parent, parent_columns) for refs in references.values() for _, parent, parent_columns in refs}
+        copied_keys = defaultdict(set)
+        counts = {}
+
+        for table_name in _sorted_tables(tables, references):
+            table = Table(table_name, MetaData(), autoload_with=scratch)
+            # Las columnas generadas (search_vector, time_slot) las calcula la BD
+            generated = {name for (name,) in scratch.execute(text("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = :table AND is_generated = 'ALWAYS'
+            """), {"table": table_name})}
+            columns = [c.name for c in table.columns if c.name not in generated]
+
+            where = "WHERE random() < :fraction" if table_name in SAMPLE_ROOTS else ""
+            total = source.execute(text(f"SELECT count(*) FROM {table_name}")).scalar()
+            result = source.execution_options(stream_results=True, yield_per=COPY_BATCH_SIZE).execute(
+                text(f"SELECT {', '.join(columns)} FROM {table_name} {where}"), {"fraction": fraction}
+            )
+
+            copied = 0
+            for partition in result.mappings().partitions():
+                batch = []
+                for row in partition:
+                    if all(
+                        any(row[c] is None for c in cols)
+                        or tuple(row[c] for c in cols) in copied_keys[(parent, parent_cols)]
+                        for cols, parent, parent_cols in references.get(table_name, [])
+                    ):
+                        batch.append(dict(row))
+                if batch:
+                    scratch.execute(table.insert(), batch)
+                    copied += len(batch)
+                    for key_table, key_columns in needed_keys:
+                        if key_table == table_name:
+                            copied_keys[(key_table, key_columns)].update(
+                                tuple(row[c] for c in key_columns) for row in batch
+                            )
+
+            # Secuencias de las columnas serial al máximo copiado
+            for (column,) in scratch.execute(text("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = :table AND column_default LIKE 'nextval%'
+            """), {"table": table_name}):
+                scratch.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence(:table, :column), "
+                    f"coalesce(max({column}), 0) + 1, false) FROM {table_name}"
+                ), {"table": table_name, "column": column})
+
+            counts[table_name] = (total, copied)
+            print(f"  {table_name}: {copied}/{total} filas")
+        scratch.commit()
+        scratch.execute(text("ANALYZE"))
+        scratch.commit()
+    return counts
+
+
+# --- Perfilado ---
+class LockSampler(threading.Thread):
+    """Consulta pg_locks desde otra conexión mientras corre cada sentencia (ve también los autocommit)."""
+
+    def __init__(self, engine, pid: int):
+        super().__init__(daemon=True)
+        self.raw = engine.raw_connection()
+        self.raw.driver_connection.autocommit = True
+        self.pid = pid
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.found = set()
+        self.mutex = threading.Lock()
+
+    def run(self):
+        cursor = self.raw.cursor()
+        while not self.stopped.is_set():
+            if not self.active.wait(LOCK_POLL_SECONDS):
+                continue
+            cursor.execute(LOCKS_SQL, (self.pid,))
+            with self.mutex:
+                self.found.update(cursor.fetchall())
+            time.sleep(LOCK_POLL_SECONDS)
+
+    def begin(self):
+        with self.mutex:
+            self.found = set()
+        self.active.set()
+
+    def end(self) -> set:
+        self.active.clear()
+        with self.mutex:
+            return set(self.found)
+
+    def stop(self):
+        self.stopped.set()
+        self.active.set()
+        self.join()
+        self.raw.close()
+
+
+class MigrationProfiler:
+    """Mide cada sentencia que Alembic ejecuta en el engine scratch."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.revision = None
+        self.direction = None
+        self.operations = []
+        self._pending = None
+        self.sampler = None
+        self.owners = {}
+
+    def attach(self, connection):
+        pid = connection.execute(text("SELECT pg_backend_pid()")).scalar()
+        self.owners = dict(connection.execute(text(RELATION_OWNER_SQL)).fetchall())
+        self.sampler = LockSampler(self.engine, pid)
+        self.sampler.start()
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        event.listen(self.engine, "after_cursor_execute", self._after)
+
+    def detach(self):
+        event.remove(self.engine, "before_cursor_execute", self._before)
+        event.remove(self.engine, "after_cursor_execute", self._after)
+        self.sampler.stop()
+
+    def _snapshot(self, cursor, sql: str, params=None):
+        # Cursor "crudo" de la misma conexión: no dispara los eventos de SQLAlchemy
+        raw = cursor.connection.cursor()
+        raw.execute(sql, params)
+        rows = raw.fetchall()
+        raw.close()
+        return rows
+
+    def _owner(self, relation: str) -> str:
+        return self.owners.get(relation, relation)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if self.revision is None or "alembic_version" in statement:
+            return
+        sizes = dict(self._snapshot(cursor, SIZES_SQL))
+        self.sampler.begin()
+        self._pending = (statement, sizes, time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if self._pending is None or self._pending[0] != statement:
+            return
+        statement, sizes_before, started = self._pending
+        elapsed = time.perf_counter() - started
+        self._pending = None
+
+        locks = self.sampler.end()
+        # Los bloqueos de la transacción siguen tomados tras la sentencia
+        locks.update(self._snapshot(cursor, LOCKS_SQL, (cursor.connection.get_backend_pid(),)))
+        sizes_after = dict(self._snapshot(cursor, SIZES_SQL))
+        # Relaciones nuevas (ej. particiones) aparecen al final: se refresca el mapa
+        if set(sizes_after) - set(self.owners):
+            self.owners.update(self._snapshot(cursor, RELATION_OWNER_SQL))
+
+        lock_modes = defaultdict(set)
+        for relation, mode in locks:
+            lock_modes[self._owner(relation)].add(mode)
+        size_deltas = defaultdict(int)
+        for relation in set(sizes_before) | set(sizes_after):
+            delta = sizes_after.get(relation, 0) - sizes_before.get(relation, 0)
+            if delta:
+                size_deltas[self._owner(relation)] += delta
+
+        self.operations.append({
+            "revision": self.revision,
+            "direction": self.direction,
+            "statement": " ".join(statement.split()),
+            "seconds": elapsed,
+            "rows": max(cursor.rowcount, 0),
+            "locks": {table: _strongest(modes) for table, modes in lock_modes.items()},
+            "size_deltas": dict(size_deltas),
+        })
+
+
+def summarize(operations: list, counts: dict) -> list:
+    """Agrupa sentencias repetidas (lotes de backfill) y extrapola al tamaño real."""
+    factors = {table: (total / copied if copied else 1.0) for table, (total, copied) in counts.items()}
+    grouped = {}
+    for op_ in operations:
+        key = (op_["revision"], op_["direction"], op_["statement"])
+        entry = grouped.setdefault(key, {
+            "revision": op_["revision"], "direction": op_["direction"], "statement": op_["statement"],
+            "executions": 0, "seconds": 0.0, "rows": 0, "locks": {}, "size_deltas": defaultdict(int),
+        })
+        entry["executions"] += 1
+        entry["seconds"] += op_["seconds"]
+        entry["rows"] += op_["rows"]
+        for table, mode in op_["locks"].items():
+            entry["locks"][table] = _strongest([mode, entry["locks"].get(table, mode)])
+        for table, delta in op_["size_deltas"].items():
+            entry["size_deltas"][table] += delta
+
+    summary = []
+    for entry in grouped.values():
+        touched = set(entry["locks"]) | set(entry["size_deltas"])
+        factor = max((factors.get(t, 1.0) for t in touched), default=1.0)
+        entry["size_deltas"] = dict(entry["size_deltas"])
+        entry["factor"] = factor
+        entry["estimated_seconds"] = entry["seconds"] * factor
+        entry["estimated_rows"] = round(entry["rows"] * factor)
+        entry["estimated_size_delta"] = sum(entry["size_deltas"].values()) * factor
+        summary.append(entry)
+    return summary
+
+
+def print_report(summary: list):
+    current = None
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for entry in summary:
+        section = (entry["revision"], entry["direction"])
+        if section != current:
+            current = section
+            print(f"\n== {entry['revision']} ({entry['direction']}) ==")
+            print(f"  {'tiempo':>8} {'estimado':>9} {'filas':>8} {'ejec':>5}  {'tamaño':>9}  bloqueos / sentencia")
+        locks = ", ".join(f"{t}:{m.replace('Lock', '')}" for t, m in sorted(entry["locks"].items()))
+        print(f"  {_format_seconds(entry['seconds']):>8} {_format_seconds(entry['estimated_seconds']):>9} "
+              f"{entry['estimated_rows']:>8} {entry['executions']:>5}  "
+              f"{_format_bytes(entry['estimated_size_delta']):>9}  {locks or '-'}")
+        print(f"  {'':>45}{entry['statement'][:100]}")
+        totals[section][0] += entry["seconds"]
+        totals[section][1] += entry["estimated_seconds"]
+
+    print("\n== Totales ==")
+    for (revision, direction), (seconds, estimated) in totals.items():
+        print(f"  {revision} ({direction}): {_format_seconds(seconds)} en la muestra, "
+              f"~{_format_seconds(estimated)} estimado en producción")
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ensaya y perfila migraciones de Alembic sobre una copia de la BD")
+    parser.add_argument("target", help="Revisión destino del upgrade (ej. b9d925015eb2 o head)")
+    parser.add_argument("--source-url", default=SQLALCHEMY_DATABASE_URL, help="BD origen (solo lectura)")
+    parser.add_argument("--scratch-db", default=DEFAULT_SCRATCH_DB, help="Nombre de la BD scratch")
+    parser.add_argument("--fraction", type=float, default=DEFAULT_FRACTION,
+                        help="Fracción de 'owners' (y sus datos) a copiar, entre 0 y 1")
+    parser.add_argument("--downgrade", action="store_true", help="Perfilar también el downgrade de vuelta")
+    parser.add_argument("--online", action="store_true", help="Ejecutar en modo online (app/online_migrations.py)")
+    parser.add_argument("--json", help="Guardar el informe en este fichero JSON")
+    parser.add_argument("--keep", action="store_true", help="No borrar la BD scratch al terminar")
+    args = parser.parse_args(argv)
+    if not 0 < args.fraction <= 1:
+        parser.error("--fraction debe estar entre 0 y 1")
+
+    source_url = make_url(args.source_url)
+    source_engine = create_engine(source_url, execution_options={"postgresql_readonly": True})
+    with source_engine.connect() as conn:
+        start = conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+    script = ScriptDirectory.from_config(Config("alembic.ini"))
+    target = script.get_revision(args.target).revision
+    # Revisiones a aplicar, de la más antigua a la más nueva
+    revisions = [rev.revision for rev in script.iterate_revisions(target, start)][::-1]
+    if not revisions:
+        print(f"La BD origen ya está en {start}; nada que perfilar.")
+        return
+
+    print(f"Creando BD scratch '{args.scratch_db}' en la revisión {start}...")
+    scratch_engine = create_engine(create_scratch_database(source_url, args.scratch_db))
+    try:
+        with scratch_engine.connect() as conn:
+            command.upgrade(alembic_config(conn), start)
+            conn.commit()
+
+        print(f"Copiando muestra ({args.fraction:.0%} de {', '.join(SAMPLE_ROOTS)})...")
+        counts = copy_sample(source_engine, scratch_engine, args.fraction)
+
+        profiler = MigrationProfiler(scratch_engine)
+        with scratch_engine.connect() as conn:
+            cfg = alembic_config(conn, online=args.online)
+            profiler.attach(conn)
+            try:
+                for revision in revisions:
+                    profiler.revision, profiler.direction = revision, "upgrade"
+                    command.upgrade(cfg, revision)
+                    conn.commit()
+                if args.downgrade:
+                    for revision in reversed(revisions):
+                        previous = script.get_revision(revision).down_revision
+                        profiler.revision, profiler.direction = revision, "downgrade"
+                        command.downgrade(cfg, previous or "base")
+                        conn.commit()
+            finally:
+                profiler.revision = None
+                profiler.detach()
+
+        summary = summarize(profiler.operations, counts)
+        print_report(summary)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"source_revision": start, "target": target, "fraction": args.fraction,
+                           "tables": counts, "operations": summary}, f, indent=2, default=str)
+            print(f"\nInforme guardado en {args.json}")
+    finally:
+        scratch_engine.dispose()
+        if not args.keep:
+            drop_scratch_database(source_url, args.scratch_db)
+        source_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
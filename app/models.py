@@ -1,7 +1,8 @@
 from sqlalchemy import (Column, Integer, String, Text, Date, TIMESTAMP, Numeric,
-                        Boolean, ForeignKey, Enum)
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+                        Boolean, ForeignKey, Enum, Computed, Index, CheckConstraint)
+from sqlalchemy.dialects.postgresql import TSVECTOR, TSRANGE
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.sql import func, text
 from .database import Base
 
 class Veterinarian(Base):
@@ -89,14 +90,42 @@ class Appointment(Base):
     status = Column(Enum('scheduled', 'completed', 'cancelled', 'no_show', name='appointment_status_enum'), default='scheduled')
     notes = Column(Text, nullable=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
-    
+
+    # --- ESTAS LÍNEAS (M7) ---
+    duration_minutes = Column(Integer, nullable=False, default=30, server_default='30')
+    # Rango [inicio, fin) calculado por PostgreSQL; lo usa la restricción de no-solapamiento
+    time_slot = deferred(Column(TSRANGE, Computed(
+        "tsrange(appointment_date, appointment_date + duration_minutes * interval '1 minute')",
+        persisted=True
+    )))
+    
+    # --- Índices (M6), restricciones (M7) y particionado (M8) ---
+    # En la BD la PK es (appointment_id, appointment_date) y la tabla está
+    # particionada por mes; para el ORM basta con appointment_id.
+    # La restricción de no-solapamiento (M7) vive en cada partición
+    # ('<partición>_no_overlap'), ver la función create_monthly_partition.
+    __table_args__ = (
+        Index('ix_appointments_appointment_date', 'appointment_date'),
+        Index('ix_appointments_veterinarian_id_appointment_date', 'veterinarian_id', 'appointment_date'),
+        Index('ix_appointments_pet_id', 'pet_id'),
+        # M14: índice parcial de citas programadas (/appointments/pending)
+        Index('ix_appointments_scheduled_appointment_date', 'appointment_date',
+              postgresql_where=text("status = 'scheduled'")),
+        CheckConstraint('duration_minutes > 0', name='ck_appointments_duration_positive'),
+        {'postgresql_partition_by': 'RANGE (appointment_date)'},
+    )
+
     # Relaciones inversas
     pet = relationship("Pet", back_populates="appointments")
     veterinarian = relationship("Veterinarian", back_populates="appointments")
-    medical_record = relationship("MedicalRecord", uselist=False, back_populates="appointment", cascade="all, delete-orphan")
+    # Sin FK real hacia 'appointments' desde M8 (tabla particionada): la
+    # integridad la mantienen triggers, y el join se declara a mano.
+    medical_record = relationship("MedicalRecord", uselist=False, back_populates="appointment", cascade="all, delete-orphan",
+                                  primaryjoin="Appointment.appointment_id == foreign(MedicalRecord.appointment_id)")
 
     # --- ESTA LÍNEA (M4) ---
-    invoice = relationship("Invoice", uselist=False, back_populates="appointment", cascade="all, delete-orphan")
+    invoice = relationship("Invoice", uselist=False, back_populates="appointment", cascade="all, delete-orphan",
+                           primaryjoin="Appointment.appointment_id == foreign(Invoice.appointment_id)")
 
     # 'uselist=False' es clave para 1:1
     # 'cascade="all, delete-orphan"' asegura que si borras la cita, se borra el historial
@@ -108,16 +137,32 @@ class MedicalRecord(Base):
     record_id = Column(Integer, primary_key=True, index=True)
     
     # FK con UNIQUE = True para enforce una relación 1:1 con Appointment
-    appointment_id = Column(Integer, ForeignKey("appointments.appointment_id", ondelete="CASCADE"), unique=True, nullable=False)
+    # (M8: la FK se reemplazó por el trigger 'medical_records_appointment_fk', con borrado en cascada)
+    appointment_id = Column(Integer, unique=True, nullable=False)
     
     diagnosis = Column(Text, nullable=False)
     treatment = Column(Text, nullable=False)
     prescription = Column(Text, nullable=True) # Puede ser nulo
     follow_up_required = Column(Boolean, default=False)
     created_at = Column(TIMESTAMP, server_default=func.now())
+
+    # --- ESTA LÍNEA (M6) ---
+    # Columna generada por PostgreSQL (ver migración M6). 'deferred' para no
+    # traer el tsvector en cada SELECT de historiales.
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('spanish', coalesce(diagnosis, '')), 'A') || "
+        "setweight(to_tsvector('spanish', coalesce(treatment, '')), 'B') || "
+        "setweight(to_tsvector('spanish', coalesce(prescription, '')), 'C')",
+        persisted=True
+    )))
+
+    __table_args__ = (
+        Index('ix_medical_records_search_vector', 'search_vector', postgresql_using='gin'),
+    )
     
     # Relación inversa con Appointment
-    appointment = relationship("Appointment", back_populates="medical_record")
+    appointment = relationship("Appointment", back_populates="medical_record",
+                               primaryjoin="foreign(MedicalRecord.appointment_id) == Appointment.appointment_id")
 
 
 class Vaccine(Base):
@@ -163,10 +208,12 @@ class Invoice(Base):
     
     invoice_id = Column(Integer, primary_key=True, index=True)
     
-    # Clave foránea única para la relación 1:1
-    appointment_id = Column(Integer, ForeignKey("appointments.appointment_id", ondelete="SET NULL"), unique=True, nullable=True)
+    # Referencia única para la relación 1:1
+    # (M8: la FK se reemplazó por el trigger 'invoices_appointment_fk', con SET NULL al borrar la cita;
+    #  la unicidad de appointment_id e invoice_number la garantiza la tabla 'invoice_keys')
+    appointment_id = Column(Integer, nullable=True, index=True)
     
-    invoice_number = Column(String(50), unique=True, nullable=False, index=True)
+    invoice_number = Column(String(50), nullable=False, index=True)
     issue_date = Column(Date, nullable=False, default=func.current_date())
     subtotal = Column(Numeric(10, 2), nullable=False)
     tax_amount = Column(Numeric(10, 2), nullable=False, default=0.00)
@@ -174,6 +221,18 @@ class Invoice(Base):
     
     payment_status = Column(Enum('pending', 'partial', 'paid', 'overdue', name='invoice_payment_status_enum'), default='pending')
     payment_date = Column(TIMESTAMP, nullable=True) # Se llena cuando 'status' es 'paid'
-    
+    amount_paid = Column(Numeric(10, 2), nullable=False, default=0, server_default='0') # M10: pagos parciales
+    
+    # --- Particionado (M8) ---
+    # En la BD la PK es (invoice_id, issue_date) y la tabla está particionada por mes.
+    __table_args__ = (
+        Index('ix_invoices_issue_date', 'issue_date'),
+        # M11: índice parcial de facturas abiertas (/invoices/pending y el barrido de vencidas)
+        Index('ix_invoices_open_issue_date', 'issue_date',
+              postgresql_where=text("payment_status IN ('pending', 'partial', 'overdue')")),
+        {'postgresql_partition_by': 'RANGE (issue_date)'},
+    )
+
     # Relación inversa
-    appointment = relationship("Appointment", back_populates="invoice")
\ No newline at end of file
+    appointment = relationship("Appointment", back_populates="invoice",
+                               primaryjoin="foreign(Invoice.appointment_id) == Appointment.appointment_id")
\ No newline at end of file
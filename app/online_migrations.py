@@ -0,0 +1,170 @@
+"""
+Modo "online" para las migraciones: cambios de esquema sin parar la API.
+
+Se activa al lanzar Alembic:
+    alembic -x online=true upgrade head
+(o con CLINICA_ONLINE_MIGRATIONS=1). Ver alembic/env.py.
+
+En modo online:
+  - Cada operación que bloquea corre en su propio autocommit, con
+    'lock_timeout' corto: si la tabla está ocupada se aborta y se reintenta
+    con espera creciente, en vez de quedarse en cola bloqueando a todos los
+    que llegan detrás.
+  - Los índices se crean con CREATE INDEX CONCURRENTLY (en tablas
+    particionadas, partición a partición y luego ATTACH al índice padre).
+  - NOT NULL se añade con CHECK ... NOT VALID + VALIDATE (que no bloquea
+    escrituras) y después SET NOT NULL, que aprovecha el CHECK validado y
+    no recorre la tabla.
+  - Se imprime cuánto esperó y cuánto retuvo el bloqueo cada operación.
+
+Fuera del modo online los helpers hacen lo mismo que 'op' en la transacción
+de la migración, como hasta ahora.
+"""
+import os
+import time
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import text
+
+LOCK_TIMEOUT = os.getenv("CLINICA_MIGRATION_LOCK_TIMEOUT", "3s")
+LOCK_RETRIES = int(os.getenv("CLINICA_MIGRATION_LOCK_RETRIES", "10"))
+RETRY_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+# SQLSTATE de Postgres cuando salta lock_timeout
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def is_online() -> bool:
+    """True si la migración corre en modo online (opción 'online_migrations' de env.py)."""
+    return bool(op.get_context().opts.get("online_migrations", False))
+
+
+def _run_with_lock_retry(description: str, statement) -> None:
+    """
+    Ejecuta 'statement' (callable sin argumentos) en autocommit con lock_timeout,
+    reintentando si no consigue el bloqueo. Registra espera y retención.
+    """
+    context = op.get_context()
+    with context.autocommit_block():
+        if context.as_sql:
+            # Modo offline: no hay a quién esperar, se emite el SQL tal cual
+            op.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+            statement()
+            return
+
+        bind = op.get_bind()
+        bind.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+        waited = 0.0
+        backoff = RETRY_BACKOFF_SECONDS
+        for attempt in range(1, LOCK_RETRIES + 1):
+            started = time.monotonic()
+            try:
+                statement()
+            except OperationalError as exc:
+                if getattr(exc.orig, "pgcode", None) != LOCK_NOT_AVAILABLE or attempt == LOCK_RETRIES:
+                    raise
+                waited += time.monotonic() - started
+                print(f"[online] {description}: bloqueo ocupado (intento {attempt}/{LOCK_RETRIES}), "
+                      f"reintentando en {backoff:.0f}s...")
+                time.sleep(backoff)
+                waited += backoff
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                continue
+            # En autocommit el bloqueo se suelta al terminar la sentencia
+            held = time.monotonic() - started
+            print(f"[online] {description}: esperó {waited:.2f}s, retuvo el bloqueo {held:.2f}s "
+                  f"({attempt} intento{'s' if attempt > 1 else ''}).")
+            return
+
+
+def execute(sql: str, description: str = None) -> None:
+    """op.execute con lock_timeout y reintentos en modo online (para ALTER TABLE cortos)."""
+    if not is_online():
+        op.execute(sql)
+        return
+    _run_with_lock_retry(description or sql.strip().splitlines()[0], lambda: op.execute(sql))
+
+
+def create_index(index_name: str, table_name: str, columns: list, **kw) -> None:
+    """op.create_index; en modo online, CONCURRENTLY (no bloquea escrituras durante la construcción)."""
+    if not is_online():
+        op.create_index(index_name, table_name, columns, **kw)
+        return
+
+    kw.pop("if_not_exists", None)
+
+    def build():
+        # Un CONCURRENTLY fallido deja el índice como INVALID: se borra antes de reintentar
+        if not op.get_context().as_sql:
+            invalid = op.get_bind().execute(text("""
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name AND NOT i.indisvalid
+            """), {"name": index_name}).scalar()
+            if invalid:
+                print(f"[online] Borrando índice inválido '{index_name}' de un intento anterior...")
+                op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
+        op.create_index(index_name, table_name, columns, postgresql_concurrently=True,
+                        if_not_exists=True, **kw)
+
+    _run_with_lock_retry(f"CREATE INDEX CONCURRENTLY {index_name}", build)
+
+
+def set_not_null(table_name: str, column_name: str, server_default: str = None, **kw) -> None:
+    """
+    op.alter_column(nullable=False, server_default=...); en modo online, por pasos:
+    SET DEFAULT, CHECK NOT VALID, VALIDATE, SET NOT NULL y DROP del CHECK auxiliar.
+    """
+    if not is_online():
+        op.alter_column(table_name, column_name, nullable=False, server_default=server_default, **kw)
+        return
+
+    check_name = f"ck_{table_name}_{column_name}_not_null"
+    if server_default is not None:
+        execute(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} SET DEFAULT {server_default}",
+                f"SET DEFAULT {table_name}.{column_name}")
+    execute(f"ALTER TABLE {table_name} DROP CONSTRAINT IF EXISTS {check_name}, "
+            f"ADD CONSTRAINT {check_name} CHECK ({column_name} IS NOT NULL) NOT VALID",
+            f"CHECK NOT VALID {table_name}.{column_name}")
+    # VALIDATE recorre la tabla pero solo toma SHARE UPDATE EXCLUSIVE: lecturas y escrituras siguen
+    execute(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {check_name}",
+            f"VALIDATE {check_name}")
+    execute(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} SET NOT NULL",
+            f"SET NOT NULL {table_name}.{column_name}")
+    execute(f"ALTER TABLE {table_name} DROP CONSTRAINT {check_name}",
+            f"DROP CONSTRAINT {check_name}")
+
+
+def create_partitioned_index(index_name: str, table_name: str, columns: list, where: str = None) -> None:
+    """
+    create_index para tablas particionadas (M8). Postgres no admite CONCURRENTLY
+    sobre el padre; en modo online se crea el índice del padre con ON ONLY
+    (inválido, vacío), uno CONCURRENTLY por partición y se adjuntan: al adjuntar
+    la última el índice del padre pasa a válido.
+    """
+    kw = {"postgresql_where": sa.text(where)} if where else {}
+    if not is_online() or op.get_context().as_sql:
+        op.create_index(index_name, table_name, columns, if_not_exists=True, **kw)
+        return
+
+    where_sql = f" WHERE {where}" if where else ""
+    execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON ONLY {table_name} ({', '.join(columns)}){where_sql}",
+            f"CREATE INDEX {index_name} ON ONLY {table_name}")
+
+    bind = op.get_bind()
+    partitions = bind.execute(text("""
+        SELECT c.relname FROM pg_inherits h JOIN pg_class c ON c.oid = h.inhrelid
+        WHERE h.inhparent = CAST(:table AS regclass) ORDER BY c.relname
+    """), {"table": table_name}).scalars().all()
+    for partition in partitions:
+        partition_index = f"{partition}_{index_name.removeprefix(f'ix_{table_name}_')}_idx"
+        create_index(partition_index, partition, columns, **kw)
+        attached = bind.execute(text("""
+            SELECT 1 FROM pg_inherits
+            WHERE inhrelid = CAST(:child AS regclass) AND inhparent = CAST(:parent AS regclass)
+        """), {"child": partition_index, "parent": index_name}).scalar()
+        if not attached:
+            execute(f"ALTER INDEX {index_name} ATTACH PARTITION {partition_index}",
+                    f"ATTACH {partition_index}")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import date, datetime
 from decimal import Decimal
 from enum import Enum
@@ -170,6 +170,8 @@ class AppointmentBase(BaseModel):
     reason: Optional[str] = None
     status: Optional[AppointmentStatusEnum] = AppointmentStatusEnum.scheduled
     notes: Optional[str] = None
+    # --- M7 ---
+    duration_minutes: int = Field(30, gt=0, le=480)
 
 class AppointmentCreate(AppointmentBase):
     pass
@@ -181,6 +183,8 @@ class AppointmentUpdate(BaseModel):
     reason: Optional[str] = None
     status: Optional[AppointmentStatusEnum] = None
     notes: Optional[str] = None
+    # --- M7 ---
+    duration_minutes: Optional[int] = Field(None, gt=0, le=480)
 
 class Appointment(AppointmentBase):
     appointment_id: int
@@ -192,6 +196,15 @@ class Appointment(AppointmentBase):
     class Config:
         from_attributes = True
 
+# --- Disponibilidad de Veterinarios (M7) ---
+class TimeSlot(BaseModel):
+    start: datetime
+    end: datetime
+
+class VeterinarianAvailability(BaseModel):
+    veterinarian: VeterinarianSimple
+    free_slots: List[TimeSlot]
+
 # --- Medical Records (M1) ---
 class MedicalRecordBase(BaseModel):
     appointment_id: int
@@ -215,6 +228,18 @@ class MedicalRecord(MedicalRecordBase):
     class Config:
         from_attributes = True
 
+# --- Búsqueda de Medical Records (M6) ---
+class MedicalRecordSearchHit(MedicalRecord):
+    rank: float
+    pet_id: int
+    species: SpeciesEnum
+    veterinarian_id: int
+    appointment_date: datetime
+
+class MedicalRecordSearchPage(BaseModel):
+    items: List[MedicalRecordSearchHit]
+    next_cursor: Optional[str] = None
+
 # --- Vaccines (M2) ---
 class VaccineBase(BaseModel):
     name: str = Field(..., max_length=200)
@@ -268,10 +293,96 @@ class InvoiceUpdate(BaseModel):
 
 class Invoice(InvoiceBase):
     invoice_id: int
+    amount_paid: Decimal = Field(default=0.00) # Solo lectura: lo actualizan los pagos (M10)
     appointment: Optional[Appointment] = None 
     class Config:
         from_attributes = True
 
+class OverdueSweepReport(BaseModel):
+    invoices_marked: int
+    batches: int
+    cutoff_date: date
+    elapsed_seconds: float
+
+# --- Conciliación de pagos por lotes ---
+class InvoicePaymentResultEnum(str, Enum):
+    applied = 'applied'
+    overpaid = 'overpaid'
+    already_paid = 'already_paid'
+    not_found = 'not_found'
+
+class InvoicePayment(BaseModel):
+    invoice_number: str = Field(..., max_length=50)
+    amount: Decimal = Field(..., gt=0)
+    payment_date: Optional[datetime] = None # Si no se indica, la fecha de la conciliación
+
+class InvoicePaymentResult(BaseModel):
+    invoice_number: str
+    result: InvoicePaymentResultEnum
+    amount: Decimal
+    invoice_id: Optional[int] = None
+    amount_paid: Optional[Decimal] = None
+    total_amount: Optional[Decimal] = None
+    payment_status: Optional[InvoicePaymentStatusEnum] = None
+
+class InvoicePaymentBatchReport(BaseModel):
+    applied: int
+    overpaid: int
+    already_paid: int
+    not_found: int
+    total_applied: Decimal
+    results: List[InvoicePaymentResult]
+
+class InvoiceGenerationReport(BaseModel):
+    invoices_created: int
+    batches: int
+    total_amount: Decimal
+    elapsed_seconds: float
+    invoices_per_second: float
+
+# --- Timeline de Pets ---
+class TimelineEventTypeEnum(str, Enum):
+    appointment = 'appointment'
+    medical_record = 'medical_record'
+    vaccination = 'vaccination'
+    invoice = 'invoice'
+
+class TimelineEvent(BaseModel):
+    event_type: TimelineEventTypeEnum
+    event_id: int
+    event_date: datetime
+    title: Optional[str] = None
+    status: Optional[str] = None
+    veterinarian_id: Optional[int] = None
+    detail: Optional[str] = None
+    amount: Optional[Decimal] = None
+    class Config:
+        from_attributes = True
+
+class PetTimeline(BaseModel):
+    pet: Pet
+    events: List[TimelineEvent]
+    next_cursor: Optional[str] = None
+
+# --- Feed de cambios (M12) ---
+class ChangeOpEnum(str, Enum):
+    upsert = 'upsert'
+    delete = 'delete'
+
+class Change(BaseModel):
+    table: str
+    row_id: int
+    op: ChangeOpEnum
+    data: Optional[dict] = None # Fila actual, con el mismo formato que su listado (None si se borró)
+
+class ChangeFeedPage(BaseModel):
+    changes: List[Change]
+    next_cursor: str
+    has_more: bool
+
+class ChangeFeedHead(BaseModel):
+    cursor: str
+
 # --- Schemas de Reportes (M5) ---
 
 class RevenueReport(BaseModel):
@@ -288,6 +399,24 @@ class VaccinationAlertReport(BaseModel):
     vaccine: Vaccine
     next_dose_date: date
 
+class ReceivablesBreakdown(BaseModel):
+    invoice_count: int
+    outstanding: Decimal
+    buckets: Dict[str, Decimal] # tramo de antigüedad ('0-30', '31-60', ...) -> monto pendiente
+
+class ReceivablesByPaymentMethod(ReceivablesBreakdown):
+    payment_method: Optional[PaymentMethodEnum] = None
+
+class ReceivablesByVeterinarian(ReceivablesBreakdown):
+    veterinarian_id: Optional[int] = None
+    veterinarian_name: Optional[str] = None
+
+class ReceivablesReport(BaseModel):
+    as_of: date
+    total: ReceivablesBreakdown
+    by_payment_method: List[ReceivablesByPaymentMethod]
+    by_veterinarian: List[ReceivablesByVeterinarian]
+
 # --- Reconstrucción de Modelos ---
 # (Necesario para que Pydantic maneje las referencias circulares/forward)
 Owner.model_rebuild()
@@ -0,0 +1,125 @@
+"""
+Arranque de producción: gunicorn con N workers uvicorn (pre-fork).
+
+    python -m app.server                       # un worker por CPU en 0.0.0.0:8000
+    python -m app.server --workers 4 --bind 127.0.0.1:8000 --pid /run/clinica.pid
+
+- La app se importa una sola vez en el proceso maestro (preload) y los
+  workers la heredan al hacer fork: arrancan rápido y comparten memoria.
+- Cada worker tiene sus propios pools de SQLAlchemy. Su tamaño se calcula
+  para que la suma no supere max_connections de Postgres:
+
+      por worker = (max_connections - reservadas) / (2 * workers) - 1
+
+  El 2 deja sitio a los workers viejos y nuevos que conviven durante un
+  reload, y el -1 es la conexión LISTEN de app/events.py. Los tamaños se
+  pasan a app/database.py con CLINICA_DB_POOL_SIZE / CLINICA_DB_MAX_OVERFLOW.
+  Si la réplica de lectura es el mismo servidor (otro rol), sus pools cuentan
+  aparte: pasar la mitad de max_connections.
+- Tras el fork, cada worker descarta (sin cerrarlas) las conexiones que
+  pudiera haber heredado del maestro: un socket compartido entre procesos
+  corrompe el protocolo.
+
+Reload sin perder peticiones (los workers viejos terminan lo que tienen en
+curso, hasta --graceful-timeout, mientras los nuevos ya aceptan):
+    kill -HUP  $(cat /run/clinica.pid)    # recrea los workers (misma versión del código)
+    kill -USR2 $(cat /run/clinica.pid)    # código nuevo: arranca un maestro nuevo junto al viejo...
+    kill -TERM <pid del maestro viejo>    # ...y después se apaga el viejo
+
+Solo Unix (gunicorn). En desarrollo sigue valiendo 'uvicorn app.main:app --reload'.
+"""
+import argparse
+import importlib.util
+import logging
+import math
+import os
+
+from gunicorn.app.base import BaseApplication
+
+# Paquete 'uvicorn-worker'; las versiones viejas de uvicorn lo traían incluido
+if importlib.util.find_spec("uvicorn_worker"):
+    WORKER_CLASS = "uvicorn_worker.UvicornWorker"
+else:
+    WORKER_CLASS = "uvicorn.workers.UvicornWorker"
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BIND = "0.0.0.0:8000"
+# Conexiones que quedan fuera de los pools: superusuario, migraciones, cron, psql...
+DEFAULT_RESERVED_CONNECTIONS = 10
+# max_connections de Postgres (por defecto 100, el de la imagen de docker-compose.yml)
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("CLINICA_DB_MAX_CONNECTIONS", "100"))
+
+
+def pool_sizes(max_connections: int, workers: int, reserved: int) -> tuple:
+    """(pool_size, max_overflow) por worker y engine para no pasar de max_connections."""
+    per_worker = (max_connections - reserved) // (2 * workers) - 1
+    if per_worker < 2:
+        raise SystemExit(f"max_connections={max_connections} no alcanza para {workers} workers "
+                         f"({reserved} reservadas): reducir --workers o subir max_connections")
+    pool_size = math.ceil(per_worker / 2)
+    return pool_size, per_worker - pool_size
+
+
+def post_fork(server, worker):
+    """Hook de gunicorn en cada worker recién creado."""
+    from .database import engine, read_engine
+    for db_engine in {engine, read_engine}:
+        # close=False: las conexiones heredadas son del maestro; solo se olvidan
+        db_engine.dispose(close=False)
+
+
+class ClinicaServer(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from .main import app
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor de producción de la API (gunicorn + uvicorn)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos worker (por defecto, uno por CPU)")
+    parser.add_argument("--bind", default=DEFAULT_BIND)
+    parser.add_argument("--max-db-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="max_connections de Postgres ('SHOW max_connections')")
+    parser.add_argument("--reserved-connections", type=int, default=DEFAULT_RESERVED_CONNECTIONS,
+                        help="Conexiones que se dejan libres fuera de los pools de la API")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="Segundos que un worker viejo tiene para terminar sus peticiones en un reload")
+    parser.add_argument("--pid", default=None, help="Fichero con el PID del maestro (para HUP/USR2)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s")
+
+    # Antes de importar la app: app/database.py crea los engines al importarse
+    max_connections = args.max_db_connections
+    pool_size, max_overflow = pool_sizes(max_connections, args.workers, args.reserved_connections)
+    os.environ["CLINICA_DB_POOL_SIZE"] = str(pool_size)
+    os.environ["CLINICA_DB_MAX_OVERFLOW"] = str(max_overflow)
+    logger.info("%s workers, pool por worker %s + %s de overflow (max_connections=%s, reservadas=%s)",
+                args.workers, pool_size, max_overflow, max_connections, args.reserved_connections)
+
+    ClinicaServer({
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": WORKER_CLASS,
+        "preload_app": True,
+        "post_fork": post_fork,
+        "graceful_timeout": args.graceful_timeout,
+        # SSE (/events) mantiene conexiones abiertas: sin timeout de keep-alive corto
+        "keepalive": 75,
+        "pidfile": args.pid,
+        "loglevel": args.log_level,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
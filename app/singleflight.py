@@ -0,0 +1,71 @@
+"""
+Coalescencia de peticiones idénticas simultáneas ("single flight").
+
+Cuando llegan a la vez N peticiones iguales a un reporte caro (ej. 30
+recepciones abriendo el dashboard a las 8:00), solo la primera ejecuta la
+consulta; las demás esperan y reciben el mismo resultado. En cuanto termina,
+la clave se libera: no es una caché, la siguiente petición vuelve a calcular.
+
+El resultado se comparte entre hilos y sesiones: la función debe devolver
+datos ya serializados (schemas de Pydantic), no objetos ORM de su sesión.
+"""
+import threading
+from collections import defaultdict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave (nombre + parámetros normalizados)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = defaultdict(lambda: {"executions": 0, "coalesced": 0, "errors": 0})
+
+    def do(self, name: str, params: dict, fn):
+        """Ejecuta fn() o, si ya hay una llamada igual en curso, espera su resultado."""
+        key = (name, tuple(sorted(params.items())))
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats[name]["executions"] += 1
+            else:
+                self._stats[name]["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as exc:
+            call.error = exc
+            with self._lock:
+                self._stats[name]["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        """{nombre: {executions, coalesced, errors, in_flight}}"""
+        with self._lock:
+            in_flight = defaultdict(int)
+            for name, _ in self._calls:
+                in_flight[name] += 1
+            return {name: {**counts, "in_flight": in_flight[name]} for name, counts in self._stats.items()}
+
+
+report_flight = SingleFlight()
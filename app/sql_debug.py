@@ -0,0 +1,123 @@
+"""
+Trazas de SQL por petición para depurar en staging.
+
+Con CLINICA_DEBUG_SQL=1, una petición con la cabecera
+
+    X-Debug-SQL: analyze    (o 'explain': plan sin ejecutar de nuevo)
+
+registra cada sentencia que ejecuta con los engines de app/database.py:
+SQL, parámetros, duración, filas y su plan. La respuesta trae
+
+    X-Debug-SQL-Id: <id>                 -> GET /debug/sql/<id> con la traza completa
+    X-Debug-SQL-Summary: 7 statements; 12.4 ms
+
+- Sin CLINICA_DEBUG_SQL no se registra ningún listener ni middleware: cero
+  coste. Con la variable activa, una petición sin la cabecera solo paga
+  leer una ContextVar por sentencia.
+- EXPLAIN ANALYZE vuelve a ejecutar la sentencia, así que solo se aplica a
+  SELECT; las escrituras (y nextval, que no se deshace) llevan EXPLAIN sin
+  ANALYZE.
+- Las trazas se guardan en memoria del worker (las últimas MAX_TRACES).
+"""
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+
+from sqlalchemy import event
+
+ENABLED = os.getenv("CLINICA_DEBUG_SQL", "") == "1"
+HEADER = "X-Debug-SQL"
+MODES = ("analyze", "explain")
+MAX_TRACES = 100
+
+# Solo se re-ejecutan con ANALYZE las lecturas puras
+READ_ONLY_STATEMENT = re.compile(r"^\s*SELECT\b(?!.*\bnextval\s*\()", re.IGNORECASE | re.DOTALL)
+
+_current_trace: ContextVar[Optional[dict]] = ContextVar("clinica_sql_trace", default=None)
+_traces = OrderedDict()
+_traces_lock = Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_trace.get() is not None:
+        context._debug_sql_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current_trace.get()
+    started = getattr(context, "_debug_sql_started", None)
+    if trace is None or started is None:
+        return
+    entry = {
+        "sql": statement,
+        "params": parameters,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        "rows": cursor.rowcount,
+        "plan": None,
+    }
+    if not executemany:
+        analyze = trace["mode"] == "analyze" and READ_ONLY_STATEMENT.match(statement)
+        explain = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+        # Cursor DBAPI aparte: no pasa por SQLAlchemy (sin eventos) ni pisa el resultado pendiente
+        dbapi_connection = conn.connection.dbapi_connection
+        in_transaction = not dbapi_connection.autocommit
+        with dbapi_connection.cursor() as explain_cursor:
+            try:
+                if in_transaction:
+                    explain_cursor.execute("SAVEPOINT debug_sql")
+                explain_cursor.execute(explain + statement, parameters)
+                entry["plan"] = "\n".join(row[0] for row in explain_cursor.fetchall())
+                if in_transaction:
+                    explain_cursor.execute("RELEASE SAVEPOINT debug_sql")
+            except Exception as exc:
+                # Un EXPLAIN fallido no debe abortar la transacción de la petición
+                if in_transaction:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT debug_sql")
+                entry["plan"] = f"EXPLAIN failed: {exc}"
+    trace["statements"].append(entry)
+
+
+def install(*engines):
+    """Registra los listeners en los engines (solo si ENABLED)."""
+    if not ENABLED:
+        return
+    for engine in set(engines):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def start_trace(mode: str, method: str, path: str):
+    """Abre una traza para la petición en curso; devuelve el token para end_trace."""
+    trace = {
+        "id": uuid.uuid4().hex,
+        "mode": mode,
+        "method": method,
+        "path": path,
+        "started_at": datetime.now(),
+        "statements": [],
+    }
+    return _current_trace.set(trace)
+
+
+def end_trace(token, elapsed_seconds: float) -> dict:
+    """Cierra la traza de la petición, la guarda y la devuelve."""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    trace["request_ms"] = round(elapsed_seconds * 1000, 3)
+    trace["sql_ms"] = round(sum(s["duration_ms"] for s in trace["statements"]), 3)
+    with _traces_lock:
+        _traces[trace["id"]] = trace
+        while len(_traces) > MAX_TRACES:
+            _traces.popitem(last=False)
+    return trace
+
+
+def get_trace(trace_id: str) -> Optional[dict]:
+    with _traces_lock:
+        return _traces.get(trace_id)
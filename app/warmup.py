@@ -0,0 +1,125 @@
+"""
+Calentamiento al arrancar cada worker (lifespan de app/main.py).
+
+Sin esto, las primeras peticiones tras un despliegue pagan trabajo que se
+hace una sola vez por proceso:
+
+- SQLAlchemy configura los mappers (relaciones, backrefs) en la primera consulta.
+- Cada consulta del ORM se compila a SQL la primera vez; después sale de la
+  caché de compilación del engine.
+- El pool abre las conexiones bajo demanda (TCP + autenticación).
+- El primer serializado de cada response_model recorre caminos en frío.
+
+run() hace todo eso antes de que el worker acepte tráfico. Las consultas se
+ejecutan de verdad (con ids inexistentes o limit=1) dentro de una transacción
+que se descarta. Si la BD no está disponible se registra y la app arranca
+igual. Se desactiva con CLINICA_WARMUP=0.
+"""
+import logging
+import os
+import time
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from . import crud, schemas
+from .database import ReadSessionLocal, SessionLocal, engine, read_engine
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("CLINICA_WARMUP", "1") == "1"
+
+# Id que no existe: compila y ejecuta la misma sentencia sin traer filas
+MISSING_ID = 0
+
+# (función de crud, argumentos, schema de respuesta): lo que más pide la recepción
+HOT_QUERIES = [
+    (crud.get_owner, {"owner_id": MISSING_ID}, schemas.Owner),
+    (crud.get_owners, {"limit": 1}, schemas.Owner),
+    (crud.get_owner_by_email, {"email": ""}, schemas.Owner),
+    (crud.get_pet, {"pet_id": MISSING_ID}, schemas.Pet),
+    (crud.get_pets, {"limit": 1}, schemas.Pet),
+    (crud.get_pets_by_owner, {"owner_id": MISSING_ID}, schemas.Pet),
+    (crud.get_veterinarian, {"vet_id": MISSING_ID}, schemas.Veterinarian),
+    (crud.get_veterinarians, {"limit": 1}, schemas.Veterinarian),
+    (crud.get_appointment, {"appt_id": MISSING_ID}, schemas.Appointment),
+    (crud.get_appointments, {"limit": 1}, schemas.Appointment),
+    (crud.get_appointments_by_vet_and_date, {"vet_id": MISSING_ID, "date": date.today()}, schemas.Appointment),
+    (crud.get_appointments_by_status_or_date, {"date": date.today()}, schemas.Appointment),
+    (crud.get_vaccines, {"limit": 1}, schemas.Vaccine),
+    (crud.get_vaccinations_by_pet, {"pet_id": MISSING_ID}, schemas.VaccinationRecord),
+    (crud.get_medical_records_by_pet, {"pet_id": MISSING_ID}, schemas.MedicalRecord),
+    (crud.get_invoice, {"invoice_id": MISSING_ID}, schemas.Invoice),
+    (crud.get_invoices, {"limit": 1}, schemas.Invoice),
+]
+
+
+def configure_models() -> None:
+    """Configura todos los mappers de app/models.py."""
+    configure_mappers()
+
+
+def prime_pools() -> int:
+    """Abre pool_size conexiones en cada engine y las deja en el pool. Devuelve cuántas abrió."""
+    opened = 0
+    for db_engine in {engine, read_engine}:
+        connections = []
+        try:
+            for _ in range(db_engine.pool.size()):
+                connection = db_engine.connect()
+                connection.execute(text("SELECT 1"))
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close()
+        opened += len(connections)
+    return opened
+
+
+def _serialize(schema, result) -> None:
+    rows = result if isinstance(result, list) else [result]
+    for row in rows:
+        if row is not None:
+            schema.model_validate(row).model_dump_json()
+
+
+def compile_hot_queries() -> int:
+    """Ejecuta las consultas calientes en cada engine (llena su caché de compilación)."""
+    executed = 0
+    session_factories = {engine: SessionLocal, read_engine: ReadSessionLocal}
+    for session_factory in session_factories.values():
+        db = session_factory()
+        try:
+            for fn, kwargs, schema in HOT_QUERIES:
+                _serialize(schema, fn(db, **kwargs))
+                executed += 1
+        finally:
+            db.rollback()
+            db.close()
+    return executed
+
+
+def run() -> dict:
+    """Calienta el worker; devuelve los tiempos de cada paso en ms."""
+    timings = {}
+    if not ENABLED:
+        return timings
+
+    started = time.perf_counter()
+    configure_models()
+    timings["mappers_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    for step, fn in (("pool", prime_pools), ("queries", compile_hot_queries)):
+        started = time.perf_counter()
+        try:
+            count = fn()
+        except Exception:
+            # Sin BD el worker arranca igual: las peticiones pagarán el coste en frío
+            logger.warning("Calentamiento '%s' incompleto", step, exc_info=True)
+            break
+        timings[f"{step}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        timings[step] = count
+
+    logger.info("Calentamiento: %s", timings)
+    return timings
@@ -0,0 +1,114 @@
+"""
+Coste por llamada de las lecturas por id de app/crud.py: la forma anterior
+(db.query(...).options(joinedload(...)).filter(...).first(), que se
+reconstruye en cada llamada) frente a la actual (Session.get con opciones
+precreadas y lambda_stmt para las búsquedas por columna única).
+
+    python benchmarks/lookups.py
+    python benchmarks/lookups.py --iterations 5000
+
+Dos escenarios por función:
+- 'sesión nueva': primera búsqueda en una sesión (siempre va a la BD);
+- 'repetida': la misma búsqueda otra vez en la misma sesión, como hace
+  update_appointment al validar y recargar (con Session.get no hay consulta).
+
+Requiere la BD con datos (seed_full.py).
+"""
+import argparse
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+
+from app import crud, models
+from app.database import SessionLocal
+
+
+# --- Forma anterior de las lecturas (referencia) ---
+def legacy_get_pet(db, pet_id):
+    return db.query(models.Pet).options(joinedload(models.Pet.owner)).filter(models.Pet.pet_id == pet_id).first()
+
+def legacy_get_veterinarian(db, vet_id):
+    return db.query(models.Veterinarian).filter(models.Veterinarian.veterinarian_id == vet_id).first()
+
+def legacy_get_appointment(db, appt_id):
+    return db.query(models.Appointment).options(
+        joinedload(models.Appointment.pet),
+        joinedload(models.Appointment.veterinarian),
+        joinedload(models.Appointment.invoice),
+        joinedload(models.Appointment.medical_record)
+    ).filter(models.Appointment.appointment_id == appt_id).first()
+
+def legacy_get_invoice(db, invoice_id):
+    return db.query(models.Invoice).options(
+        joinedload(models.Invoice.appointment).joinedload(models.Appointment.pet)
+    ).filter(models.Invoice.invoice_id == invoice_id).first()
+
+def legacy_get_owner_by_email(db, email):
+    return db.query(models.Owner).filter(models.Owner.email == email).first()
+
+
+def sample_args(db) -> dict:
+    """Un id (o email) existente por tabla."""
+    def first(column):
+        value = db.execute(select(func.min(column))).scalar()
+        if value is None:
+            raise SystemExit(f"Sin datos en {column.table.name}: ejecutar seed_full.py")
+        return value
+    return {
+        "pet": first(models.Pet.pet_id),
+        "veterinarian": first(models.Veterinarian.veterinarian_id),
+        "appointment": first(models.Appointment.appointment_id),
+        "invoice": first(models.Invoice.invoice_id),
+        "owner_email": first(models.Owner.email),
+    }
+
+
+def per_call_us(fn, arg, iterations: int, repeated: bool) -> float:
+    """Microsegundos por llamada (sin contar abrir/cerrar la sesión)."""
+    total = 0.0
+    db = SessionLocal()
+    try:
+        if repeated:
+            fn(db, arg)
+        for _ in range(iterations):
+            if not repeated:
+                db.close()
+                db = SessionLocal()
+            started = time.perf_counter()
+            fn(db, arg)
+            total += time.perf_counter() - started
+    finally:
+        db.close()
+    return total / iterations * 1_000_000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coste por llamada de las lecturas por id, antes y después")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as db:
+        ids = sample_args(db)
+    cases = [
+        ("get_pet", legacy_get_pet, crud.get_pet, ids["pet"]),
+        ("get_veterinarian", legacy_get_veterinarian, crud.get_veterinarian, ids["veterinarian"]),
+        ("get_appointment", legacy_get_appointment, crud.get_appointment, ids["appointment"]),
+        ("get_invoice", legacy_get_invoice, crud.get_invoice, ids["invoice"]),
+        ("get_owner_by_email", legacy_get_owner_by_email, crud.get_owner_by_email, ids["owner_email"]),
+    ]
+
+    print(f"{args.iterations} llamadas por caso, µs por llamada\n")
+    print(f"{'función':<20} {'escenario':<12} {'antes':>9} {'después':>9} {'mejora':>7}")
+    for name, legacy, current, arg in cases:
+        # Una pasada previa para llenar cachés de compilación y el pool
+        per_call_us(legacy, arg, 10, False)
+        per_call_us(current, arg, 10, False)
+        for label, repeated in (("sesión nueva", False), ("repetida", True)):
+            before = per_call_us(legacy, arg, args.iterations, repeated)
+            after = per_call_us(current, arg, args.iterations, repeated)
+            print(f"{name:<20} {label:<12} {before:>9.1f} {after:>9.1f} {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
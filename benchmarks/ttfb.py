@@ -0,0 +1,132 @@
+"""
+Tiempo hasta el primer byte de las primeras peticiones tras arrancar,
+con y sin el calentamiento de app/warmup.py.
+
+    python benchmarks/ttfb.py
+    python benchmarks/ttfb.py --runs 5
+
+Para cada modo arranca uvicorn (CLINICA_WARMUP=0 / 1), espera a que el puerto
+acepte conexiones (sin peticiones HTTP, que calentarían la app) y mide la
+primera y la segunda petición a cada endpoint. La segunda es la referencia
+en caliente: con el calentamiento la primera debería quedar cerca de ella.
+
+Sale con código 1 si, calentado, la primera petición de algún endpoint
+supera la referencia en más de --max-ratio (y de --slack-ms, para que los
+endpoints de pocos ms no fallen por ruido).
+
+Requiere la BD con datos (seed_full.py) y 'pip install httpx'.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = [
+    "/owners/?limit=20",
+    "/owners/1",
+    "/pets/1",
+    "/appointments/?limit=20",
+    "/invoices/?limit=20",
+    "/veterinarians/",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, warmup: bool) -> tuple:
+    """Arranca uvicorn; devuelve (proceso, segundos hasta aceptar conexiones)."""
+    env = {**os.environ, "CLINICA_WARMUP": "1" if warmup else "0", "CLINICA_RUN_PERIODIC_JOBS": "0"}
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            # uvicorn abre el puerto después del startup del lifespan
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, time.perf_counter() - started
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise SystemExit("uvicorn no arrancó en 60s")
+
+
+def ttfb_ms(client: httpx.Client, path: str) -> float:
+    started = time.perf_counter()
+    with client.stream("GET", path) as response:
+        # stream() vuelve al recibir las cabeceras
+        elapsed = time.perf_counter() - started
+        response.read()
+    if response.status_code != 200:
+        # Un error rápido no es un TTFB válido
+        raise SystemExit(f"GET {path}: {response.status_code}")
+    return elapsed * 1000
+
+
+def measure(warmup: bool) -> dict:
+    port = free_port()
+    server, startup_seconds = start_server(port, warmup)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            first = {path: ttfb_ms(client, path) for path in ENDPOINTS}
+            second = {path: ttfb_ms(client, path) for path in ENDPOINTS}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {"startup_ms": startup_seconds * 1000, "first": first, "second": second}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TTFB tras el arranque, con y sin calentamiento")
+    parser.add_argument("--runs", type=int, default=3, help="Arranques por modo (se toma la mediana)")
+    parser.add_argument("--max-ratio", type=float, default=1.5,
+                        help="Máximo permitido de la 1ª petición calentada frente a la 2ª (referencia)")
+    parser.add_argument("--slack-ms", type=float, default=5.0,
+                        help="Margen absoluto sobre la referencia que nunca cuenta como fallo")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for label, warmup in (("frío", False), ("calentado", True)):
+        runs = [measure(warmup) for _ in range(args.runs)]
+        results[label] = {
+            "startup_ms": statistics.median(r["startup_ms"] for r in runs),
+            "first": {p: statistics.median(r["first"][p] for r in runs) for p in ENDPOINTS},
+            "second": {p: statistics.median(r["second"][p] for r in runs) for p in ENDPOINTS},
+        }
+
+    print(f"Mediana de {args.runs} arranques por modo (ms)\n")
+    print(f"{'endpoint':<26} {'frío 1ª':>9} {'calent. 1ª':>11} {'2ª (ref.)':>10} {'ratio':>6}")
+    exceeded = []
+    for path in ENDPOINTS:
+        first, reference = results["calentado"]["first"][path], results["calentado"]["second"][path]
+        ratio = first / reference if reference else float("inf")
+        if first > max(reference * args.max_ratio, reference + args.slack_ms):
+            exceeded.append(path)
+        print(f"{path:<26} {results['frío']['first'][path]:>9.1f} {first:>11.1f} {reference:>10.1f} "
+              f"{ratio:>5.2f}x" + ("  FAIL" if path in exceeded else ""))
+    print(f"\n{'arranque hasta aceptar':<26} {results['frío']['startup_ms']:>9.0f} "
+          f"{results['calentado']['startup_ms']:>11.0f}")
+
+    if exceeded:
+        print(f"\n{len(exceeded)} endpoints con la 1ª petición calentada por encima de "
+              f"{args.max_ratio}x la referencia (+{args.slack_ms:.0f} ms de margen): {', '.join(exceeded)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
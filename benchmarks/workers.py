@@ -0,0 +1,144 @@
+"""
+Escalado del throughput con el número de workers (app/server.py).
+
+    python benchmarks/workers.py                                  # 1, 2, 4... hasta las CPUs
+    python benchmarks/workers.py --workers 1 2 4 8 --duration 20 --concurrency 64
+
+Para cada N arranca 'python -m app.server --workers N' en un puerto local,
+espera a que responda, lanza carga sobre endpoints de recepción durante
+--duration segundos y lo apaga. La carga sale de varios procesos (--clients)
+para que el generador no sea el cuello de botella.
+
+Requiere la BD con datos (seed_full.py) y 'pip install httpx'. Los 503 del
+control de admisión (app/admission.py) se cuentan aparte como 'shed'.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Mezcla de lecturas típica de la recepción
+ENDPOINTS = [
+    "/owners/?limit=20",
+    "/pets/?limit=20",
+    "/appointments/?limit=20",
+    "/veterinarians/",
+    "/vaccines/",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--workers", str(workers),
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, "CLINICA_RUN_PERIODIC_JOBS": "0"},
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"El servidor con {workers} workers no arrancó en 30s")
+
+
+async def _load(base_url: str, duration: float, concurrency: int) -> dict:
+    latencies, errors, shed = [], 0, 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def user(offset: int):
+            nonlocal errors, shed
+            i = offset
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(ENDPOINTS[i % len(ENDPOINTS)])
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                finally:
+                    i += 1
+                if response.status_code == 503:
+                    shed += 1
+                elif response.status_code != 200:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(user(n) for n in range(concurrency)))
+    return {"latencies": latencies, "errors": errors, "shed": shed}
+
+
+def _load_process(args) -> dict:
+    return asyncio.run(_load(*args))
+
+
+def run_load(base_url: str, duration: float, concurrency: int, clients: int) -> dict:
+    per_client = max(1, concurrency // clients)
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_load_process, [(base_url, duration, per_client)] * clients)
+    latencies = sorted(l for r in results for l in r["latencies"])
+    return {
+        "requests_per_second": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        "errors": sum(r["errors"] for r in results),
+        "shed": sum(r["shed"] for r in results),
+    }
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, *(2 ** n for n in range(1, cpus.bit_length()) if 2 ** n <= cpus), cpus})
+    parser = argparse.ArgumentParser(description="Throughput de la API según el número de workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--duration", type=float, default=15.0, help="Segundos de carga por configuración")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Segundos de carga previa que no se miden")
+    parser.add_argument("--concurrency", type=int, default=64, help="Peticiones simultáneas en total")
+    parser.add_argument("--clients", type=int, default=max(1, cpus // 2), help="Procesos generadores de carga")
+    args = parser.parse_args(argv)
+
+    print(f"{cpus} CPUs · concurrencia {args.concurrency} · {args.clients} procesos de carga · "
+          f"{args.duration:.0f}s por configuración\n")
+    print(f"{'workers':>7} {'req/s':>9} {'speedup':>8} {'eficiencia':>10} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'errores':>8} {'shed':>6}")
+    baseline = None
+    for workers in args.workers:
+        port = free_port()
+        server = start_server(workers, port)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            if args.warmup:
+                run_load(base_url, args.warmup, args.concurrency, args.clients)
+            result = run_load(base_url, args.duration, args.concurrency, args.clients)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+        baseline = baseline or result["requests_per_second"] / workers
+        speedup = result["requests_per_second"] / baseline if baseline else 0.0
+        print(f"{workers:>7} {result['requests_per_second']:>9.0f} {speedup:>7.2f}x {speedup / workers:>10.0%} "
+              f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>8} {result['shed']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,627 @@
+"""
+Regresiones de planes de consulta de app/crud.py.
+
+Cada caso llama a una función de crud.py sobre una BD scratch poblada a escala
+y captura el EXPLAIN (FORMAT JSON) de cada sentencia que emite (antes de
+ejecutarla, en la misma transacción). Sobre el plan se comprueba:
+
+  - Que no haya Seq Scan sobre tablas grandes (LARGE_TABLES), salvo excepción
+    declarada en el caso.
+  - Que se use un índice sobre la columna del filtro ('index_on').
+  - Que las filas estimadas estén acotadas ('max_rows').
+  - Que la poda de particiones (M8) deje pocas particiones ('max_partitions').
+
+Además se guarda la forma de cada plan (nodos, tablas e índices, sin costes)
+en query_plans/<caso>.txt y se compara con la guardada: cualquier cambio se
+muestra como diff y falla. Un caso sin snapshot solo se avisa (no falla) y
+no se escribe nada. Tras revisar un cambio intencionado (o un caso nuevo):
+
+    python check_query_plans.py --update
+
+Uso:
+    python check_query_plans.py                  # crea y puebla la BD scratch, comprueba y la borra
+    python check_query_plans.py --keep           # no la borra al terminar
+    python check_query_plans.py --reuse -k owner # reutiliza la BD ya poblada, solo casos con 'owner'
+
+Devuelve código de salida 1 si algún caso falla. 'known_issue' lista fallos
+concretos de un caso (problemas conocidos pendientes de arreglar): esos se
+informan pero no fallan; cualquier otro fallo del mismo caso sí falla.
+"""
+import argparse
+import difflib
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Optional
+
+from alembic import command
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app import crud, schemas
+from app.cache import report_cache
+from app.database import SQLALCHEMY_DATABASE_URL
+from app.migration_profiler import alembic_config, create_scratch_database, drop_scratch_database
+
+DEFAULT_SCRATCH_DB = "clinica_db_plans"
+SNAPSHOT_DIR = Path(__file__).parent / "query_plans"
+
+# Volumen con --scale 1 (filas); lo bastante grande para que el planificador
+# prefiera índices como en producción
+BASE_COUNTS = {
+    "veterinarians": 50,
+    "owners": 20000,
+    "pets": 40000,
+    "vaccines": 30,
+    "appointments": 400000,
+    "vaccination_records": 80000,
+    "change_log": 200000,
+}
+# Meses de historia de citas (más los futuros de crud.PARTITION_MONTHS_AHEAD)
+HISTORY_MONTHS = 24
+
+# Un Seq Scan sobre estas tablas (o sus particiones) es un fallo
+LARGE_TABLES = ("owners", "pets", "appointments", "medical_records",
+                "vaccination_records", "invoices", "invoice_keys", "change_log")
+
+# Sufijo de las particiones mensuales (M8): appointments_2026_10 -> appointments
+PARTITION_SUFFIX = re.compile(r"_(\d{4}_\d{2}|default)(?=_|$)")
+
+SCAN_NODES = ("Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Heap Scan", "Bitmap Index Scan")
+INDEX_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+# --- Población de la BD scratch ---
+SEED_SQL = """
+-- Particiones antes de tocar los triggers: las nuevas copian los del padre
+SELECT create_monthly_partition(parent, month::date)
+FROM (VALUES ('appointments'), ('invoices')) AS t(parent),
+     generate_series(date_trunc('month', current_date) - make_interval(months => :history_months),
+                     date_trunc('month', current_date), interval '1 month') AS month;
+SELECT ensure_monthly_partitions('appointments');
+SELECT ensure_monthly_partitions('invoices');
+
+-- Triggers de usuario fuera (change_log, NOTIFY, FKs por trigger de M8): los
+-- datos se generan consistentes y 'invoice_keys' se rellena al final
+ALTER TABLE owners DISABLE TRIGGER USER;
+ALTER TABLE pets DISABLE TRIGGER USER;
+ALTER TABLE appointments DISABLE TRIGGER USER;
+ALTER TABLE invoices DISABLE TRIGGER USER;
+ALTER TABLE medical_records DISABLE TRIGGER USER;
+ALTER TABLE vaccination_records DISABLE TRIGGER USER;
+
+INSERT INTO veterinarians (license_number, first_name, last_name, email, phone, specialization,
+                           hire_date, is_active, consultation_fee, rating, total_appointments)
+SELECT 'VET-' || n, 'Vet', 'Number ' || n, 'vet' || n || '@clinica.test', '555-' || n,
+       (ARRAY['Cirugía', 'Dermatología', 'Medicina Interna', 'Oncología', 'General'])[1 + n % 5],
+       current_date - (n * 30), n % 10 <> 0, 80 + n % 70, 3 + (n % 20) / 10.0, 0
+FROM generate_series(1, :veterinarians) AS n;
+
+INSERT INTO owners (first_name, last_name, email, phone, address, emergency_contact, preferred_payment_method)
+SELECT 'Owner', 'Number ' || n, 'owner' || n || '@clinica.test', '555-' || n, 'Calle ' || n,
+       '555-9' || n, (ARRAY['cash', 'credit', 'debit', 'insurance'])[1 + n % 4]::payment_method_enum
+FROM generate_series(1, :owners) AS n;
+
+INSERT INTO pets (name, species, breed, birth_date, weight, owner_id, microchip_number,
+                  is_neutered, blood_type, visit_count)
+SELECT 'Pet ' || n, (ARRAY['dog', 'cat', 'bird', 'rabbit', 'other'])[1 + n % 5]::species_enum,
+       'Mixto', current_date - (n % 5000), 1 + n % 40, 1 + n % :owners, 'CHIP-' || n,
+       n % 2 = 0, NULL, 0
+FROM generate_series(1, :pets) AS n;
+
+-- Cada veterinario tiene una cita cada step_minutes minutos: nunca se solapan (M7)
+INSERT INTO appointments (pet_id, veterinarian_id, appointment_date, reason, status, notes, duration_minutes)
+SELECT 1 + (n * 7919) % :pets, 1 + n % :veterinarians, ts,
+       (ARRAY['Control anual', 'Vacunación', 'Cojera', 'Dermatitis', 'Revisión dental'])[1 + n % 5],
+       CASE WHEN ts >= now() THEN 'scheduled'
+            WHEN n % 10 = 0 THEN 'cancelled'
+            WHEN n % 10 = 1 THEN 'no_show'
+            ELSE 'completed' END::appointment_status_enum,
+       NULL, 30
+FROM generate_series(0, :appointments - 1) AS n,
+     LATERAL (SELECT date_trunc('month', current_date) - make_interval(months => :history_months)
+                     + make_interval(mins => (n / :veterinarians) * :step_minutes) AS ts) AS t;
+
+INSERT INTO medical_records (appointment_id, diagnosis, treatment, prescription, follow_up_required, created_at)
+SELECT appointment_id,
+       (ARRAY['Otitis externa', 'Dermatitis alérgica', 'Gastroenteritis aguda', 'Fractura de radio',
+              'Enfermedad periodontal', 'Obesidad'])[1 + appointment_id % 6],
+       (ARRAY['Antibiótico tópico', 'Antiinflamatorio', 'Dieta blanda', 'Inmovilización',
+              'Limpieza dental', 'Plan de ejercicio'])[1 + appointment_id % 6],
+       CASE WHEN appointment_id % 3 = 0 THEN 'Amoxicilina 250mg' END,
+       appointment_id % 4 = 0, appointment_date
+FROM appointments
+WHERE status = 'completed' AND appointment_id % 2 = 0;
+
+-- Casi todas las citas completadas ya facturadas; las recientes, sin pagar
+INSERT INTO invoices (appointment_id, invoice_number, issue_date, subtotal, tax_amount, total_amount,
+                      payment_status, payment_date, amount_paid)
+SELECT appointment_id, 'INV-SEED-' || lpad(appointment_id::text, 8, '0'), appointment_date::date,
+       100, 13, 113, status::invoice_payment_status_enum,
+       CASE WHEN status = 'paid' THEN appointment_date + interval '3 days' END,
+       CASE status WHEN 'paid' THEN 113 WHEN 'partial' THEN 50 ELSE 0 END
+FROM (
+    SELECT appointment_id, appointment_date,
+           CASE WHEN appointment_date < now() - interval '90 days' AND appointment_id % 50 <> 0 THEN 'paid'
+                WHEN appointment_id % 7 = 0 THEN 'partial'
+                WHEN appointment_date < now() - interval '30 days' THEN 'overdue'
+                ELSE 'pending' END AS status
+    FROM appointments
+    WHERE status = 'completed' AND appointment_id % 20 <> 0
+) AS a;
+INSERT INTO invoice_keys (invoice_id, invoice_number, appointment_id)
+SELECT invoice_id, invoice_number, appointment_id FROM invoices;
+
+INSERT INTO vaccines (name, manufacturer, species_applicable)
+SELECT 'Vacuna ' || n, 'Laboratorio ' || n % 5, (ARRAY['dog', 'cat', 'dog,cat'])[1 + n % 3]
+FROM generate_series(1, :vaccines) AS n;
+
+INSERT INTO vaccination_records (pet_id, vaccine_id, veterinarian_id, vaccination_date, next_dose_date, batch_number)
+SELECT 1 + (n * 104729) % :pets, 1 + n % :vaccines, 1 + n % :veterinarians, d,
+       CASE WHEN n % 4 <> 0 THEN d + 365 END, 'LOTE-' || n % 1000
+FROM generate_series(1, :vaccination_records) AS n,
+     LATERAL (SELECT current_date - (n % (:history_months * 30)) AS d) AS t;
+
+-- Un cambio por fila, en transacciones de 5 cambios, repartidos en la retención
+INSERT INTO change_log (txid, table_name, row_id, op, changed_at)
+SELECT 1 + n / 5, (ARRAY['owners', 'pets', 'appointments', 'invoices'])[1 + n % 4], 1 + n % :owners, 'U',
+       now() - make_interval(secs => (:change_log - n) * (:retention_days * 86400.0 / :change_log))
+FROM generate_series(0, :change_log - 1) AS n;
+
+ALTER TABLE owners ENABLE TRIGGER USER;
+ALTER TABLE pets ENABLE TRIGGER USER;
+ALTER TABLE appointments ENABLE TRIGGER USER;
+ALTER TABLE invoices ENABLE TRIGGER USER;
+ALTER TABLE medical_records ENABLE TRIGGER USER;
+ALTER TABLE vaccination_records ENABLE TRIGGER USER;
+"""
+
+
+def seed_database(engine, scale: float) -> dict:
+    """Puebla la BD (ya migrada a head) con datos sintéticos y devuelve los conteos usados."""
+    counts = {table: max(1, int(rows * scale)) for table, rows in BASE_COUNTS.items()}
+    counts["veterinarians"] = BASE_COUNTS["veterinarians"]  # El reparto de agendas depende de este número
+
+    # Minutos entre citas de un mismo veterinario para cubrir la historia y los meses futuros
+    days = (HISTORY_MONTHS + crud.PARTITION_MONTHS_AHEAD) * 30
+    slots_per_vet = counts["appointments"] // counts["veterinarians"]
+    step_minutes = days * 1440 // slots_per_vet
+    if step_minutes < 30:
+        raise SystemExit("--scale demasiado grande: las citas de un veterinario se solaparían")
+
+    params = {**counts, "history_months": HISTORY_MONTHS, "step_minutes": step_minutes,
+              "retention_days": crud.CHANGE_LOG_RETENTION_DAYS}
+    with engine.begin() as conn:
+        for statement in SEED_SQL.split(";\n"):
+            if statement.strip():
+                conn.execute(text(statement), {k: v for k, v in params.items() if f":{k}" in statement})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+    return counts
+
+
+def sample_values(engine) -> dict:
+    """Ids y valores reales de la BD para parametrizar los casos."""
+    with engine.connect() as conn:
+        def scalar(sql):
+            return conn.execute(text(sql)).scalar()
+        # Una mascota con historia completa (citas, historial, vacunas y facturas)
+        pet_id = scalar("""
+            SELECT a.pet_id FROM appointments a JOIN invoices i ON i.appointment_id = a.appointment_id
+            JOIN medical_records m ON m.appointment_id = a.appointment_id
+            WHERE EXISTS (SELECT 1 FROM vaccination_records v WHERE v.pet_id = a.pet_id)
+            LIMIT 1
+        """)
+        appointment_id = scalar("SELECT appointment_id FROM medical_records ORDER BY record_id LIMIT 1")
+        invoice_numbers = conn.execute(text(
+            "SELECT invoice_number FROM invoices WHERE payment_status <> 'paid' ORDER BY invoice_id LIMIT 100"
+        )).scalars().all()
+        max_txid = scalar("SELECT max(txid) FROM change_log")
+        return {
+            "vet_id": 1,
+            "owner_id": scalar(f"SELECT owner_id FROM pets WHERE pet_id = {pet_id}"),
+            "owner_email": scalar("SELECT email FROM owners ORDER BY owner_id LIMIT 1"),
+            "pet_id": pet_id,
+            "appointment_id": appointment_id,
+            "record_id": scalar("SELECT min(record_id) FROM medical_records"),
+            "vaccination_id": scalar("SELECT min(vaccination_id) FROM vaccination_records"),
+            "invoice_id": scalar("SELECT min(invoice_id) FROM invoices"),
+            "invoice_numbers": invoice_numbers,
+            "ids": list(range(1, 51)),
+            "day": date.today() - timedelta(days=10),
+            "change_txid": max_txid - 200,
+        }
+
+
+# --- Captura de planes ---
+class PlanCapture:
+    """Hace EXPLAIN (FORMAT JSON) de cada sentencia justo antes de que se ejecute."""
+
+    EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.plans = []
+        self._explaining = False
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._before)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if self._explaining or executemany or not self.EXPLAINABLE.match(statement):
+            return
+        self._explaining = True
+        try:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+            self.plans.append({"sql": statement, "plan": cursor.fetchone()[0][0]["Plan"]})
+        finally:
+            self._explaining = False
+
+
+def base_table(relation: str) -> str:
+    return PARTITION_SUFFIX.sub("", relation)
+
+
+def walk(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def check_plan(case, plan: dict, main: bool) -> list:
+    """Fallos de 'plan' respecto a las expectativas de 'case' ('main': es la consulta principal)."""
+    failures = []
+    partitions = {}
+    for node in walk(plan):
+        relation = node.get("Relation Name")
+        if node["Node Type"] not in SCAN_NODES or relation is None:
+            continue
+        table = base_table(relation)
+        partitions.setdefault(table, set()).add(relation)
+        if node["Node Type"] == "Seq Scan" and table in LARGE_TABLES and table not in case.allow_seq_scan:
+            failures.append(f"Seq Scan sobre {relation}")
+
+    for table, limit in case.max_partitions.items():
+        scanned = len(partitions.get(table, ()))
+        if scanned > limit:
+            failures.append(f"{table}: {scanned} particiones recorridas (máximo {limit}), no hay poda")
+
+    if main and case.max_rows is not None and plan["Plan Rows"] > case.max_rows:
+        failures.append(f"{plan['Plan Rows']} filas estimadas (máximo {case.max_rows})")
+    return failures
+
+
+def check_indexes(case, plans: list) -> list:
+    """Fallos por columnas de 'index_on' que ninguna sentencia del caso filtra con un índice."""
+    conditions = [
+        node.get("Index Cond", "") + " " + node.get("Index Name", "")
+        for captured in plans for node in walk(captured["plan"]) if node["Node Type"] in INDEX_NODES
+    ]
+    return [f"ningún índice usado sobre '{column}'" for column in case.index_on
+            if not any(re.search(rf"\b{column}\b", condition) for condition in conditions)]
+
+
+def plan_shape(node: dict, depth: int = 0) -> list:
+    """Forma del plan para el snapshot: nodos, tablas e índices, sin costes ni valores."""
+    label = node["Node Type"]
+    for key in ("Join Type", "Strategy"):
+        if key in node:
+            label += f" {node[key]}"
+    if "Relation Name" in node:
+        label += f" on {PARTITION_SUFFIX.sub('_YYYY_MM', node['Relation Name'])}"
+    if "Index Name" in node:
+        label += f" using {PARTITION_SUFFIX.sub('_YYYY_MM', node['Index Name'])}"
+    lines = ["  " * depth + label]
+
+    # Las particiones dan subárboles iguales tras normalizar: se agrupan con (xN)
+    blocks = [plan_shape(child, depth + 1) for child in node.get("Plans", [])]
+    i = 0
+    while i < len(blocks):
+        repeat = 1
+        while i + repeat < len(blocks) and blocks[i + repeat] == blocks[i]:
+            repeat += 1
+        lines += blocks[i]
+        if repeat > 1:
+            lines.append("  " * (depth + 1) + f"(x{repeat})")
+        i += repeat
+    return lines
+
+
+# --- Casos ---
+# Problemas conocidos comunes a varios casos (ver QueryCase.known_issue)
+NO_PETS_OWNER_INDEX = "pets.owner_id no tiene índice"
+NO_VACCINATIONS_PET_INDEX = "vaccination_records.pet_id no tiene índice"
+
+@dataclass
+class QueryCase:
+    name: str
+    call: Callable[[Session, dict], object]
+    index_on: tuple = ()            # Columnas que alguna sentencia del caso debe filtrar por índice
+    max_rows: Optional[int] = None  # Filas estimadas máximas de la consulta principal
+    main_statement: int = 0         # Posición de la consulta principal entre las sentencias del caso
+    max_partitions: dict = field(default_factory=dict)  # {tabla particionada: particiones máximas}
+    allow_seq_scan: tuple = ()      # Tablas grandes en las que un Seq Scan es aceptable
+    known_issue: dict = field(default_factory=dict)  # {fallo: problema conocido}: se informa pero no falla
+
+
+CASES = [
+    # Veterinarios
+    # veterinarians no está en LARGE_TABLES (50 filas): un Seq Scan es aceptable
+    QueryCase("veterinarians_by_ids", lambda db, v: crud.get_veterinarians_by_ids(db, v["ids"]),
+              max_rows=50),  # Los ids de prueba cubren los 50 veterinarios
+    QueryCase("veterinarian_delete_check",
+              lambda db, v: crud.delete_veterinarian(db, crud.get_veterinarian(db, v["vet_id"])),
+              index_on=("veterinarian_id",), main_statement=1, max_rows=1),
+    QueryCase("veterinarians_availability",
+              lambda db, v: crud.get_veterinarians_availability(db, v["day"], v["day"] + timedelta(days=6)),
+              index_on=("time_slot",)),
+    QueryCase("conflicting_appointment",
+              lambda db, v: crud.get_conflicting_appointment(
+                  db, v["vet_id"], datetime.combine(v["day"], datetime.min.time()).replace(hour=10), 30),
+              index_on=("time_slot",), max_rows=1),
+    QueryCase("appointments_by_vet_and_date",
+              lambda db, v: crud.get_appointments_by_vet_and_date(db, v["vet_id"], v["day"]),
+              index_on=("veterinarian_id",), max_rows=50, max_partitions={"appointments": 1}),
+    QueryCase("appointments_by_veterinarian",
+              lambda db, v: crud.get_appointments_by_veterinarian(db, v["vet_id"]),
+              index_on=("veterinarian_id",)),
+
+    # Dueños y mascotas
+    QueryCase("owner", lambda db, v: crud.get_owner(db, v["owner_id"]),
+              index_on=("owner_id",), max_rows=50,
+              known_issue={"Seq Scan sobre pets": NO_PETS_OWNER_INDEX}),
+    QueryCase("owner_by_email", lambda db, v: crud.get_owner_by_email(db, v["owner_email"]),
+              index_on=("email",), max_rows=1),
+    # ORDER BY owner_id: recorre owners_pkey hasta el LIMIT (las filas se multiplican por el join con pets)
+    QueryCase("owners", lambda db, v: crud.get_owners(db, limit=100),
+              known_issue={"Seq Scan sobre pets": NO_PETS_OWNER_INDEX}),
+    QueryCase("owners_by_ids", lambda db, v: crud.get_owners_by_ids(db, v["ids"]),
+              index_on=("owner_id",), max_rows=500,
+              known_issue={"Seq Scan sobre pets": NO_PETS_OWNER_INDEX}),
+    QueryCase("pets_by_owner", lambda db, v: crud.get_pets_by_owner(db, v["owner_id"]),
+              index_on=("owner_id",), max_rows=50,
+              known_issue={"Seq Scan sobre pets": NO_PETS_OWNER_INDEX,
+                           "ningún índice usado sobre 'owner_id'": NO_PETS_OWNER_INDEX}),
+    QueryCase("appointments_by_owner", lambda db, v: crud.get_appointments_by_owner(db, v["owner_id"]),
+              index_on=("pet_id",), max_rows=500,
+              known_issue={"Seq Scan sobre pets": NO_PETS_OWNER_INDEX}),
+    QueryCase("pet", lambda db, v: crud.get_pet(db, v["pet_id"]),
+              index_on=("pet_id",), max_rows=1),
+    QueryCase("pets", lambda db, v: crud.get_pets(db, limit=100),
+              max_rows=100),  # ORDER BY pet_id: recorre pets_pkey hasta el LIMIT
+    QueryCase("pets_by_ids", lambda db, v: crud.get_pets_by_ids(db, v["ids"]),
+              index_on=("pet_id",), max_rows=50),
+    QueryCase("pet_timeline", lambda db, v: crud.get_pet_timeline(db, v["pet_id"]),
+              index_on=("pet_id",), max_rows=51,
+              known_issue={"Seq Scan sobre vaccination_records": NO_VACCINATIONS_PET_INDEX}),
+
+    # Citas
+    QueryCase("appointment", lambda db, v: crud.get_appointment(db, v["appointment_id"]),
+              index_on=("appointment_id",), max_rows=1),
+    QueryCase("appointments", lambda db, v: crud.get_appointments(db, limit=100),
+              index_on=("appointment_date",), max_rows=100),
+    QueryCase("appointments_by_ids", lambda db, v: crud.get_appointments_by_ids(db, v["ids"]),
+              index_on=("appointment_id",), max_rows=100),
+    QueryCase("appointments_by_status_and_date",
+              lambda db, v: crud.get_appointments_by_status_or_date(db, status="completed", date=v["day"]),
+              index_on=("appointment_date",), max_rows=2000, max_partitions={"appointments": 1}),
+    QueryCase("pending_appointments",
+              lambda db, v: crud.get_appointments_by_status_or_date(
+                  db, status="scheduled",
+                  since=v["day"] - timedelta(days=crud.PENDING_APPOINTMENTS_LOOKBACK_DAYS)),
+              # Hasta 3 meses desde 'since' (40 días atrás), los futuros con partición y la DEFAULT
+              index_on=("appointment_date",),
+              max_partitions={"appointments": 3 + crud.PARTITION_MONTHS_AHEAD + 1}),
+
+    # Historiales médicos
+    QueryCase("medical_record", lambda db, v: crud.get_medical_record(db, v["record_id"]),
+              index_on=("record_id",), max_rows=1),
+    QueryCase("medical_record_by_appointment",
+              lambda db, v: crud.get_medical_record_by_appointment(db, v["appointment_id"]),
+              index_on=("appointment_id",), max_rows=1),
+    QueryCase("medical_records_by_pet", lambda db, v: crud.get_medical_records_by_pet(db, v["pet_id"]),
+              index_on=("pet_id",), max_rows=100),
+    QueryCase("search_medical_records", lambda db, v: crud.search_medical_records(db, "otitis"),
+              index_on=("search_vector",), max_rows=21),
+    QueryCase("search_medical_records_filtered",
+              lambda db, v: crud.search_medical_records(db, "dermatitis", vet_id=v["vet_id"],
+                                                        start_date=v["day"] - timedelta(days=90),
+                                                        end_date=v["day"]),
+              index_on=("search_vector",), max_rows=21),
+
+    # Vacunas
+    QueryCase("vaccination_record", lambda db, v: crud.get_vaccination_record(db, v["vaccination_id"]),
+              index_on=("vaccination_id",), max_rows=1),
+    QueryCase("vaccination_records", lambda db, v: crud.get_vaccination_records(db, limit=100),
+              allow_seq_scan=("vaccination_records",), max_rows=100),  # Sin ORDER BY
+    QueryCase("vaccinations_by_pet", lambda db, v: crud.get_vaccinations_by_pet(db, v["pet_id"]),
+              index_on=("pet_id",), max_rows=50,
+              known_issue={"Seq Scan sobre vaccination_records": NO_VACCINATIONS_PET_INDEX,
+                           "ningún índice usado sobre 'pet_id'": NO_VACCINATIONS_PET_INDEX}),
+    QueryCase("vaccination_schedule_by_pet",
+              lambda db, v: crud.get_vaccination_schedule_by_pet(db, v["pet_id"]),
+              index_on=("pet_id",), max_rows=50,
+              known_issue={"Seq Scan sobre vaccination_records": NO_VACCINATIONS_PET_INDEX,
+                           "ningún índice usado sobre 'pet_id'": NO_VACCINATIONS_PET_INDEX}),
+    QueryCase("vaccination_alerts", lambda db, v: crud.get_vaccination_alerts(db),
+              index_on=("next_dose_date",), max_rows=5000,
+              known_issue={
+                  "Seq Scan sobre vaccination_records": "vaccination_records.next_dose_date no tiene índice",
+                  "ningún índice usado sobre 'next_dose_date'": "vaccination_records.next_dose_date no tiene índice",
+              }),
+
+    # Facturas
+    QueryCase("invoice", lambda db, v: crud.get_invoice(db, v["invoice_id"]),
+              index_on=("invoice_id",), max_rows=1),
+    QueryCase("invoices", lambda db, v: crud.get_invoices(db, limit=100),
+              index_on=("issue_date",), max_rows=100),
+    QueryCase("invoices_by_ids", lambda db, v: crud.get_invoices_by_ids(db, v["ids"]),
+              index_on=("invoice_id",), max_rows=100),
+    QueryCase("pending_invoices", lambda db, v: crud.get_pending_invoices(db, limit=100),
+              index_on=("issue_date",), max_rows=100),
+    QueryCase("generate_pending_invoices",
+              lambda db, v: crud.generate_pending_invoices(db, batch_size=1000, max_batches=1),
+              index_on=("appointment_id",), max_rows=1,
+              known_issue={"Seq Scan sobre appointments":
+                           "no hay índice para citas completadas: cada lote recorre todas las citas"}),
+    QueryCase("apply_invoice_payments",
+              lambda db, v: crud.apply_invoice_payments(db, [
+                  schemas.InvoicePayment(invoice_number=number, amount=Decimal("10.00"))
+                  for number in v["invoice_numbers"]
+              ]),
+              index_on=("invoice_number",)),
+    QueryCase("mark_overdue_invoices",
+              lambda db, v: crud.mark_overdue_invoices(db, max_batches=1),
+              index_on=("issue_date",)),
+
+    # Feed de cambios
+    QueryCase("changes", lambda db, v: crud.get_changes(db, v["change_txid"], 0, limit=500),
+              index_on=("txid",), max_rows=501),
+    QueryCase("prune_change_log", lambda db, v: crud.prune_change_log(db),
+              index_on=("changed_at",)),
+
+    # Reportes
+    QueryCase("revenue_report",
+              lambda db, v: crud.get_revenue_report(db, v["day"] - timedelta(days=30), v["day"]),
+              index_on=("payment_date",),
+              known_issue={
+                  "Seq Scan sobre invoices": "invoices.payment_date no tiene índice ni poda particiones",
+                  "ningún índice usado sobre 'payment_date'": "invoices.payment_date no tiene índice",
+              }),
+    QueryCase("receivables_report", lambda db, v: crud.get_receivables_report(db),
+              index_on=("issue_date",),
+              # Agrega todas las facturas abiertas: cruza con sus citas, mascotas y dueños
+              allow_seq_scan=("appointments", "pets", "owners")),
+]
+
+
+def run_case(engine, case: QueryCase, values: dict) -> list:
+    """Ejecuta el caso en una transacción que se deshace (los commit de crud son savepoints)."""
+    report_cache.invalidate()
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            with PlanCapture(engine) as capture, \
+                    Session(bind=conn, join_transaction_mode="create_savepoint") as db:
+                case.call(db, values)
+        finally:
+            transaction.rollback()
+    return capture.plans
+
+
+def known_failure(case: QueryCase, failure: str) -> Optional[str]:
+    """Problema conocido que explica 'failure' (las particiones cuentan como su tabla), o None."""
+    return case.known_issue.get(PARTITION_SUFFIX.sub("", failure))
+
+
+def snapshot_path(case: QueryCase) -> Path:
+    return SNAPSHOT_DIR / f"{case.name}.txt"
+
+
+def compare_snapshot(case: QueryCase, plans: list, update: bool) -> Optional[str]:
+    """Diff contra query_plans/<caso>.txt (None si no cambió o si se actualiza)."""
+    current = "\n\n".join("\n".join(plan_shape(p["plan"])) for p in plans) + "\n"
+    path = snapshot_path(case)
+    if update:
+        SNAPSHOT_DIR.mkdir(exist_ok=True)
+        path.write_text(current)
+        return None
+    saved = path.read_text()
+    if saved == current:
+        return None
+    return "".join(difflib.unified_diff(saved.splitlines(keepends=True), current.splitlines(keepends=True),
+                                        fromfile=f"{path.name} (guardado)", tofile=f"{path.name} (actual)"))
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comprueba los planes de las consultas de app/crud.py")
+    parser.add_argument("--source-url", default=SQLALCHEMY_DATABASE_URL,
+                        help="Servidor donde crear la BD scratch (la BD de esta URL no se toca)")
+    parser.add_argument("--scratch-db", default=DEFAULT_SCRATCH_DB, help="Nombre de la BD scratch")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor sobre el volumen de BASE_COUNTS")
+    parser.add_argument("--reuse", action="store_true", help="Usar la BD scratch ya poblada (de un --keep)")
+    parser.add_argument("--keep", action="store_true", help="No borrar la BD scratch al terminar")
+    parser.add_argument("--update", action="store_true", help="Reescribir los snapshots de query_plans/")
+    parser.add_argument("--json", help="Guardar los planes completos en este fichero JSON")
+    parser.add_argument("-k", dest="pattern", help="Solo los casos cuyo nombre contenga este texto")
+    args = parser.parse_args(argv)
+
+    source_url = make_url(args.source_url)
+    if args.reuse:
+        scratch_url = source_url.set(database=args.scratch_db)
+    else:
+        print(f"Creando BD scratch '{args.scratch_db}'...")
+        scratch_url = create_scratch_database(source_url, args.scratch_db)
+    engine = create_engine(scratch_url)
+    try:
+        if not args.reuse:
+            with engine.connect() as conn:
+                command.upgrade(alembic_config(conn), "head")
+                conn.commit()
+            started = time.monotonic()
+            counts = seed_database(engine, args.scale)
+            print(f"BD poblada en {time.monotonic() - started:.0f}s: "
+                  + ", ".join(f"{table}={rows}" for table, rows in counts.items()))
+
+        values = sample_values(engine)
+        cases = [case for case in CASES if not args.pattern or args.pattern in case.name]
+        failed, known, changed, missing, dump = 0, 0, 0, 0, {}
+        for case in cases:
+            try:
+                plans = run_case(engine, case, values)
+            except Exception as exc:
+                failed += 1
+                print(f"ERROR  {case.name}: {exc}")
+                continue
+            dump[case.name] = plans
+            failures = check_indexes(case, plans)
+            for i, captured in enumerate(plans):
+                failures += check_plan(case, captured["plan"], main=(i == case.main_statement))
+            has_snapshot = args.update or snapshot_path(case).exists()
+            diff = compare_snapshot(case, plans, args.update) if has_snapshot else None
+
+            unexpected = [failure for failure in failures if not known_failure(case, failure)]
+            if unexpected:
+                failed += 1
+                print(f"FAIL   {case.name}")
+            elif failures:
+                known += 1
+                print(f"KNOWN  {case.name}")
+            else:
+                print(f"ok     {case.name}")
+            for failure in failures:
+                issue = known_failure(case, failure)
+                print(f"         - {failure}" + (f" (conocido: {issue})" if issue else ""))
+            if not has_snapshot:
+                missing += 1
+                print(f"         sin snapshot {snapshot_path(case).name}: revisar el plan y ejecutar con --update")
+            if diff:
+                changed += 1
+                print(f"         plan distinto al snapshot:\n{diff}")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(dump, f, indent=2, default=str)
+        print(f"\n{len(cases)} casos: {failed} fallidos, {known} con problemas conocidos, "
+              f"{changed} planes cambiados, {missing} sin snapshot"
+              + (" (snapshots actualizados)" if args.update else ""))
+        return 1 if failed or changed else 0
+    finally:
+        engine.dispose()
+        if not args.keep and not args.reuse:
+            drop_scratch_database(source_url, args.scratch_db)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 import streamlit as st
 import requests
 import pandas as pd
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 
 # --- Configuración de la Página ---
 st.set_page_config(
@@ -37,6 +37,122 @@ def post_data(endpoint, data):
         st.error(f"Error al enviar datos ({endpoint}): {response.json().get('detail', e)}")
         return None
 
+# --- Sincronización incremental (feed de cambios M12) ---
+# Los listados grandes se descargan completos (página a página) una sola vez
+# por sesión; después solo se piden los cambios desde el último cursor y se
+# aplican en local. Cada filtro reproduce el del endpoint, así el resultado es
+# el mismo que una recarga completa.
+PAGE_SIZE = 500 # MAX_PAGE_SIZE de la API
+# Ventana de /appointments/pending (como crud.PENDING_APPOINTMENTS_LOOKBACK_DAYS);
+# se pasa explícita en ?since= para que el filtro local use la misma fecha
+PENDING_LOOKBACK_DAYS = 30
+# Recargas completas seguidas si un listado cambia mientras se pagina
+FULL_SYNC_ATTEMPTS = 3
+
+def pending_since():
+    return date.today() - timedelta(days=PENDING_LOOKBACK_DAYS)
+
+def is_pending_appointment(row):
+    return (row["status"] == "scheduled"
+            and datetime.fromisoformat(row["appointment_date"]) >= datetime.combine(pending_since(), time.min))
+
+# tabla -> (endpoint del listado, paginado con skip/limit, clave primaria, filtro que aplica ese endpoint)
+SYNCED_LISTS = {
+    "owners": ("/owners/", True, "owner_id", lambda row: True),
+    "pets": ("/pets/", True, "pet_id", lambda row: True),
+    "appointments": ("/appointments/pending", False, "appointment_id", is_pending_appointment),
+    "invoices": ("/invoices/pending", True, "invoice_id",
+                 lambda row: row["payment_status"] in ("pending", "partial", "overdue")),
+}
+
+def fetch_json(endpoint):
+    """GET sin caché. Devuelve (status_code, json) o (None, None) si la API no responde."""
+    try:
+        response = requests.get(f"{API_URL}{endpoint}")
+        return response.status_code, response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None, None
+
+def fetch_list(table):
+    """Listado completo de 'table' como {id: fila}, o {} si la API falla."""
+    endpoint, paged, pk, _ = SYNCED_LISTS[table]
+    if table == "appointments":
+        endpoint = f"{endpoint}?since={pending_since()}"
+    if not paged:
+        status, rows = fetch_json(endpoint)
+        return {row[pk]: row for row in rows} if status == 200 else {}
+    rows, skip = {}, 0
+    while True:
+        status, page = fetch_json(f"{endpoint}?skip={skip}&limit={PAGE_SIZE}")
+        if status != 200:
+            return {}
+        rows.update((row[pk], row) for row in page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        skip += PAGE_SIZE
+
+def removed_since(cursor):
+    """Tablas paginadas con filas que salieron de su listado desde 'cursor' (None si no se puede saber)."""
+    tables, has_more = set(), True
+    while has_more:
+        status, page = fetch_json(f"/changes?since={cursor}")
+        if status != 200:
+            return None
+        for change in page["changes"]:
+            _, paged, _, keep = SYNCED_LISTS[change["table"]]
+            if paged and (change["op"] != "upsert" or not keep(change["data"])):
+                tables.add(change["table"])
+        cursor, has_more = page["next_cursor"], page["has_more"]
+    return tables
+
+def full_sync():
+    for _ in range(FULL_SYNC_ATTEMPTS):
+        status, head = fetch_json("/changes/head") # Antes de los listados: no se pierde nada entre medias
+        store = {"cursor": head["cursor"] if status == 200 else None,
+                 "tables": {table: fetch_list(table) for table in SYNCED_LISTS}}
+        # Una fila que sale del listado mientras se pagina desplaza las siguientes
+        # con skip/limit y una de ellas no se descarga: en ese caso se repite
+        if store["cursor"] is None or not removed_since(store["cursor"]):
+            break
+    return store
+
+def sync_lists():
+    """Devuelve {tabla: {id: fila}} actualizado con los cambios desde la última vez."""
+    store = st.session_state.get("synced")
+    if store is None or store["cursor"] is None:
+        # Primera carga (o API sin /changes: se recarga todo en cada ejecución, como antes)
+        store = full_sync()
+        st.session_state["synced"] = store
+        return store["tables"]
+
+    has_more = True
+    while has_more:
+        status, page = fetch_json(f"/changes?since={store['cursor']}")
+        if status == 410:
+            # Cursor caducado (change_log ya purgado): recarga completa
+            st.session_state["synced"] = store = full_sync()
+            break
+        if status != 200:
+            st.error(f"Error al sincronizar cambios: {page.get('detail') if page else 'API no disponible'}")
+            break
+        for change in page["changes"]:
+            _, _, _, keep = SYNCED_LISTS[change["table"]]
+            rows = store["tables"][change["table"]]
+            if change["op"] == "upsert" and keep(change["data"]):
+                rows[change["row_id"]] = change["data"]
+            else:
+                rows.pop(change["row_id"], None)
+        store["cursor"] = page["next_cursor"]
+        has_more = page["has_more"]
+
+    # La ventana de citas pendientes avanza con los días: fuera las que ya no entran
+    appointments = store["tables"]["appointments"]
+    for appt_id in [i for i, row in appointments.items() if not is_pending_appointment(row)]:
+        del appointments[appt_id]
+    return store["tables"]
+
+synced = sync_lists()
+
 # --- Título de la App ---
 st.title("🐾 Clínica Veterinaria")
 st.markdown("Esta app deberia funcionar con la API de la clínica (vM4 y vM5).")
@@ -125,7 +241,7 @@ tab_owners, tab_pets, tab_appointments, tab_invoices = st.tabs(["Dueños", "Masc
 # --- Pestaña de Dueños ---
 with tab_owners:
     st.subheader("Buscar y Ver Dueños")
-    owners = get_data("/owners/")
+    owners = list(synced["owners"].values())
     if owners:
         # --- LÓGICA DE COMPROBACIÓN (IF) ---
         # Verificamos si el primer dueño tiene los campos de M3 (que existen en M4 y M5)
@@ -171,7 +287,7 @@ with tab_owners:
 # --- Pestaña de Mascotas ---
 with tab_pets:
     st.subheader("Ver Todas las Mascotas")
-    pets = get_data("/pets/")
+    pets = list(synced["pets"].values())
     if pets:
         pet_info = []
         
@@ -217,7 +333,7 @@ with tab_pets:
 # --- Pestaña de Citas ---
 with tab_appointments:
     st.subheader("Ver Citas Programadas")
-    appointments = get_data("/appointments/pending") # Endpoint de M4
+    appointments = sorted(synced["appointments"].values(), key=lambda a: a["appointment_date"]) # Endpoint de M4
     if appointments:
         appt_info = [
             {
@@ -234,7 +350,7 @@ with tab_appointments:
 # --- Pestaña de Facturas (M4) ---
 with tab_invoices:
     st.subheader("Facturas Pendientes de Pago (M4)")
-    invoices = get_data("/invoices/pending")
+    invoices = sorted(synced["invoices"].values(), key=lambda i: i["issue_date"], reverse=True)
     if invoices:
         invoice_info = [
             {